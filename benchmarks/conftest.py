@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+from oschecks.main import App
+import oschecks.runner as runner
+
+from benchmarks.mockcloud import MockCloud
+
+
+def pytest_addoption(parser):
+    g = parser.getgroup('mockcloud', 'Mock OpenStack cloud')
+    g.addoption('--mock-latency', type=float, default=0,
+                help='Delay every mock API response by this many seconds')
+    for kind, default in (('images', 1000), ('servers', 1000),
+                          ('volumes', 1000), ('containers', 100),
+                          ('objects', 100)):
+        g.addoption('--mock-{}'.format(kind), type=int, default=default,
+                    help='Number of {} in the mock cloud'.format(kind))
+
+
+@pytest.fixture(scope='session')
+def cloud(request):
+    '''A running mock cloud, with the OS_* environment pointing at it
+    and an empty oschecks cache directory.'''
+
+    opt = request.config.getoption
+    cloud = MockCloud(latency=opt('--mock-latency'),
+                      images=opt('--mock-images'),
+                      servers=opt('--mock-servers'),
+                      volumes=opt('--mock-volumes'),
+                      containers=opt('--mock-containers'),
+                      objects=opt('--mock-objects'))
+    cloud.start()
+
+    cache_dir = tempfile.mkdtemp(prefix='oschecks-bench-')
+    saved = dict(os.environ)
+    for name in list(os.environ):
+        if name.startswith('OS_'):
+            del os.environ[name]
+    os.environ.update(cloud.environ())
+    os.environ['OSCHECKS_CACHE_DIR'] = cache_dir
+
+    yield cloud
+
+    os.environ.clear()
+    os.environ.update(saved)
+    shutil.rmtree(cache_dir)
+    cloud.stop()
+
+
+@pytest.fixture(scope='session')
+def app(cloud):
+    app = App()
+    app.options, _ = app.parser.parse_known_args([])
+    return app
+
+
+@pytest.fixture(scope='session')
+def check_runner(app):
+    return runner.CheckRunner(app)
+
+
+@pytest.fixture(scope='session')
+def daemon(cloud):
+    '''An `oschecks serve` process; yields the path to its socket.'''
+
+    path = os.path.join(os.environ['OSCHECKS_CACHE_DIR'], 'oschecks.sock')
+    proc = subprocess.Popen(
+        [sys.executable, '-c', 'import sys; from oschecks.main import cli; '
+         'sys.exit(cli())', 'serve', '--socket', path])
+
+    deadline = time.time() + 30
+    while not os.path.exists(path):
+        if time.time() > deadline or proc.poll() is not None:
+            proc.kill()
+            pytest.fail('oschecks serve did not start')
+        time.sleep(0.1)
+
+    yield path
+
+    proc.terminate()
+    proc.wait()
+
@@ -0,0 +1,874 @@
+'''A stand-in for an OpenStack cloud, for measuring oschecks' own
+overhead without the noise of a real cloud.
+
+It serves just enough of Keystone v3 (with a service catalog), Nova,
+Glance v2, Cinder and Swift for every oschecks check to run against
+it, from canned data held in memory.  Every response can be delayed by
+a fixed latency, and the number of images, servers, volumes,
+containers and objects is configurable so that list and lookup costs
+can be measured against realistically large clouds.
+
+If `notification_url` is set (to a kombu URL such as `memory://`),
+Cinder volume changes are also published as notifications on the
+`cinder` exchange when they take effect.
+
+Run it on its own with:
+
+    python -m benchmarks.mockcloud --images 50000 --latency 0.01
+
+which prints the environment variables that point oschecks at it.'''
+
+from __future__ import print_function
+
+import argparse
+import ast
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+
+try:
+    import http.server as http_server
+    import socketserver
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+    from urlparse import parse_qs, urlparse
+
+import oschecks.notifications as notifications
+
+PROJECT_ID = 'f3bbf2a5a3cb4a28a5d3eb4d8da0b4b8'
+USER_ID = '9f2d3c6a3e9c4fd0b1e3b2a1d0c9e8f7'
+
+# Volumes and servers change status this long after being created or
+# deleted.
+transition_delay = 0.2
+
+
+def isotime(when):
+    return datetime.datetime.utcfromtimestamp(when).strftime(
+        '%Y-%m-%dT%H:%M:%S.000000Z')
+
+
+def make_id(kind, i):
+    '''Return a stable UUID for the `i`th resource of a kind, so that
+    benchmarks can refer to resources by ID.'''
+
+    return str(uuid.UUID(hashlib.md5(
+        '{}-{}'.format(kind, i).encode('utf-8')).hexdigest()))
+
+
+class Route(object):
+    def __init__(self, method, pattern, func):
+        self.method = method
+        self.pattern = re.compile('^{}$'.format(pattern))
+        self.func = func
+
+
+class Response(object):
+    def __init__(self, status=200, body=None, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class MockCloud(object):
+    '''The state of the mock cloud and the handlers for its API
+    requests.  Use it like this:
+
+        cloud = MockCloud(images=50000, latency=0.01)
+        cloud.start()
+        os.environ.update(cloud.environ())
+        ...run checks...
+        cloud.stop()'''
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0,
+                 images=10, servers=10, volumes=10, flavors=5,
+                 containers=10, objects=10, object_size=1024):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.object_data = b'x' * object_size
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        self.notification_url = None
+
+        # How long volumes of each type take to create, if not
+        # transition_delay.
+        self.volume_create_delay = {}
+
+        now = time.time()
+        self.flavors = [
+            {'id': str(i + 1), 'name': 'm1.flavor{}'.format(i),
+             'ram': 512 * (i + 1), 'vcpus': i + 1, 'disk': 10 * (i + 1)}
+            for i in range(flavors)]
+        self.images = [
+            {'id': make_id('image', i), 'name': 'image-{}'.format(i),
+             'status': 'active', 'visibility': 'public',
+             'disk_format': 'qcow2', 'container_format': 'bare',
+             'size': 1024, 'checksum': None, 'tags': [],
+             'created_at': isotime(now), 'updated_at': isotime(now)}
+            for i in range(images)]
+        self.servers = [
+            {'id': make_id('server', i), 'name': 'server-{}'.format(i),
+             'status': 'ACTIVE', 'tenant_id': PROJECT_ID,
+             'flavor': {'id': '1'}, 'created': isotime(now),
+             'updated': isotime(now)}
+            for i in range(servers)]
+        self.volumes = [
+            {'id': make_id('volume', i), 'name': 'volume-{}'.format(i),
+             'status': 'available', 'size': 1,
+             'availability_zone': 'nova', 'volume_type': 'default',
+             'metadata': {}, 'created_at': isotime(now)}
+            for i in range(volumes)]
+        self.containers = dict(
+            ('container-{}'.format(i),
+             dict(('object-{}'.format(j), self.object_data)
+                  for j in range(objects)))
+            for i in range(containers))
+
+        # The data uploaded to images created by checks, by image ID.
+        self.image_data = {}
+
+        # The segments of each static large object, by (container,
+        # name); the object's data is stored as their concatenation.
+        self.manifests = {}
+
+        # Every token issued, and those that have been revoked (which
+        # are refused with a 401).
+        self.tokens = []
+        self.revoked = set()
+
+        # (when, collection, resource, changes) for each pending status
+        # change; changes of None remove the resource.
+        self.pending = []
+
+        self.routes = [
+            Route('GET', r'/', self.versions),
+            Route('GET', r'/v3/?', self.identity_version),
+            Route('POST', r'/v3/auth/tokens', self.issue_token),
+            Route('GET', r'/v3/auth/tokens', self.validate_token),
+            Route('GET', r'/compute/v2\.1/?', self.compute_version),
+            Route('GET', r'/compute/v2\.1/servers(/detail)?',
+                  self.list_servers),
+            Route('GET', r'/compute/v2\.1/servers/([^/]+)', self.get_server),
+            Route('POST', r'/compute/v2\.1/servers', self.create_server),
+            Route('DELETE', r'/compute/v2\.1/servers/([^/]+)',
+                  self.delete_server),
+            Route('GET', r'/compute/v2\.1/flavors(/detail)?',
+                  self.list_flavors),
+            Route('GET', r'/compute/v2\.1/flavors/([^/]+)', self.get_flavor),
+            Route('GET', r'/image/?', self.image_versions),
+            Route('GET', r'/image/v2/schemas/image', self.image_schema),
+            Route('GET', r'/image/v2/images', self.list_images),
+            Route('GET', r'/image/v2/images/([^/]+)', self.get_image),
+            Route('POST', r'/image/v2/images', self.create_image),
+            Route('DELETE', r'/image/v2/images/([^/]+)', self.delete_image),
+            Route('PUT', r'/image/v2/images/([^/]+)/file',
+                  self.upload_image),
+            Route('GET', r'/image/v2/images/([^/]+)/file',
+                  self.download_image),
+            Route('GET', r'/volume/v([23])/[^/]+/?', self.volume_version),
+            Route('GET', r'/volume/v[23]/[^/]+/volumes(/detail)?',
+                  self.list_volumes),
+            Route('GET', r'/volume/v[23]/[^/]+/volumes/([^/]+)',
+                  self.get_volume),
+            Route('POST', r'/volume/v[23]/[^/]+/volumes',
+                  self.create_volume),
+            Route('DELETE', r'/volume/v[23]/[^/]+/volumes/([^/]+)',
+                  self.delete_volume),
+            Route('GET', r'/object/v1/[^/]+/?', self.get_account),
+            Route('HEAD', r'/object/v1/[^/]+/?', self.head_account),
+            Route('GET', r'/object/v1/[^/]+/([^/]+)/?',
+                  self.get_container),
+            Route('HEAD', r'/object/v1/[^/]+/([^/]+)/?',
+                  self.head_container),
+            Route('GET', r'/object/v1/[^/]+/([^/]+)/(.+)',
+                  self.get_object),
+            Route('PUT', r'/object/v1/[^/]+/([^/]+)/?',
+                  self.put_container),
+            Route('DELETE', r'/object/v1/[^/]+/([^/]+)/?',
+                  self.delete_container),
+            Route('PUT', r'/object/v1/[^/]+/([^/]+)/(.+)', self.put_object),
+            Route('DELETE', r'/object/v1/[^/]+/([^/]+)/(.+)',
+                  self.delete_object),
+            Route('HEAD', r'/object/v1/[^/]+/([^/]+)/(.+)',
+                  self.head_object),
+        ]
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    @property
+    def auth_url(self):
+        return '{}/v3'.format(self.url)
+
+    def environ(self):
+        '''Return the OS_* environment variables that point the
+        OpenStack clients at this cloud.'''
+
+        return {
+            'OS_AUTH_URL': self.auth_url,
+            'OS_USERNAME': 'admin',
+            'OS_PASSWORD': 'secret',
+            'OS_PROJECT_NAME': 'admin',
+            'OS_USER_DOMAIN_NAME': 'Default',
+            'OS_PROJECT_DOMAIN_NAME': 'Default',
+            'OS_REGION_NAME': 'RegionOne',
+            'OS_IDENTITY_API_VERSION': '3',
+        }
+
+    def start(self):
+        self.server = Server((self.host, self.port), Handler, self)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def handle(self, method, path, query, body, token=None):
+        time.sleep(self.latency)
+        self.apply_transitions()
+
+        if token in self.revoked:
+            return Response(401, {'error': {
+                'code': 401, 'message': 'The request you have made '
+                'requires authentication.'}})
+
+        for route in self.routes:
+            if route.method != method:
+                continue
+
+            match = route.pattern.match(path)
+            if match:
+                return route.func(query, body, *match.groups())
+
+        return Response(404, {'error': {'code': 404,
+                                        'message': 'Not found'}})
+
+    def apply_transitions(self):
+        now = time.time()
+        with self.lock:
+            due = [p for p in self.pending if p[0] <= now]
+            self.pending = [p for p in self.pending if p[0] > now]
+
+        for when, collection, resource, changes in due:
+            if changes is None:
+                collection.remove(resource)
+            else:
+                resource.update(changes)
+                if 'updated' in resource:
+                    resource['updated'] = isotime(when)
+
+    def transition(self, collection, resource, status, delay=None,
+                   **fields):
+        '''Change the status (and any other `fields`) of `resource` after
+        `delay` seconds, or remove it from `collection` if `status` is
+        None.'''
+
+        if delay is None:
+            delay = transition_delay
+        changes = None
+        if status is not None:
+            changes = dict(fields, status=status)
+
+        with self.lock:
+            self.pending.append(
+                (time.time() + delay, collection, resource, changes))
+
+    def notify(self, event_type, payload, delay=None):
+        '''Publish a Cinder notification after `delay` seconds (when the
+        change it reports is due), if notifications are enabled.'''
+
+        if self.notification_url is None:
+            return
+
+        timer = threading.Timer(
+            transition_delay if delay is None else delay,
+            notifications.publish,
+            args=(self.notification_url, 'cinder', event_type, payload))
+        timer.daemon = True
+        timer.start()
+
+    # Keystone
+
+    def version_doc(self):
+        return {
+            'id': 'v3.14',
+            'status': 'stable',
+            'updated': '2020-04-07T00:00:00Z',
+            'links': [{'rel': 'self', 'href': '{}/'.format(self.auth_url)}],
+            'media-types': [{
+                'base': 'application/json',
+                'type': 'application/vnd.openstack.identity-v3+json'}],
+        }
+
+    def versions(self, query, body):
+        return Response(300, {'versions': {'values': [self.version_doc()]}})
+
+    def identity_version(self, query, body):
+        return Response(200, {'version': self.version_doc()})
+
+    def catalog(self):
+        services = [
+            ('identity', 'keystone', '/v3'),
+            ('compute', 'nova', '/compute/v2.1'),
+            ('image', 'glance', '/image'),
+            ('volumev2', 'cinderv2', '/volume/v2/{}'.format(PROJECT_ID)),
+            ('volumev3', 'cinderv3', '/volume/v3/{}'.format(PROJECT_ID)),
+            ('object-store', 'swift',
+             '/object/v1/AUTH_{}'.format(PROJECT_ID)),
+        ]
+
+        return [{
+            'id': make_id('service', service_type),
+            'type': service_type,
+            'name': name,
+            'endpoints': [{
+                'id': make_id('endpoint', service_type + interface),
+                'interface': interface,
+                'region': 'RegionOne',
+                'region_id': 'RegionOne',
+                'url': self.url + path,
+            } for interface in ('public', 'internal', 'admin')],
+        } for service_type, name, path in services]
+
+    def token(self):
+        now = time.time()
+        domain = {'id': 'default', 'name': 'Default'}
+        return {
+            'token': {
+                'methods': ['password'],
+                'issued_at': isotime(now),
+                'expires_at': isotime(now + 3600),
+                'user': {'id': USER_ID, 'name': 'admin', 'domain': domain},
+                'project': {'id': PROJECT_ID, 'name': 'admin',
+                            'domain': domain},
+                'roles': [{'id': make_id('role', 0), 'name': 'admin'}],
+                'catalog': self.catalog(),
+            }
+        }
+
+    def issue_token(self, query, body):
+        token = uuid.uuid4().hex
+        self.tokens.append(token)
+        return Response(201, self.token(), {'X-Subject-Token': token})
+
+    def revoke_tokens(self):
+        '''Revoke every token issued so far.'''
+
+        self.revoked.update(self.tokens)
+
+    def validate_token(self, query, body):
+        return Response(200, self.token())
+
+    # Nova
+
+    def compute_version(self, query, body):
+        return Response(200, {'version': {
+            'id': 'v2.1', 'status': 'CURRENT', 'version': '2.79',
+            'min_version': '2.1',
+            'links': [{'rel': 'self',
+                       'href': '{}/compute/v2.1/'.format(self.url)}]}})
+
+    def list_servers(self, query, body, detail=None):
+        # Like Nova, only list deleted servers when asked for changes.
+        if 'changes-since' in query:
+            servers = [s for s in self.servers
+                       if s['updated'] >= query['changes-since']]
+        else:
+            servers = [s for s in self.servers if s['status'] != 'DELETED']
+        if 'name' in query:
+            pattern = re.compile(query['name'])
+            servers = [s for s in servers if pattern.search(s['name'])]
+
+        return Response(200, {'servers': paginate(servers, query)})
+
+    def get_server(self, query, body, server_id):
+        return find([s for s in self.servers if s['status'] != 'DELETED'],
+                    server_id, 'server')
+
+    def create_server(self, query, body):
+        request = json.loads(body)['server']
+        server = {
+            'id': str(uuid.uuid4()),
+            'name': request['name'],
+            'status': 'BUILD',
+            'OS-EXT-STS:task_state': 'scheduling',
+            'tenant_id': PROJECT_ID,
+            'flavor': {'id': request['flavorRef']},
+            'image': {'id': request['imageRef']},
+            'metadata': request.get('metadata') or {},
+            'created': isotime(time.time()),
+            'updated': isotime(time.time()),
+        }
+        self.servers.append(server)
+        self.transition(self.servers, server, 'BUILD',
+                        delay=transition_delay / 2,
+                        **{'OS-EXT-STS:task_state': 'spawning'})
+        self.transition(self.servers, server, 'ACTIVE',
+                        **{'OS-EXT-STS:task_state': None})
+
+        return Response(202, {'server': {'id': server['id'],
+                                         'links': []}})
+
+    def delete_server(self, query, body, server_id):
+        for server in self.servers:
+            if server['id'] == server_id and server['status'] != 'DELETED':
+                server['OS-EXT-STS:task_state'] = 'deleting'
+                server['updated'] = isotime(time.time())
+                self.transition(self.servers, server, 'DELETED',
+                                **{'OS-EXT-STS:task_state': None})
+                return Response(204)
+
+        return Response(404, {'itemNotFound': {'code': 404,
+                                               'message': 'Not found'}})
+
+    def list_flavors(self, query, body, detail=None):
+        return Response(200, {'flavors': paginate(self.flavors, query)})
+
+    def get_flavor(self, query, body, flavor_id):
+        return find(self.flavors, flavor_id, 'flavor')
+
+    # Glance
+
+    def image_versions(self, query, body):
+        return Response(200, {'versions': [{
+            'id': 'v2.9', 'status': 'CURRENT',
+            'links': [{'rel': 'self',
+                       'href': '{}/image/v2/'.format(self.url)}]}]})
+
+    def image_schema(self, query, body):
+        return Response(200, {
+            'name': 'image',
+            'properties': {
+                'id': {'type': 'string'},
+                'name': {'type': ['null', 'string']},
+                'status': {'type': 'string'},
+                'visibility': {'type': 'string'},
+                'tags': {'type': 'array', 'items': {'type': 'string'}},
+                'size': {'type': ['null', 'integer']},
+                'checksum': {'type': ['null', 'string']},
+            },
+            'additionalProperties': {'type': 'string'},
+        })
+
+    def list_images(self, query, body):
+        images = self.images
+        if 'name' in query:
+            images = [i for i in images if i['name'] == query['name']]
+
+        page = paginate(images, query, default_limit=20)
+        doc = {'images': page}
+        if page and len(page) == int(query.get('limit', 20)):
+            doc['next'] = '/v2/images?limit={}&marker={}'.format(
+                query.get('limit', 20), page[-1]['id'])
+
+        return Response(200, doc)
+
+    def get_image(self, query, body, image_id):
+        for image in self.images:
+            if image['id'] == image_id:
+                return Response(200, image)
+
+        return Response(404, {'message': 'No image found'})
+
+    def create_image(self, query, body):
+        image = json.loads(body)
+        now = isotime(time.time())
+        image.update({
+            'id': str(uuid.uuid4()), 'status': 'queued', 'size': None,
+            'checksum': None, 'tags': [], 'created_at': now,
+            'updated_at': now,
+        })
+        self.images.append(image)
+
+        return Response(201, image)
+
+    def delete_image(self, query, body, image_id):
+        for image in self.images:
+            if image['id'] == image_id:
+                self.images.remove(image)
+                self.image_data.pop(image_id, None)
+                return Response(204)
+
+        return Response(404, {'message': 'No image found'})
+
+    def upload_image(self, query, body, image_id):
+        for image in self.images:
+            if image['id'] == image_id:
+                self.image_data[image_id] = body
+                image.update({'status': 'active', 'size': len(body),
+                              'checksum': hashlib.md5(body).hexdigest()})
+                return Response(204)
+
+        return Response(404, {'message': 'No image found'})
+
+    def download_image(self, query, body, image_id):
+        if image_id not in self.image_data:
+            return Response(404, {'message': 'No image data found'})
+
+        return Response(200, self.image_data[image_id])
+
+    # Cinder
+
+    def volume_version(self, query, body, major):
+        return Response(200, {'versions': [{
+            'id': 'v{}.0'.format(major), 'status': 'CURRENT',
+            'links': [{'rel': 'self', 'href': '{}/volume/v{}/'.format(
+                self.url, major)}]}]})
+
+    def list_volumes(self, query, body, detail=None):
+        volumes = list(self.volumes)
+        if 'name' in query:
+            volumes = [v for v in volumes if v['name'] == query['name']]
+        if 'metadata' in query:
+            metadata = ast.literal_eval(query['metadata'])
+            volumes = [v for v in volumes if all(
+                v['metadata'].get(key) == value
+                for key, value in metadata.items())]
+
+        return Response(200, {'volumes': paginate(volumes, query)})
+
+    def get_volume(self, query, body, volume_id):
+        return find(self.volumes, volume_id, 'volume')
+
+    def create_volume(self, query, body):
+        request = json.loads(body)['volume']
+        volume = {
+            'id': str(uuid.uuid4()),
+            'name': request.get('name'),
+            'status': 'creating',
+            'size': request.get('size'),
+            'availability_zone': request.get('availability_zone') or 'nova',
+            'volume_type': request.get('volume_type') or 'default',
+            'metadata': request.get('metadata') or {},
+            'created_at': isotime(time.time()),
+        }
+        self.volumes.append(volume)
+        volume['os-vol-host-attr:host'] = 'mock@{}#pool'.format(
+            volume['volume_type'])
+        delay = self.volume_create_delay.get(volume['volume_type'])
+        self.transition(self.volumes, volume, 'available', delay=delay)
+        self.notify('volume.create.end',
+                    {'volume_id': volume['id'], 'status': 'available'},
+                    delay=delay)
+
+        return Response(202, {'volume': volume})
+
+    def delete_volume(self, query, body, volume_id):
+        for volume in self.volumes:
+            if volume['id'] == volume_id:
+                if volume['status'] == 'creating':
+                    return Response(400, {'badRequest': {
+                        'code': 400, 'message': 'Invalid volume: Volume '
+                        'status must be available or error'}})
+                volume['status'] = 'deleting'
+                self.transition(self.volumes, volume, None)
+                self.notify('volume.delete.end', {'volume_id': volume_id})
+                return Response(202)
+
+        return Response(404, {'itemNotFound': {'code': 404,
+                                               'message': 'Not found'}})
+
+    # Swift
+
+    def account_headers(self):
+        return {
+            'X-Account-Container-Count': str(len(self.containers)),
+            'X-Account-Object-Count': str(sum(
+                len(objects) for objects in self.containers.values())),
+            'X-Account-Bytes-Used': str(sum(
+                len(data) for objects in self.containers.values()
+                for data in objects.values())),
+        }
+
+    def get_account(self, query, body):
+        names = sorted(self.containers)
+        if 'marker' in query:
+            names = [name for name in names if name > query['marker']]
+        if 'limit' in query:
+            names = names[:int(query['limit'])]
+
+        return Response(200, [{
+            'name': name,
+            'count': len(self.containers[name]),
+            'bytes': sum(len(data)
+                         for data in self.containers[name].values()),
+        } for name in names], self.account_headers())
+
+    def head_account(self, query, body):
+        return Response(204, None, self.account_headers())
+
+    def container_headers(self, objects):
+        return {
+            'X-Container-Object-Count': str(len(objects)),
+            'X-Container-Bytes-Used': str(sum(
+                len(data) for data in objects.values())),
+        }
+
+    def get_container(self, query, body, container):
+        if container not in self.containers:
+            return Response(404, None)
+
+        objects = self.containers[container]
+        names = sorted(objects)
+        if 'marker' in query:
+            names = [name for name in names if name > query['marker']]
+        if 'limit' in query:
+            names = names[:int(query['limit'])]
+
+        return Response(200, [{
+            'name': name,
+            'bytes': len(objects[name]),
+            'hash': hashlib.md5(objects[name]).hexdigest(),
+            'content_type': 'application/octet-stream',
+            'last_modified': isotime(time.time()),
+        } for name in names], self.container_headers(objects))
+
+    def head_container(self, query, body, container):
+        if container not in self.containers:
+            return Response(404, None)
+
+        return Response(204, None,
+                        self.container_headers(self.containers[container]))
+
+    def put_container(self, query, body, container):
+        with self.lock:
+            if container in self.containers:
+                return Response(202, None)
+            self.containers[container] = {}
+
+        return Response(201, None)
+
+    def delete_container(self, query, body, container):
+        with self.lock:
+            if container not in self.containers:
+                return Response(404, None)
+            if self.containers[container]:
+                return Response(409, None)
+            del self.containers[container]
+
+        return Response(204, None)
+
+    def object_headers(self, container, name, data):
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'ETag': hashlib.md5(data).hexdigest(),
+            'Content-Length': str(len(data)),
+        }
+        if (container, name) in self.manifests:
+            headers['X-Static-Large-Object'] = 'True'
+
+        return headers
+
+    def get_object(self, query, body, container, name):
+        data = self.containers.get(container, {}).get(name)
+        if data is None:
+            return Response(404, None)
+
+        return Response(200, data,
+                        self.object_headers(container, name, data))
+
+    def head_object(self, query, body, container, name):
+        data = self.containers.get(container, {}).get(name)
+        if data is None:
+            return Response(404, None)
+
+        return Response(200, b'',
+                        self.object_headers(container, name, data))
+
+    def put_object(self, query, body, container, name):
+        segments = None
+        if query.get('multipart-manifest') == 'put':
+            # Like Swift, refuse a manifest whose ETags or sizes don't
+            # match the segments it names.
+            entries = json.loads(body.decode('utf-8'))
+            segments = [entry['path'].lstrip('/').split('/', 1)
+                        for entry in entries]
+            try:
+                data = [self.containers[c][n] for c, n in segments]
+            except KeyError:
+                return Response(400, None)
+            for entry, segment in zip(entries, data):
+                if (entry.get('etag') not in
+                        (None, hashlib.md5(segment).hexdigest()) or
+                        entry.get('size_bytes') not in
+                        (None, len(segment))):
+                    return Response(400, None)
+            body = b''.join(data)
+
+        with self.lock:
+            if container not in self.containers:
+                return Response(404, None)
+            self.containers[container][name] = body
+            if segments is None:
+                self.manifests.pop((container, name), None)
+            else:
+                self.manifests[container, name] = segments
+
+        return Response(201, None,
+                        {'ETag': hashlib.md5(body).hexdigest()})
+
+    def delete_object(self, query, body, container, name):
+        with self.lock:
+            if name not in self.containers.get(container, {}):
+                return Response(404, None)
+            del self.containers[container][name]
+            segments = self.manifests.pop((container, name), [])
+            if query.get('multipart-manifest') == 'delete':
+                for c, n in segments:
+                    self.containers.get(c, {}).pop(n, None)
+
+        return Response(204, None)
+
+
+def paginate(items, query, default_limit=None):
+    '''Apply the `marker` and `limit` query parameters to a list of
+    resources.'''
+
+    if 'marker' in query:
+        for i, item in enumerate(items):
+            if item['id'] == query['marker']:
+                items = items[i + 1:]
+                break
+
+    limit = query.get('limit', default_limit)
+    if limit is not None:
+        items = items[:int(limit)]
+
+    return items
+
+
+def find(items, item_id, kind):
+    for item in items:
+        if item['id'] == item_id:
+            return Response(200, {kind: item})
+
+    return Response(404, {'itemNotFound': {
+        'code': 404,
+        'message': '{} {} could not be found.'.format(kind, item_id)}})
+
+
+class Handler(http_server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately; without this, delayed
+    # ACKs add 40ms to some responses.
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def respond(self, method):
+        url = urlparse(self.path)
+        query = dict((key, values[-1])
+                     for key, values in parse_qs(url.query).items())
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = self.read_chunked()
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+
+        response = self.server.cloud.handle(
+            method, url.path, query, body,
+            token=self.headers.get('X-Auth-Token'))
+
+        if isinstance(response.body, bytes):
+            data = response.body
+            content_type = 'application/octet-stream'
+        elif response.body is None:
+            data = b''
+            content_type = 'text/plain'
+        else:
+            data = json.dumps(response.body).encode('utf-8')
+            content_type = 'application/json'
+
+        self.send_response(response.status)
+        headers = {'Content-Type': content_type,
+                   'Content-Length': str(len(data))}
+        headers.update(response.headers)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        if method != 'HEAD':
+            self.wfile.write(data)
+
+    def read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                self.rfile.readline()
+                return b''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_HEAD(self):
+        self.respond('HEAD')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_PUT(self):
+        self.respond('PUT')
+
+    def do_DELETE(self):
+        self.respond('DELETE')
+
+
+class Server(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, cloud):
+        self.cloud = cloud
+        http_server.HTTPServer.__init__(self, address, handler)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=5000)
+    p.add_argument('--latency', type=float, default=0,
+                   help='Delay every response by this many seconds')
+    for kind, default in (('images', 10), ('servers', 10), ('volumes', 10),
+                          ('flavors', 5), ('containers', 10),
+                          ('objects', 10)):
+        p.add_argument('--{}'.format(kind), type=int, default=default,
+                       help='Number of {} to serve'.format(kind))
+    p.add_argument('--object-size', type=int, default=1024)
+    args = p.parse_args()
+
+    cloud = MockCloud(host=args.host, port=args.port, latency=args.latency,
+                      images=args.images, servers=args.servers,
+                      volumes=args.volumes, flavors=args.flavors,
+                      containers=args.containers, objects=args.objects,
+                      object_size=args.object_size)
+    cloud.start()
+
+    for name, value in sorted(cloud.environ().items()):
+        print('export {}={}'.format(name, value))
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        cloud.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''Tests of the token and result caches (see oschecks.cache).'''
+
+import os
+import threading
+import time
+
+import oschecks.cache as cache
+import oschecks.common as common
+
+
+def make_cache(tmpdir, **kwargs):
+    return cache.ResultCache(str(tmpdir), **kwargs)
+
+
+def test_ttl(tmpdir):
+    results = make_cache(tmpdir)
+    results.put('a', 'value', 0.2)
+
+    assert results.get('a', 0.2)['value'] == 'value'
+    time.sleep(0.3)
+    assert results.get('a', 0.2) is None
+
+
+def test_fetch_age(tmpdir):
+    results = make_cache(tmpdir)
+    key = cache.result_cache_key('a')
+
+    assert results.fetch(key, 60, lambda: 'fresh') == ('fresh', None)
+    time.sleep(0.2)
+    value, age = results.fetch(key, 60, lambda: 'not called')
+    assert value == 'fresh'
+    assert 0.2 <= age < 5
+
+
+def test_hits_do_not_write(tmpdir):
+    results = make_cache(tmpdir)
+    key = cache.result_cache_key('a')
+    results.fetch(key, 60, lambda: 'value')
+
+    paths = [results.path, results.counters.path]
+    before = [os.stat(path).st_mtime for path in paths]
+    time.sleep(0.05)
+    for i in range(10):
+        assert results.fetch(key, 60, lambda: 'not called')[1] is not None
+    assert [os.stat(path).st_mtime for path in paths] == before
+
+    # They are written out along with the next miss.
+    results.fetch(cache.result_cache_key('b'), 60, lambda: 'value')
+    assert results.counters.read()['hits'] == 10
+
+
+def test_eviction_order(tmpdir):
+    '''At capacity the results stored first are evicted, whether or
+    not they have been used since.'''
+
+    results = make_cache(tmpdir, max_entries=2)
+    results.put('a', 1, 60)
+    results.put('b', 2, 60)
+    assert results.get('a', 60)
+    results.put('c', 3, 60)
+
+    assert results.get('a', 60) is None
+    assert results.get('b', 60)['value'] == 2
+    assert results.get('c', 60)['value'] == 3
+    assert results.counters.read()['evictions'] == 1
+
+
+def test_fill_lock_timeout(tmpdir):
+    '''A caller that waits too long for another to run the same check
+    runs it itself, without caching its result.'''
+
+    results = make_cache(tmpdir)
+    key = cache.result_cache_key('a')
+    started = threading.Event()
+    release = threading.Event()
+
+    def hung():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    thread = threading.Thread(
+        target=make_cache(tmpdir).fetch, args=(key, 60, hung))
+    thread.start()
+    try:
+        started.wait(5)
+        time_start = time.time()
+        assert results.fetch(key, 60, lambda: 'fast',
+                             timeout=0.2) == ('fast', None)
+        assert time.time() - time_start < 2
+        assert results.get(key, 60) is None
+    finally:
+        release.set()
+        thread.join()
+
+    assert results.get(key, 60)['value'] == 'slow'
+    assert results.counters.read()['lock_timeouts'] == 1
+
+
+def test_token_revoked(cloud, check_runner):
+    '''A check whose cached token is rejected with a 401 evicts it,
+    authenticates again and caches the new token.'''
+
+    def run():
+        cmd, parsed_args = check_runner.prepare(['nova', 'api'])
+        try:
+            result = check_runner.check(cmd, parsed_args)
+        finally:
+            cmd.auth.close()
+        assert result.exitcode == common.RET_OKAY, str(result)
+        return cmd.auth.token_cache
+
+    token_cache = run()
+    cached = cache.read_json(token_cache.path)
+    assert cached is not None
+
+    cloud.revoke_tokens()
+    issued = len(cloud.tokens)
+    evictions = token_cache.counters.local['evictions']
+
+    token_cache = run()
+    assert len(cloud.tokens) == issued + 1
+    assert token_cache.counters.local['evictions'] == evictions + 1
+
+    replaced = cache.read_json(token_cache.path)
+    assert replaced is not None and replaced != cached
+    assert cloud.tokens[-1] in str(replaced)
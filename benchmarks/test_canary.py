@@ -0,0 +1,61 @@
+'''Tests of the cleanup of checks that create several resources at once
+(see oschecks.canary), using volumes that are slow to create.'''
+
+import time
+
+import pytest
+
+import oschecks.common as common
+
+from benchmarks.test_checks import cinder, run_check
+
+
+@pytest.fixture
+def slow_volumes(cloud):
+    cloud.volume_create_delay['glacial'] = 1.5
+    yield cloud
+    del cloud.volume_create_delay['glacial']
+
+
+def run_stress(check_runner):
+    return run_check(check_runner, [
+        'cinder', 'volume', 'stress', '--volume-type', 'glacial',
+        '--volume-count', '2', '--volume-ready-timeout', '1',
+        '--name', 'glacial'] + cinder)
+
+
+def leftovers(cloud):
+    # Deleted volumes are removed after a short delay.
+    time.sleep(0.5)
+    cloud.apply_transitions()
+    return [volume for volume in cloud.volumes
+            if volume['name'].startswith('glacial-')]
+
+
+def test_cleanup_waits_for_creating(slow_volumes, check_runner):
+    '''Volumes still being created when the check gives up on them are
+    deleted once they are created.'''
+
+    result = run_stress(check_runner)
+
+    assert result.exitcode == common.RET_CRIT
+    assert '2 of 2 volumes failed' in result.msg
+    assert 'Failed to delete' not in result.msg
+    assert not leftovers(slow_volumes)
+
+
+def test_cleanup_reports_leaked(slow_volumes, check_runner):
+    '''Volumes that are still being created when the cleanup gives up
+    are reported.'''
+
+    slow_volumes.volume_create_delay['glacial'] = 3
+    try:
+        result = run_stress(check_runner)
+    finally:
+        time.sleep(3)
+        for volume in leftovers(slow_volumes):
+            slow_volumes.volumes.remove(volume)
+
+    assert result.exitcode == common.RET_CRIT
+    assert 'Failed to delete 2 test volumes' in result.msg
+    assert '(creating)' in result.msg
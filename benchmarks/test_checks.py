@@ -0,0 +1,270 @@
+'''Benchmarks for every command in the oschecks.check entry point group,
+run against the mock cloud.  Run them with:
+
+    pytest benchmarks --mock-images 50000
+
+and compare runs with pytest-benchmark's --benchmark-autosave and
+--benchmark-compare options.'''
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+import pytest
+
+import oschecks.client as client
+import oschecks.common as common
+import oschecks.openstack as openstack
+
+from benchmarks.mockcloud import make_id
+
+# The python-cinderclient releases that are current at the time of
+# writing no longer support the v2 API.
+cinder = ['--os-volume-api-version', '3']
+
+# The arguments to benchmark each command with.  Every command in
+# setup.cfg must be listed here.
+commands = {
+    'keystone api': [],
+    'keystone service exists': ['compute'],
+    'keystone service alive': ['compute'],
+    'nova api': [],
+    'nova flavor exists': ['1'],
+    'nova server exists': ['server-500'],
+    'nova server create-delete': ['--flavor', '1', '--image', 'image-1',
+                                  '--server-count', '3'],
+    'cinder api': cinder,
+    'cinder volume exists': ['volume-500'] + cinder,
+    'cinder volume create-delete': cinder,
+    'cinder volume stress': ['--volume-type', 'fast', '--volume-type',
+                             'slow'] + cinder,
+    'glance api': [],
+    'glance image exists': ['image-500'],
+    'glance image create-delete': ['1'],
+    'swift api': [],
+    'swift container exists': ['container-50'],
+    'swift object exists': ['container-50', 'object-50'],
+    'swift object create-delete': ['--segment-size', '0.25', '1'],
+    'startup time': ['--repeat', '1', 'nova api'],
+    'batch': ['--workers', '4'],
+    'bench': ['--iterations', '5', 'nova api'],
+    'serve': ['nova', 'api'],
+    'schedule': ['--interval', '0.5', '--duration', '2'],
+    'export': ['--interval', '0.5', '--listen-address', '127.0.0.1'],
+}
+
+# Commands that aren't checks, and are benchmarked separately.
+tools = ('batch', 'bench', 'serve', 'schedule', 'export')
+
+# Lookups by ID as well as by name.
+lookups = [
+    ('nova server exists', [make_id('server', 500)]),
+    ('cinder volume exists', [make_id('volume', 500)] + cinder),
+    ('glance image exists', [make_id('image', 500)]),
+]
+
+# Counting every resource a page at a time rather than listing one.
+counts = [
+    ('nova api', ['--count']),
+    ('cinder api', ['--count'] + cinder),
+    ('glance api', ['--count']),
+]
+
+
+def entry_points():
+    setup_cfg = os.path.join(os.path.dirname(__file__), '..', 'setup.cfg')
+    config = configparser.ConfigParser()
+    config.read(setup_cfg)
+
+    return set(line.split('=')[0].strip()
+               for line in config.get('entry_points',
+                                      'oschecks.check').splitlines()
+               if line.strip())
+
+
+def argv_for(name):
+    return name.split() + commands[name]
+
+
+def run_check(check_runner, argv):
+    '''Run a check the way `oschecks` does, including formatting its
+    output, but without starting a new process.'''
+
+    cmd, parsed_args = check_runner.prepare(argv)
+    try:
+        result = check_runner.check(cmd, parsed_args)
+        str(result)
+    finally:
+        if getattr(cmd, 'auth', None) is not None:
+            cmd.auth.close()
+
+    return result
+
+
+def test_every_command_is_benchmarked():
+    assert entry_points() == set(commands)
+
+
+@pytest.mark.parametrize('name', sorted(set(commands) - set(tools)))
+def test_check(benchmark, cloud, check_runner, name):
+    result = benchmark(run_check, check_runner, argv_for(name))
+    assert result.exitcode == common.RET_OKAY, str(result)
+
+
+@pytest.mark.parametrize('name,args', lookups,
+                         ids=[name for name, args in lookups])
+def test_lookup_by_id(benchmark, cloud, check_runner, name, args):
+    result = benchmark(run_check, check_runner, name.split() + args)
+    assert result.exitcode == common.RET_OKAY, str(result)
+
+
+@pytest.mark.parametrize('name,args', counts,
+                         ids=[name for name, args in counts])
+def test_count(benchmark, cloud, check_runner, name, args):
+    result = benchmark(run_check, check_runner, name.split() + args)
+    assert result.exitcode == common.RET_OKAY, str(result)
+    assert 'more than' not in result.msg
+
+
+@pytest.mark.parametrize('name', sorted(set(commands) - set(tools)))
+def test_process(benchmark, cloud, name):
+    '''Run each check in a new process, as Nagios would, to include
+    interpreter startup and imports.'''
+
+    argv = [sys.executable, '-c',
+            'import sys; from oschecks.main import cli; sys.exit(cli())']
+    argv += argv_for(name)
+
+    exitcode = benchmark.pedantic(subprocess.call, args=(argv,),
+                                  kwargs={'stdout': subprocess.PIPE},
+                                  rounds=3)
+    assert exitcode == common.RET_OKAY
+
+
+def test_batch(benchmark, app, tmpdir):
+    manifest = tmpdir.join('manifest.yaml')
+    manifest.write('checks:\n' + ''.join(
+        '  - {}\n'.format(' '.join(argv_for(name)))
+        for name in sorted(commands)
+        if name not in tools and name != 'startup time'))
+
+    exitcode = benchmark(app.run, ['batch'] + commands['batch'] +
+                         [str(manifest)])
+    assert exitcode == common.RET_OKAY
+
+
+def test_schedule(benchmark, app, tmpdir):
+    manifest = tmpdir.join('manifest.yaml')
+    manifest.write('checks: [nova api, glance api, keystone api]\n')
+    output = tmpdir.join('results')
+
+    exitcode = benchmark.pedantic(
+        app.run, args=(['schedule'] + commands['schedule'] +
+                       ['--output', str(output), str(manifest)],),
+        rounds=1)
+    assert not exitcode
+
+    lines = output.readlines()
+    assert len(lines) >= 6
+    assert all(';0;OKAY: ' in line for line in lines)
+
+
+def free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def fetch(url):
+    return urlopen(url, timeout=10).read().decode('utf-8')
+
+
+def test_export(benchmark, cloud, tmpdir):
+    '''Scrape an `oschecks export` process once every check has
+    reported; scrapes should cost no more than serving a page.'''
+
+    manifest = tmpdir.join('manifest.yaml')
+    manifest.write('checks: [nova api, glance api, keystone api]\n')
+    port = free_port()
+    url = 'http://127.0.0.1:{}/metrics'.format(port)
+
+    proc = subprocess.Popen(
+        [sys.executable, '-c', 'import sys; from oschecks.main import cli; '
+         'sys.exit(cli())', 'export'] + commands['export'] +
+        ['--port', str(port), str(manifest)])
+    try:
+        deadline = time.time() + 30
+        while True:
+            assert time.time() < deadline and proc.poll() is None
+            try:
+                page = fetch(url)
+            except IOError:
+                page = ''
+            if page.count('oschecks_check_status{') == 3:
+                break
+            time.sleep(0.1)
+
+        page = benchmark(fetch, url)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    assert 'oschecks_check_status{check="nova api"} 0' in page
+    assert 'oschecks_check_duration_seconds_count{check="nova api"}' in page
+    assert 'le="+Inf"' in page
+    assert 'oschecks_token_cache_events_total' in page
+
+
+def test_bench(benchmark, app):
+    exitcode = benchmark(app.run, ['bench'] + commands['bench'])
+    assert not exitcode
+
+
+def test_serve(benchmark, daemon):
+    response = benchmark(client.request, daemon, commands['serve'],
+                         timeout=60)
+    assert response['exitcode'] == common.RET_OKAY, response['output']
+
+
+@pytest.mark.parametrize('token_cache', [False, True],
+                         ids=['no-token-cache', 'token-cache'])
+def test_auth(benchmark, cloud, check_runner, token_cache):
+    cmd, parsed_args = check_runner.prepare(['keystone', 'api'])
+    parsed_args.token_cache = token_cache
+
+    def authenticate():
+        openstack.Openstack(parsed_args).close()
+
+    benchmark(authenticate)
+
+
+@pytest.mark.parametrize('fmt', ['text', 'json'])
+def test_format(benchmark, fmt):
+    result = common.Result(common.RET_OKAY, 'Found 1 servers\nDetails')
+    result.format = fmt
+    result.add_perfdata('time', 0.1234, 's', warning=5, critical=10,
+                        minimum=0)
+    with common.span('nova api') as root:
+        with common.span('auth'):
+            common.record_span('POST http://keystone/v3/auth/tokens 201',
+                               0.05)
+        with common.span('list servers'):
+            common.record_span('GET http://nova/v2.1/servers 200', 0.07)
+    result.phases = root.children
+
+    benchmark(str, result)
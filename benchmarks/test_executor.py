@@ -0,0 +1,54 @@
+'''Tests of oschecks.executor's handling of tasks that time out.'''
+
+import threading
+import time
+
+import pytest
+
+import oschecks.executor as executor
+
+
+def test_timeout_is_measured_from_start():
+    '''Time spent queued for a worker doesn't count against a task.'''
+
+    with executor.Executor(workers=1) as pool:
+        first = pool.submit(time.sleep, 0.3, timeout=1)
+        second = pool.submit(time.sleep, 0.3, timeout=0.5)
+        first.result()
+        second.result()
+
+
+def test_timed_out_task_does_not_starve_queue():
+    '''A task queued behind one that times out still runs, on a
+    worker started in place of the one that was abandoned.'''
+
+    release = threading.Event()
+    with executor.Executor(workers=1) as pool:
+        hung = pool.submit(release.wait, 3, timeout=0.5)
+        quick = pool.submit(lambda: 'done', timeout=0.5)
+
+        time_start = time.time()
+        with pytest.raises(executor.TimeoutError):
+            hung.result()
+        assert quick.result() == 'done'
+        assert time.time() - time_start < 1
+
+        # The abandoned worker exits once its task finishes, leaving
+        # the pool at its size.
+        release.set()
+        deadline = time.time() + 5
+        while len(pool.threads) > 1 and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(pool.threads) == 1
+
+
+def test_cancel():
+    release = threading.Event()
+    with executor.Executor(workers=1) as pool:
+        running = pool.submit(release.wait, 5)
+        queued = pool.submit(lambda: 'not run')
+        assert queued.cancel()
+        release.set()
+        assert running.result()
+        with pytest.raises(executor.CancelledError):
+            queued.result()
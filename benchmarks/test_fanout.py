@@ -0,0 +1,64 @@
+'''Tests of checks run against several clouds at once (see
+oschecks.openstack.OpenstackAuthCommand.get_fanout_result).'''
+
+import threading
+import time
+
+import oschecks.common as common
+
+
+def test_fanout(check_runner, monkeypatch):
+    '''The worst result wins, each target's perfdata is labelled with
+    its name, and a target still running at the deadline is CRITICAL
+    without being waited for.'''
+
+    cmd, parsed_args = check_runner.prepare(['nova', 'api', '-c', '1'])
+    release = threading.Event()
+
+    def check_target(parsed_args, cloud, region):
+        if cloud == 'hung':
+            release.wait(5)
+        result = common.Result(
+            common.RET_CRIT if cloud == 'broken' else common.RET_OKAY,
+            'Found 1 servers')
+        result.add_perfdata('time', 0.1, 's')
+        return result
+
+    monkeypatch.setattr(cmd, 'check_target', check_target)
+    targets = [('good', 'RegionOne'), ('broken', None), ('hung', None)]
+
+    time_start = time.time()
+    try:
+        result = cmd.get_fanout_result(parsed_args, targets)
+    finally:
+        release.set()
+
+    assert time.time() - time_start < 3
+    assert result.exitcode == common.RET_CRIT
+    lines = result.msg.splitlines()
+    assert lines[0] == '1 of 3 clouds OK'
+    assert lines[1] == 'good/RegionOne: OKAY: Found 1 servers'
+    assert lines[2] == 'broken: CRITICAL: Found 1 servers'
+    assert lines[3] == ('hung: CRITICAL: Check did not finish within '
+                        '1 seconds')
+    assert [perf.label for perf in result.perfdata] == [
+        'good/RegionOne time', 'broken time']
+
+
+def test_fanout_clouds(check_runner, monkeypatch):
+    '''Giving --cloud more than once checks each of the clouds.'''
+
+    cmd, parsed_args = check_runner.prepare(
+        ['nova', 'api', '--cloud', 'a', '--cloud', 'b'])
+    checked = []
+
+    def check_target(parsed_args, cloud, region):
+        checked.append((cloud, region))
+        return common.Result(common.RET_OKAY, 'Found 1 servers')
+
+    monkeypatch.setattr(cmd, 'check_target', check_target)
+
+    result = cmd.get_result(parsed_args)
+    assert sorted(checked) == [('a', None), ('b', None)]
+    assert result.exitcode == common.RET_OKAY
+    assert result.msg.splitlines()[0] == '2 of 2 clouds OK'
@@ -0,0 +1,43 @@
+'''Tests of reading batch and schedule manifests (see
+oschecks.runner.load_manifest).'''
+
+import pytest
+
+import oschecks.runner as runner
+
+
+def load(tmpdir, content):
+    manifest = tmpdir.join('manifest.yaml')
+    manifest.write(content)
+    return runner.load_manifest(str(manifest))
+
+
+def test_manifest(tmpdir):
+    jobs = load(tmpdir, '''
+defaults: --cloud mycloud
+checks:
+  - nova api
+  - check: [glance, image, exists, cirros]
+    name: cirros image
+    interval: 30
+''')
+
+    assert [job.argv for job in jobs] == [
+        ['nova', 'api', '--cloud', 'mycloud'],
+        ['glance', 'image', 'exists', 'cirros', '--cloud', 'mycloud']]
+    assert [job.name for job in jobs] == ['nova api', 'cirros image']
+    assert jobs[1].options == {'interval': 30}
+
+
+@pytest.mark.parametrize('content', [
+    '',
+    '- nova api\n',
+    'defaults: [--cloud, mycloud]\n',
+    'checks:\n',
+    'checks: nova api\n',
+    'checks:\n  - name: no check\n',
+], ids=['empty', 'list', 'no checks', 'checks empty', 'checks string',
+        'entry without check'])
+def test_invalid_manifest(tmpdir, content):
+    with pytest.raises(runner.ManifestError):
+        load(tmpdir, content)
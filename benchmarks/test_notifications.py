@@ -0,0 +1,69 @@
+'''Benchmarks for waiting on volume status changes with notifications
+(see oschecks.notifications), using an in-process `memory://` broker
+that the mock cloud publishes Cinder notifications to.'''
+
+import pytest
+
+import oschecks.common as common
+
+from benchmarks.test_checks import cinder
+
+pytest.importorskip('kombu')
+
+url = 'memory://'
+
+
+@pytest.fixture
+def notifying_cloud(cloud):
+    cloud.notification_url = url
+    yield cloud
+    cloud.notification_url = None
+
+
+def create_delete(check_runner, args):
+    '''Run `cinder volume create-delete` listening for notifications, and
+    return the command (which holds the transitions it waited for) and
+    the result.'''
+
+    cmd, parsed_args = check_runner.prepare(
+        ['cinder', 'volume', 'create-delete', '--notification-url', url] +
+        cinder + args)
+    try:
+        result = check_runner.check(cmd, parsed_args)
+    finally:
+        if getattr(cmd, 'auth', None) is not None:
+            cmd.auth.close()
+
+    return cmd, result
+
+
+def test_notifications(benchmark, notifying_cloud, check_runner):
+    '''With notifications arriving, each wait ends on the event without
+    polling the API again, long before the fallback would poll.'''
+
+    cmd, result = benchmark.pedantic(
+        create_delete,
+        args=(check_runner, ['--notification-fallback', '30']),
+        rounds=1)
+
+    assert result.exitcode == common.RET_OKAY, str(result)
+    assert cmd.listener is not None
+    assert sorted(cmd.transitions) == ['create', 'delete']
+    for name, transition in cmd.transitions.items():
+        assert transition.polls == 1, name
+        assert transition.interval < 5, name
+
+
+def test_notification_fallback(benchmark, cloud, check_runner):
+    '''With no notifications, the check still finishes by polling.'''
+
+    cmd, result = benchmark.pedantic(
+        create_delete,
+        args=(check_runner, ['--notification-fallback', '0.1']),
+        rounds=1)
+
+    assert result.exitcode == common.RET_OKAY, str(result)
+    assert cmd.listener is not None
+    assert sorted(cmd.transitions) == ['create', 'delete']
+    for name, transition in cmd.transitions.items():
+        assert transition.polls > 1, name
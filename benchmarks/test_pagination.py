@@ -0,0 +1,92 @@
+'''Tests of counting resources a page at a time (see
+oschecks.pagination).'''
+
+import pytest
+
+import oschecks.pagination as pagination
+
+
+class Item(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class API(object):
+    '''Serves `total` items by marker, recording every request.'''
+
+    def __init__(self, total):
+        self.items = [Item(i) for i in range(total)]
+        self.calls = []
+
+    def __call__(self, marker, limit):
+        self.calls.append((marker, limit))
+        start = 0 if marker is None else marker + 1
+        return iter(self.items[start:start + limit])
+
+
+def listed(api, **kwargs):
+    return [item.id for item in pagination.paginate(api, **kwargs)]
+
+
+def test_empty():
+    api = API(0)
+    assert listed(api, page_size=10) == []
+    assert api.calls == [(None, 10)]
+
+
+def test_pages():
+    api = API(25)
+    assert listed(api, page_size=10) == list(range(25))
+    assert api.calls == [(None, 10), (9, 10), (19, 10)]
+
+
+def test_exact_pages():
+    '''When the last page is full, one more (empty) page is asked for
+    after its marker.'''
+
+    api = API(20)
+    assert listed(api, page_size=10) == list(range(20))
+    assert api.calls == [(None, 10), (9, 10), (19, 10)]
+
+
+def test_limit_smaller_than_page():
+    api = API(100)
+    assert listed(api, page_size=10, limit=3) == [0, 1, 2]
+    assert api.calls == [(None, 3)]
+
+
+def test_limit_at_page_boundary():
+    '''Listing stops at the limit without asking for another page.'''
+
+    api = API(100)
+    assert listed(api, page_size=10, limit=20) == list(range(20))
+    assert api.calls == [(None, 10), (9, 10)]
+
+
+def test_limit_within_page():
+    api = API(100)
+    assert listed(api, page_size=10, limit=15) == list(range(15))
+    assert api.calls == [(None, 10), (9, 5)]
+
+
+def test_marker_of():
+    api = API(5)
+    names = pagination.paginate(
+        lambda marker, limit: api(None if marker is None
+                                  else int(marker), limit),
+        page_size=2, marker_of=lambda item: str(item.id))
+    assert [item.id for item in names] == list(range(5))
+
+
+@pytest.mark.parametrize('total,cap,expected', [
+    (0, None, '0'),
+    (5, None, '5'),
+    (5, 5, '5'),
+    (6, 5, 'more than 5'),
+    (0, 0, '0'),
+    (1, 0, 'more than 0'),
+])
+def test_count(total, cap, expected):
+    found = pagination.count(iter(range(total)), cap=cap)
+    assert str(found) == expected
+    assert found.complete == (expected == str(total))
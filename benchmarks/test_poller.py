@@ -0,0 +1,115 @@
+'''Tests of waiting for many resources with one listing per poll (see
+oschecks.poller).'''
+
+import threading
+import time
+
+import pytest
+
+import oschecks.executor as executor
+import oschecks.poller as poller
+import oschecks.waiter as waiter
+
+
+class Resource(object):
+    def __init__(self, id, status, updated):
+        self.id = id
+        self.status = status
+        self.updated = updated
+
+
+class Listing(object):
+    '''A fake API listing, recording the `since` of every call.'''
+
+    def __init__(self, resources):
+        self.resources = dict((r.id, r) for r in resources)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def update(self, resource_id, status, updated):
+        with self.lock:
+            self.resources[resource_id] = Resource(resource_id, status,
+                                                   updated)
+
+    def __call__(self, since):
+        with self.lock:
+            self.calls.append(since)
+            return [r for r in self.resources.values()
+                    if since is None or r.updated > since]
+
+
+def fast_waiter():
+    return waiter.Waiter(initial=0.02, maximum=0.05, jitter=0)
+
+
+def test_changes_since():
+    '''Waits on several resources share each listing, and every listing
+    after the first asks only for what changed since the newest change
+    seen.'''
+
+    ids = ['vol-{}'.format(i) for i in range(5)]
+    listing = Listing([Resource(i, 'creating', '2020-01-01T00:00:00')
+                       for i in ids])
+    tracker = poller.Poller(listing, changes_since=True,
+                            status_waiter=fast_waiter())
+
+    def finish():
+        time.sleep(0.2)
+        for n, resource_id in enumerate(ids):
+            listing.update(resource_id, 'available',
+                           '2020-01-01T00:00:0{}'.format(n + 1))
+
+    thread = threading.Thread(target=finish)
+    thread.start()
+    with executor.Executor(workers=len(ids)) as pool:
+        transitions = [task.result() for task in [
+            pool.submit(tracker.wait, resource_id, 'available', timeout=5)
+            for resource_id in ids]]
+    thread.join()
+
+    assert all(t.interval >= 0.1 for t in transitions)
+    assert len(listing.calls) < sum(t.polls for t in transitions)
+    # Until every waiter is watching there may be more than one full
+    # listing, but after that only changes are asked for.
+    assert listing.calls[0] is None
+    assert listing.calls[-1] is not None
+    since = [call for call in listing.calls if call is not None]
+    assert since == sorted(since)
+    assert tracker.since == '2020-01-01T00:00:05'
+
+
+def test_missing():
+    '''A resource absent from a full listing is given the `missing`
+    status.'''
+
+    tracker = poller.Poller(Listing([]), status_waiter=fast_waiter())
+    assert tracker.wait('vol-0', 'deleted', timeout=1).polls == 1
+
+
+def test_listing_fails():
+    '''A failed listing is raised to the waiter that made it, and the
+    others are woken to try again rather than sleeping until their
+    timeout.'''
+
+    listing = Listing([Resource('vol-0', 'available', None)])
+    polling = threading.Event()
+
+    def list_resources(since):
+        if not polling.is_set():
+            polling.set()
+            time.sleep(0.3)
+            raise RuntimeError('listing failed')
+        return listing(since)
+
+    tracker = poller.Poller(list_resources, status_waiter=fast_waiter())
+    with executor.Executor(workers=2) as pool:
+        first = pool.submit(tracker.wait, 'vol-0', 'available', timeout=10)
+        polling.wait(5)
+        time_start = time.time()
+        second = pool.submit(tracker.wait, 'vol-0', 'available',
+                             timeout=10)
+
+        with pytest.raises(RuntimeError):
+            first.result()
+        assert second.result().status == 'available'
+        assert time.time() - time_start < 2
@@ -0,0 +1,86 @@
+'''Tests of the scheduling behind `oschecks schedule` and `oschecks
+export` (see oschecks.scheduler).'''
+
+import threading
+import time
+
+import oschecks.common as common
+import oschecks.runner as runner
+import oschecks.scheduler as scheduler
+
+
+def test_jitter_bounds(check_runner):
+    jobs = [runner.Job(['nova', 'api'], name=str(i)) for i in range(50)]
+    time_start = time.time()
+    sched = scheduler.Scheduler(check_runner, jobs, None, interval=10,
+                                jitter=0.2)
+
+    # Each job first runs at a random point in its first interval.
+    for entry in sched.entries:
+        assert time_start <= entry.due <= time.time() + 10
+
+    intervals = [sched.next_interval(sched.entries[0])
+                 for i in range(1000)]
+    assert all(8 <= interval <= 12 for interval in intervals)
+    assert max(intervals) - min(intervals) > 2
+
+
+def test_token_bucket():
+    bucket = scheduler.TokenBucket(rate=2, burst=3)
+    now = bucket.time_last
+
+    # A burst, then one every 1/rate seconds.
+    assert [bucket.take(now) for i in range(3)] == [0, 0, 0]
+    assert abs(bucket.take(now) - 0.5) < 1e-9
+    assert bucket.take(now + 0.25) > 0
+    assert bucket.take(now + 0.5) == 0
+
+    # Over a long run the rate holds, whatever the burst.
+    taken = sum(1 for i in range(1000)
+                if bucket.take(now + 0.5 + i * 0.01) == 0)
+    assert 19 <= taken <= 21
+
+
+class HungRunner(runner.CheckRunner):
+    '''Runs checks that don't return until `release` is set.'''
+
+    def __init__(self, app):
+        super(HungRunner, self).__init__(app)
+        self.release = threading.Event()
+        self.started = []
+
+    def check(self, cmd, parsed_args):
+        self.started.append(time.time())
+        self.release.wait(10)
+        return common.Result(common.RET_OKAY, 'done')
+
+
+def test_hung_check_keeps_slot(app):
+    '''A check reported as CRITICAL at its deadline is not run again,
+    and keeps its worker, until it actually returns.'''
+
+    hung = HungRunner(app)
+    results = []
+    jobs = [runner.Job(['nova', 'api', '-c', '1'], name='hung')]
+    sched = scheduler.Scheduler(
+        hung, jobs, lambda entry, result: results.append(result),
+        interval=0.1, jitter=0, workers=1, grace=5)
+
+    thread = threading.Thread(target=sched.run)
+    thread.start()
+    try:
+        time.sleep(2)
+        assert len(hung.started) == 1
+        assert [result.exitcode for result in results] == [
+            common.RET_CRIT]
+        assert not sched.slots.acquire(blocking=False)
+
+        hung.release.set()
+        time.sleep(0.5)
+    finally:
+        hung.release.set()
+        sched.stop()
+        thread.join()
+
+    assert len(hung.started) > 1
+    assert common.RET_OKAY in [result.exitcode for result in results]
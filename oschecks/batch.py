@@ -0,0 +1,54 @@
+from __future__ import print_function
+
+import cliff.command
+import json
+
+import oschecks.common as common
+import oschecks.openstack as openstack
+import oschecks.runner as runner
+
+
+class Batch(cliff.command.Command):
+    '''Run every check listed in a manifest in a single process.  Checks
+    with the same authentication options share one Openstack session,
+    and with --workers several checks run at once.  Prints one result
+    per check, in manifest order, and exits with the most severe of
+    their exit codes.'''
+
+    def get_parser(self, prog_name):
+        p = super(Batch, self).get_parser(prog_name)
+        p.add_argument('--workers', '-j', type=int, default=1,
+                       help='Number of checks to run concurrently')
+        p.add_argument('--format', '-f', choices=['text', 'json'],
+                       default='text',
+                       help='Print one line per check, or one JSON '
+                       'document per check')
+        p.add_argument('manifest')
+
+        return p
+
+    def take_action(self, parsed_args):
+        try:
+            jobs = runner.load_manifest(parsed_args.manifest)
+        except runner.ManifestError as exc:
+            print('UNKNOWN: {}'.format(exc))
+            return common.RET_WTF
+
+        self.app.session_pool = openstack.SessionPool()
+        check_runner = runner.CheckRunner(self.app, self.app_args)
+
+        try:
+            results = check_runner.run_all(jobs, workers=parsed_args.workers)
+        finally:
+            self.app.session_pool.close()
+
+        for job, result in zip(jobs, results):
+            if parsed_args.format == 'json':
+                doc = result.as_dict()
+                doc['name'] = job.name
+                print(json.dumps(doc, sort_keys=True))
+            else:
+                print('{}: {}'.format(job.name, result.as_text()))
+
+        return common.worst_exitcode(
+            [result.exitcode for result in results])
@@ -0,0 +1,183 @@
+from __future__ import print_function
+
+import argparse
+import cliff.command
+import collections
+import json
+import threading
+import time
+
+import oschecks.common as common
+import oschecks.executor as executor
+import oschecks.openstack as openstack
+import oschecks.runner as runner
+import oschecks.stats as stats
+
+
+class Sample(object):
+    '''The outcome of one run of the check being benchmarked.'''
+
+    def __init__(self, exitcode, latency, auth=None):
+        self.exitcode = exitcode
+        self.latency = latency
+        self.auth = auth
+
+
+def auth_time(result):
+    '''Return the time spent authenticating during a check, from its
+    phases, or None if it didn't authenticate.'''
+
+    for phase in result.phases:
+        if phase.name == 'auth':
+            return phase.interval
+
+
+class Bench(cliff.command.Command):
+    '''Run a check over and over and report how its latency is
+    distributed, for capacity planning rather than alerting.  Runs
+    stop after --iterations runs or --duration seconds, whichever
+    comes first; --iterations 0 means no limit, and needs --duration.
+
+    By default every run shares one authenticated session, as in
+    `oschecks serve`, so only the first run pays for authentication.
+    With --reauth every run authenticates from scratch (bypassing the
+    token cache), and the time spent authenticating is reported
+    separately.'''
+
+    def get_parser(self, prog_name):
+        p = super(Bench, self).get_parser(prog_name)
+        p.add_argument('--iterations', '-n', type=int, default=10,
+                       help='Number of times to run the check (0 for no '
+                       'limit, with --duration)')
+        p.add_argument('--duration', '-d', type=float,
+                       help='Stop starting new runs after this many '
+                       'seconds')
+        p.add_argument('--concurrency', '-j', type=int, default=1,
+                       help='Number of runs in flight at once')
+        p.add_argument('--reauth', action='store_true',
+                       help='Authenticate on every run instead of '
+                       'reusing one session')
+        p.add_argument('--format', '-f', choices=['text', 'json'],
+                       default='text')
+        p.add_argument('check', nargs=argparse.REMAINDER,
+                       help='A check and its arguments, e.g. "nova api"')
+
+        return p
+
+    def worker(self, check_runner, parsed_args, claim):
+        '''Prepare a command of our own (commands keep per-run state, so
+        workers can't share one) and run it until `claim` says to
+        stop.'''
+
+        cmd, check_args = check_runner.prepare(parsed_args.check)
+        check_args.cache_ttl = 0
+        if parsed_args.reauth and hasattr(check_args, 'token_cache'):
+            check_args.token_cache = False
+
+        samples = []
+        while claim():
+            with common.Timer() as t:
+                result = check_runner.check(cmd, check_args)
+
+            if parsed_args.reauth and getattr(cmd, 'auth', None):
+                cmd.auth.close()
+
+            samples.append(Sample(result.exitcode, t.interval,
+                                  auth_time(result)))
+
+        return samples
+
+    def take_action(self, parsed_args):
+        if not parsed_args.check:
+            raise ValueError('no check given')
+        if parsed_args.iterations < 0:
+            raise ValueError('--iterations must not be negative')
+        if not parsed_args.iterations and not parsed_args.duration:
+            raise ValueError('--iterations 0 (no limit) needs --duration')
+
+        if not parsed_args.reauth:
+            self.app.session_pool = openstack.SessionPool()
+        check_runner = runner.CheckRunner(self.app, self.app_args)
+
+        # Check the command line once up front, so that a typo is
+        # reported once rather than by every worker.
+        check_runner.prepare(parsed_args.check)
+
+        lock = threading.Lock()
+        claimed = [0]
+        deadline = None
+        if parsed_args.duration:
+            deadline = time.time() + parsed_args.duration
+
+        def claim():
+            with lock:
+                if (parsed_args.iterations and
+                        claimed[0] >= parsed_args.iterations):
+                    return False
+                if deadline is not None and time.time() >= deadline:
+                    return False
+                claimed[0] += 1
+                return True
+
+        samples = []
+        try:
+            with common.Timer() as t:
+                with executor.Executor(
+                        workers=parsed_args.concurrency) as pool:
+                    tasks = [pool.submit(self.worker, check_runner,
+                                         parsed_args, claim)
+                             for i in range(parsed_args.concurrency)]
+                    for task in tasks:
+                        samples.extend(task.result())
+        finally:
+            if getattr(self.app, 'session_pool', None) is not None:
+                self.app.session_pool.close()
+
+        latency = stats.Summary(sample.latency for sample in samples)
+        auth = stats.Summary(sample.auth for sample in samples
+                             if sample.auth is not None)
+        histogram = stats.Histogram()
+        histogram.update(sample.latency for sample in samples)
+
+        exitcodes = collections.Counter(
+            common.exitcodes.labels.get(sample.exitcode, 'UNKNOWN')
+            for sample in samples)
+        errors = sum(count for label, count in exitcodes.items()
+                     if label != 'OKAY')
+
+        report = {
+            'check': ' '.join(parsed_args.check),
+            'concurrency': parsed_args.concurrency,
+            'reauth': parsed_args.reauth,
+            'iterations': len(samples),
+            'elapsed': t.interval,
+            'throughput': len(samples) / t.interval if t.interval else None,
+            'errors': errors,
+            'error_rate': float(errors) / len(samples) if samples else None,
+            'exitcodes': dict(exitcodes),
+            'latency': latency.as_dict(),
+            'auth': auth.as_dict(),
+            'histogram': histogram.as_dict(),
+        }
+
+        if parsed_args.format == 'json':
+            print(json.dumps(report, sort_keys=True))
+            return
+
+        print('{check}: {iterations} runs in {elapsed:0.2f} seconds '
+              'with concurrency {concurrency}'.format(**report))
+        if not samples:
+            return
+
+        print('throughput: {:0.2f} runs/second'.format(report['throughput']))
+        print('errors: {} ({:0.1f}%){}'.format(
+            errors, 100 * report['error_rate'],
+            ''.join(', {} {}'.format(label, count)
+                    for label, count in sorted(exitcodes.items())
+                    if label != 'OKAY')))
+        print('latency: {}'.format(latency.format()))
+        if auth.count:
+            print('auth: {} ({} runs)'.format(auth.format(), auth.count))
+        print()
+        for line in histogram.format():
+            print(line)
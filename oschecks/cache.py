@@ -0,0 +1,435 @@
+import atexit
+import collections
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+def cache_dir(*parts):
+    '''Return the path to the oschecks cache directory (or a subdirectory
+    of it), creating it if necessary.  The location can be set with
+    the OSCHECKS_CACHE_DIR environment variable and otherwise follows
+    the XDG base directory specification.'''
+
+    base = os.environ.get('OSCHECKS_CACHE_DIR')
+    if base is None:
+        base = os.path.join(
+            os.environ.get('XDG_CACHE_HOME',
+                           os.path.expanduser('~/.cache')),
+            'oschecks')
+
+    path = os.path.join(base, *parts)
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+    return path
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def try_lock(fd):
+    '''Take an exclusive lock on `fd` if no one else holds it, and
+    return whether it was taken.'''
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as exc:
+        if exc.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return False
+
+    return True
+
+
+@contextlib.contextmanager
+def locked(path, timeout=None):
+    '''Hold an exclusive lock on `path` for the duration of the
+    context.  The lock is shared by every process (and every thread)
+    that locks the same path.  If `timeout` is given, raise LockTimeout
+    rather than wait longer than `timeout` seconds for it.'''
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if timeout is None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            deadline = time.time() + timeout
+            while not try_lock(fd):
+                if time.time() >= deadline:
+                    raise LockTimeout(
+                        'timed out waiting for lock on {}'.format(path))
+                time.sleep(0.05)
+    except Exception:
+        os.close(fd)
+        raise
+
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def read_json(path):
+    '''Return the decoded content of `path`, or None if it does not
+    exist or cannot be parsed.'''
+
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except IOError as exc:
+        if exc.errno != errno.ENOENT:
+            LOG.warning('failed to read %s: %s', path, exc)
+    except ValueError as exc:
+        LOG.warning('ignoring corrupt cache file %s: %s', path, exc)
+
+
+def write_json(path, data):
+    '''Atomically replace `path` with the JSON encoding of `data`.  The
+    file is only readable by the current user.'''
+
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path),
+                                   prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(data, fp)
+        os.rename(tmppath, path)
+    except Exception:
+        os.unlink(tmppath)
+        raise
+
+
+def remove(path):
+    try:
+        os.unlink(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+
+
+class Counters(object):
+    '''Event counters that are kept both in memory (for the current
+    process) and in a JSON file in the cache directory (for every
+    process sharing that directory).
+
+    Updating the file takes a lock shared by every process, so frequent
+    events (such as cache hits) can be counted with `defer`: they are
+    written out along with the next event that isn't deferred, at most
+    `flush_interval` seconds later, or when the process exits.  Use
+    `counters()` to get the one Counters object for a path, so that
+    nothing deferred is lost when a ResultCache is thrown away.'''
+
+    flush_interval = 10
+
+    def __init__(self, path):
+        self.path = path
+        self.local = collections.Counter()
+        self.pending = collections.Counter()
+        self.lock = threading.Lock()
+        self.time_flushed = time.time()
+
+    def incr(self, name, defer=False):
+        with self.lock:
+            self.local[name] += 1
+            self.pending[name] += 1
+            if (defer and
+                    time.time() - self.time_flushed < self.flush_interval):
+                return
+
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, collections.Counter()
+            self.time_flushed = time.time()
+
+        if not pending:
+            return
+
+        try:
+            with locked(self.path + '.lock'):
+                counters = read_json(self.path) or {}
+                for name, count in pending.items():
+                    counters[name] = counters.get(name, 0) + count
+                write_json(self.path, counters)
+        except (IOError, OSError) as exc:
+            LOG.warning('failed to update %s: %s', self.path, exc)
+
+    def read(self):
+        return read_json(self.path) or {}
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def counters(path):
+    '''Return the Counters for `path`, shared by everything in this
+    process that counts events there.'''
+
+    with _counters_lock:
+        if path not in _counters:
+            _counters[path] = Counters(path)
+
+        return _counters[path]
+
+
+@atexit.register
+def flush_counters():
+    for path_counters in list(_counters.values()):
+        path_counters.flush()
+
+
+class TokenCache(object):
+    '''Persists the authentication state of a keystoneauth1 identity
+    plugin (the token and service catalog) on disk, so that every
+    oschecks process using the same credentials can share a single
+    token until it expires.
+
+    Use it like this:
+
+        cache = TokenCache(key)
+        cache.load(sess)
+        ...make requests using sess...
+        cache.save(sess)
+
+    `load` either installs a cached token into the session's auth plugin
+    or authenticates and caches the new token.  The cache entry is
+    evicted if the token is close to expiry or if a request using it
+    receives a 401 response.'''
+
+    # Don't hand out tokens that will expire in less than this many
+    # seconds.  This matches the point at which keystoneauth1 would
+    # re-authenticate anyway.
+    stale_duration = 120
+
+    def __init__(self, key, directory=None):
+        self.directory = directory or cache_dir('tokens')
+        self.path = os.path.join(self.directory, '{}.json'.format(key))
+        self.lockpath = '{}.lock'.format(self.path)
+        self.counters = counters(os.path.join(self.directory, 'stats.json'))
+        self.state = None
+
+    def load(self, sess):
+        '''Install cached authentication state into `sess.auth`.  On a
+        cache miss, authenticate now (while holding the lock, so that
+        concurrent processes wait for this one rather than
+        authenticating as well) and cache the result.  Returns True on a
+        cache hit.'''
+
+        plugin = sess.auth
+
+        with locked(self.lockpath):
+            state = read_json(self.path)
+            hit = state is not None and self._restore(plugin, state)
+            if hit:
+                LOG.debug('using cached token from %s', self.path)
+                self.counters.incr('hits')
+                self.state = state
+            else:
+                LOG.debug('no valid cached token in %s', self.path)
+                self.counters.incr('misses')
+                plugin.get_access(sess)
+                self.state = plugin.get_auth_state()
+                write_json(self.path, self.state)
+
+        self._wrap_invalidate(plugin)
+        return hit
+
+    def save(self, sess):
+        '''Update the cache if the plugin has re-authenticated since the
+        state was loaded.'''
+
+        state = sess.auth.get_auth_state()
+        if state is None or state == self.state:
+            return
+
+        with locked(self.lockpath):
+            write_json(self.path, state)
+            self.state = state
+
+    def evict(self):
+        with locked(self.lockpath):
+            remove(self.path)
+            self.state = None
+
+        self.counters.incr('evictions')
+
+    def _restore(self, plugin, state):
+        try:
+            plugin.set_auth_state(state)
+        except (ValueError, KeyError, TypeError) as exc:
+            LOG.warning('discarding invalid cached token: %s', exc)
+            plugin.set_auth_state(None)
+            return False
+
+        if (plugin.auth_ref is None or
+                plugin.auth_ref.will_expire_soon(self.stale_duration)):
+            plugin.set_auth_state(None)
+            remove(self.path)
+            self.counters.incr('expired')
+            return False
+
+        return True
+
+    def _wrap_invalidate(self, plugin):
+        # keystoneauth1 calls the plugin's invalidate method when a
+        # request receives a 401 response, before re-authenticating
+        # and retrying the request.  We hook that so the rejected token
+        # is evicted from the cache; the replacement token is written
+        # back by save().
+        invalidate = plugin.invalidate
+
+        def _invalidate():
+            LOG.info('token rejected, evicting %s', self.path)
+            try:
+                self.evict()
+            except (IOError, OSError) as exc:
+                LOG.warning('failed to evict %s: %s', self.path, exc)
+            return invalidate()
+
+        plugin.invalidate = _invalidate
+
+
+def token_cache_key(cfg, plugin):
+    '''Return a cache key identifying the cloud, user and project
+    that `cfg` authenticates as.  Where the plugin supports it, the
+    key also covers a hash of the remaining authentication options
+    (including the password), so changing credentials never reuses a
+    stale token.'''
+
+    auth = cfg.config.get('auth', {})
+    parts = [
+        cfg.name,
+        auth.get('auth_url'),
+        auth.get('user_domain_name') or auth.get('user_domain_id'),
+        auth.get('username') or auth.get('user_id'),
+        auth.get('project_domain_name') or auth.get('project_domain_id'),
+        (auth.get('project_name') or auth.get('project_id') or
+         auth.get('tenant_name') or auth.get('tenant_id')),
+        plugin.get_cache_id(),
+    ]
+
+    return hashlib.sha256(
+        json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    '''Remembers recent check results in a JSON file in the cache
+    directory, so that when several monitoring systems run the same
+    check within a few seconds of each other only one of them actually
+    talks to the cloud.
+
+    Use it like this:
+
+        results = ResultCache()
+        value, age = results.fetch(key, ttl, run_check)
+
+    `fetch` returns a cached value no older than `ttl` seconds along
+    with its age, or calls `run_check` and returns its value with an
+    age of None.  Processes that miss on the same key at the same time
+    wait for the first of them to finish rather than all running the
+    check, but only for up to `fill_timeout` seconds: a process that
+    waits longer runs the check itself without caching the result, so
+    that a hung check only holds up callers of the same check.  Once
+    the cache holds more than `max_entries` values the oldest are
+    evicted.'''
+
+    # Processes filling the cache for different keys mostly don't wait
+    # for each other, without needing a lock file for every key.
+    lock_stripes = 16
+    fill_timeout = 30
+
+    def __init__(self, directory=None, max_entries=1000):
+        self.directory = directory or cache_dir('results')
+        self.path = os.path.join(self.directory, 'results.json')
+        self.lockpath = '{}.lock'.format(self.path)
+        self.max_entries = max_entries
+        self.counters = counters(os.path.join(self.directory, 'stats.json'))
+
+    def get(self, key, ttl):
+        '''Return the cache entry for `key` if it is less than `ttl`
+        seconds old.  The cache file is always replaced atomically, so
+        this doesn't need the lock.'''
+
+        entry = (read_json(self.path) or {}).get(key)
+        if entry is None or time.time() - entry['stored'] >= ttl:
+            return None
+
+        return entry
+
+    def put(self, key, value, ttl):
+        now = time.time()
+        with locked(self.lockpath):
+            entries = read_json(self.path) or {}
+            entries[key] = {'stored': now, 'ttl': ttl, 'value': value}
+
+            expired = [k for k, entry in entries.items()
+                       if now - entry['stored'] >= entry['ttl']]
+            for k in expired:
+                del entries[k]
+
+            evicted = sorted(entries, key=lambda k: entries[k]['stored'])
+            evicted = evicted[:max(0, len(entries) - self.max_entries)]
+            for k in evicted:
+                del entries[k]
+
+            write_json(self.path, entries)
+
+        for k in evicted:
+            self.counters.incr('evictions')
+
+    def fetch(self, key, ttl, func, timeout=None):
+        '''Return (value, age) for `key`; see the class docstring.  The
+        wait for another process to fill the entry is limited to
+        `timeout` seconds (by default, `fill_timeout`).'''
+
+        if timeout is None:
+            timeout = self.fill_timeout
+
+        entry = self.get(key, ttl)
+        if entry is None:
+            stripe = int(key[:8], 16) % self.lock_stripes
+            try:
+                with locked(os.path.join(self.directory,
+                                         'fill.{}.lock'.format(stripe)),
+                            timeout=timeout):
+                    # Another process may have filled the entry while
+                    # we were waiting for the lock.
+                    entry = self.get(key, ttl)
+                    if entry is None:
+                        self.counters.incr('misses')
+                        value = func()
+                        if value is not None:
+                            self.put(key, value, ttl)
+                        return value, None
+            except LockTimeout as exc:
+                LOG.warning('%s; running the check uncached', exc)
+                self.counters.incr('lock_timeouts')
+                return func(), None
+
+        self.counters.incr('hits', defer=True)
+        return entry['value'], time.time() - entry['stored']
+
+
+def result_cache_key(*parts):
+    '''Return a cache key for a check result from the (JSON
+    serializable) `parts` that identify it.'''
+
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
@@ -0,0 +1,289 @@
+'''Checks that create several test resources at once and time them.
+
+A canary check creates a batch of resources (servers, volumes) at
+once, waits for all of them to become ready, deletes them all at once
+and waits for them to go, then reports percentiles of how long each
+phase took.  Every resource is tracked through one shared
+poller.Poller, so the number of API requests per poll doesn't grow
+with the number of resources, and a cleanup that always runs at the
+end deletes anything of the run that was left behind.'''
+
+import collections
+import time
+
+import oschecks.common as common
+import oschecks.executor as executor
+import oschecks.stats as stats
+import oschecks.waiter as waiter
+
+
+class Canary(object):
+    '''One of the resources created by a CanaryCommand, and how long
+    after its create or delete request it was seen to reach each
+    phase.  Latencies are reported separately for each `group` (such
+    as the backend a volume was created on), if there is more than
+    one.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.id = None
+        self.group = None
+        self.status = None
+        self.time_created = None
+        self.time_deleted = None
+        self.latency = {}
+
+    def update(self, resource, now):
+        '''Record what a listing says about this resource.'''
+
+        self.status = resource.status
+
+
+class CanaryCommand(common.CheckCommand):
+    '''A check that creates and deletes several resources at once.
+
+    Subclasses set the statuses and exceptions of their API, put the
+    Canary objects to create in `ctx.canaries` and a poller.Poller that
+    lists them in `ctx.poller`, and provide:
+
+    - `create_canary(parsed_args, ctx, canary)`, which asks for a
+      resource to be created and sets the canary's `time_created` and
+      `id`;
+    - `delete_resource(canary)`, which asks for it to be deleted;
+    - `list_leftovers(ctx)`, which returns Canary objects (with their
+      `id` and `status`) for the resources of the run that still exist
+      and aren't already being deleted.
+
+    Their options must include `canary_workers`, `ready_timeout`,
+    `delete_timeout`, `latency_warning` and `latency_critical` (as the
+    dest of options named for the resource).'''
+
+    # The plural name of the resources, for messages.
+    resource_type = 'resources'
+    done = 'Created and deleted'
+
+    ready_status = None
+    deleted_status = None
+    failed = ()
+
+    # The phases reported, in order, and the phase that ends when a
+    # resource reaches ready_status, which the latency thresholds
+    # apply to.
+    phases = ()
+    ready_phase = 'create'
+
+    # What the API raises for a resource that doesn't exist, and for
+    # any other failed request.
+    not_found = ()
+    client_errors = ()
+
+    # Statuses in which a resource can't be deleted yet.  The cleanup
+    # waits (for up to the ready timeout) for leftover resources to
+    # leave them.
+    busy_statuses = ()
+
+    def run_all(self, parsed_args, func, canaries):
+        with executor.Executor(
+                workers=parsed_args.canary_workers or len(canaries)) as pool:
+            tasks = [pool.submit(func, canary) for canary in canaries]
+            return [task.result() for task in tasks]
+
+    def delete_canary(self, canary):
+        '''Ask for `canary` to be deleted, and return whether the API
+        accepted.'''
+
+        canary.time_deleted = time.time()
+        try:
+            self.delete_resource(canary)
+        except self.not_found:
+            pass
+        except self.client_errors as exc:
+            self.log.warning('failed to delete %s: %s', canary.name, exc)
+            return False
+
+        return True
+
+    def wait_for_canaries(self, ctx, canaries, status, phase, timeout,
+                          since, failed=()):
+        '''Wait for each of `canaries` to reach `status`, all of them
+        sharing the one listing per poll made by `ctx.poller`, and
+        record as the `phase` latency of each how long after its
+        `since` attribute it was first seen there.  Canaries that fail,
+        or that haven't made it by the timeout, are left with their
+        last status.'''
+
+        def wait(canary):
+            time_start = time.time()
+            try:
+                transition = ctx.poller.wait(
+                    canary.id, status, timeout=timeout,
+                    failed=self.failed + failed)
+            except (waiter.StatusError, common.TimeoutError):
+                return
+            finally:
+                canary.status = ctx.poller.status(canary.id)
+
+            canary.latency[phase] = (
+                time_start + transition.interval - getattr(canary, since))
+
+        with executor.Executor(workers=len(canaries)) as pool:
+            for task in [pool.submit(wait, canary) for canary in canaries]:
+                task.result()
+
+    def create_canaries(self, parsed_args, ctx):
+        self.run_all(parsed_args,
+                     lambda canary: self.create_canary(
+                         parsed_args, ctx, canary),
+                     ctx.canaries)
+        self.wait_for_canaries(ctx, ctx.canaries, self.ready_status,
+                               self.ready_phase, parsed_args.ready_timeout,
+                               'time_created',
+                               failed=(self.deleted_status,))
+
+    def delete_canaries(self, parsed_args, ctx):
+        created = [canary for canary in ctx.canaries
+                   if canary.id is not None]
+        accepted = self.run_all(parsed_args, self.delete_canary, created)
+        self.wait_for_canaries(ctx, [canary for canary, ok in
+                                     zip(created, accepted) if ok],
+                               self.deleted_status, 'delete',
+                               parsed_args.delete_timeout, 'time_deleted')
+
+    def wait_until_idle(self, parsed_args, ctx, canaries):
+        '''Wait for each of `canaries` to leave the busy statuses,
+        giving up on any still busy after the ready timeout.'''
+
+        def wait(canary):
+            try:
+                ctx.poller.wait(
+                    canary.id, self.ready_status,
+                    timeout=parsed_args.ready_timeout,
+                    failed=self.failed + (self.deleted_status,))
+            except (waiter.StatusError, common.TimeoutError):
+                pass
+            finally:
+                canary.status = ctx.poller.status(canary.id)
+
+        self.run_all(parsed_args, wait, canaries)
+
+    def cleanup(self, parsed_args, ctx):
+        '''Delete any resources of this run that are still there,
+        including any whose create request failed after the resource
+        was made, and record in `ctx.leaked` those that couldn't be
+        deleted.'''
+
+        with common.span('cleanup'):
+            leftover = list(self.list_leftovers(ctx))
+            busy = [canary for canary in leftover
+                    if canary.status in self.busy_statuses]
+            if busy:
+                self.wait_until_idle(parsed_args, ctx, busy)
+            if leftover:
+                accepted = self.run_all(parsed_args, self.delete_canary,
+                                        leftover)
+                ctx.leaked = [canary for canary, ok in
+                              zip(leftover, accepted) if not ok]
+
+    def run_canaries(self, parsed_args, ctx, test_plan):
+        '''Run the steps of `test_plan`, clean up, and return the
+        (exitcode, message, timer) of the check.'''
+
+        self.canaries = ctx.canaries
+        ctx.leaked = []
+
+        with common.Timer() as t:
+            try:
+                for step in test_plan:
+                    self.log.info('running step: {}'.format(
+                        step.__doc__))
+                    with common.span(step.__doc__):
+                        step(parsed_args, ctx)
+            except self.client_errors as exc:
+                raise common.ExitCritical(
+                    '{} failed: {}'.format(step.__doc__, exc))
+            finally:
+                try:
+                    self.cleanup(parsed_args, ctx)
+                except self.client_errors as exc:
+                    raise common.ExitCritical(
+                        'Failed to delete test {}: {}'.format(
+                            self.resource_type, exc))
+
+        exitcode = common.RET_OKAY
+        lines = []
+
+        failed = [canary for canary in ctx.canaries
+                  if 'delete' not in canary.latency]
+        if failed:
+            exitcode = common.RET_CRIT
+            lines.append('{} of {} {} failed: {}'.format(
+                len(failed), len(ctx.canaries), self.resource_type,
+                ', '.join('{} ({})'.format(canary.name,
+                                           canary.status or 'not created')
+                          for canary in failed)))
+        else:
+            lines.append('{} {} {}'.format(
+                self.done, len(ctx.canaries), self.resource_type))
+
+        if ctx.leaked:
+            exitcode = common.RET_CRIT
+            lines.append('Failed to delete {} test {}: {}'.format(
+                len(ctx.leaked), self.resource_type,
+                ', '.join('{} ({})'.format(canary.name, canary.status)
+                          for canary in ctx.leaked)))
+
+        for group, summaries in self.summaries():
+            prefix = '{} '.format(group) if group else ''
+
+            p90 = summaries[self.ready_phase].p[90]
+            for threshold, code in (
+                    (parsed_args.latency_critical, common.RET_CRIT),
+                    (parsed_args.latency_warning, common.RET_WARN)):
+                if threshold and p90 is not None and p90 > threshold:
+                    exitcode = common.worst_exitcode([exitcode, code])
+                    lines.append('{}90% of {} took up to {:0.2f} seconds '
+                                 'to become {}'.format(
+                                     prefix, self.resource_type, p90,
+                                     self.ready_status))
+                    break
+
+            for phase in self.phases:
+                if summaries[phase].count:
+                    lines.append('{}{}: {}'.format(
+                        prefix, phase, summaries[phase].format()))
+
+        return (exitcode, '\n'.join(lines), t)
+
+    def summaries(self):
+        '''Return (group, {phase: stats.Summary}) pairs, sorted by
+        group, with a summary of each reported phase and of the ready
+        phase.'''
+
+        latencies = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        for canary in self.canaries:
+            for phase, latency in canary.latency.items():
+                latencies[canary.group][phase].append(latency)
+
+        phases = set(self.phases) | set([self.ready_phase])
+        return [(group, dict((phase, stats.Summary(latencies[group][phase]))
+                             for phase in phases))
+                for group in sorted(latencies, key=lambda group: group or '')]
+
+    def get_result(self, parsed_args):
+        '''Add the latency percentiles of each phase (of each group) to
+        the performance data.'''
+
+        self.canaries = []
+        result = super(CanaryCommand, self).get_result(parsed_args)
+
+        for group, summaries in self.summaries():
+            prefix = '{}_'.format(group) if group else ''
+            for phase in self.phases:
+                for p in (50, 90):
+                    if summaries[phase].count:
+                        result.add_perfdata(
+                            '{}{}_p{}'.format(prefix, phase, p),
+                            summaries[phase].p[p], 's', minimum=0)
+
+        return result
@@ -1,6 +1,22 @@
 import glanceclient
+import hashlib
+import itertools
+import keystoneauth1
+import uuid
 import oschecks.openstack as openstack
 import oschecks.common as common
+import oschecks.pagination as pagination
+import oschecks.payload as payload
+
+# What a failed Glance request can raise: glanceclient's HTTP errors,
+# its other errors (such as CommunicationError, which doesn't derive
+# from ClientException), and the connection errors of the keystoneauth1
+# session that it sends requests through.
+glance_errors = (
+    glanceclient.exc.ClientException,
+    glanceclient.exc.BaseException,
+    keystoneauth1.exceptions.ConnectionError,
+)
 
 
 class NonUniqueMatch(Exception):
@@ -14,9 +30,10 @@ class GlanceCommand(openstack.OpenstackCommand):
         super(GlanceCommand, self).take_action(parsed_args)
 
         try:
-            self.glance = glanceclient.client.Client(
-                parsed_args.os_image_api_version,
-                session=self.auth.sess)
+            with common.span('client'):
+                self.glance = glanceclient.client.Client(
+                    parsed_args.os_image_api_version,
+                    session=self.auth.sess)
         except glanceclient.exc.ClientException as exc:
             raise common.ExitCritical(
                     'Failed to create Glance client: {}'.format(exc))
@@ -36,20 +53,46 @@ class CheckAPI(GlanceCommand):
         super(CheckAPI, self).take_action(parsed_args)
 
         try:
-            with common.Timer() as t:
-                images = list(self.glance.images.list(
-                    limit=parsed_args.limit))
+            if parsed_args.count:
+                # glanceclient follows the pages itself.
+                cap = parsed_args.count_cap or None
+                with common.span('count images') as t:
+                    found = pagination.count(
+                        self.glance.images.list(
+                            page_size=parsed_args.page_size,
+                            limit=cap + 1 if cap else None),
+                        cap)
+            else:
+                with common.span('list images') as t:
+                    found = len(list(self.glance.images.list(
+                        limit=parsed_args.limit)))
         except glanceclient.exc.ClientException as exc:
             return (common.RET_CRIT,
                     'Failed to list images: {}'.format(exc),
                     t)
 
-        msg = 'Found {} images'.format(len(images))
+        msg = 'Found {} images'.format(found)
 
         return (common.RET_OKAY, msg, t)
 
 
 class CheckImageExists(GlanceCommand):
+    def find_image(self, name):
+        '''Look up an image by name, letting Glance do the filtering.
+        Two matches are enough to know the name is not unique, so no
+        more than that are requested.'''
+
+        images = list(itertools.islice(
+            self.glance.images.list(filters={'name': name}, limit=2), 2))
+
+        if not images:
+            raise glanceclient.exc.NotFound(name)
+
+        if len(images) > 1:
+            raise NonUniqueMatch()
+
+        return images[0]
+
     def get_parser(self, prog_name):
         p = super(CheckImageExists, self).get_parser(prog_name)
 
@@ -63,30 +106,26 @@ class CheckImageExists(GlanceCommand):
         '''Check if the named image exists.'''
         super(CheckImageExists, self).take_action(parsed_args)
 
+        t = None
         try:
-            try:
-                with common.Timer() as t:
-                    image = self.glance.images.get(
-                        parsed_args.image_name)
-            except glanceclient.exc.NotFound:
-                with common.Timer() as t:
-                    images = [image for image in self.glance.images.list()
-                              if image.name == parsed_args.image_name]
-
-                    if not images:
-                        raise glanceclient.exc.NotFound(
+            image = None
+            if common.looks_like_id(parsed_args.image_name):
+                try:
+                    with common.span('get image') as t:
+                        image = self.glance.images.get(
                             parsed_args.image_name)
+                except glanceclient.exc.NotFound:
+                    pass
 
-                    if len(images) > 1:
-                        raise NonUniqueMatch()
-
-                    image = images[0]
+            if image is None:
+                with common.span('find image') as t:
+                    image = self.find_image(parsed_args.image_name)
         except NonUniqueMatch:
             return (common.RET_WARN,
                     'Too many matches for image name {}'.format(
                         parsed_args.image_name),
                     t)
-        except glanceclient.exc.NotFound as exc:
+        except glanceclient.exc.NotFound:
             return (common.RET_CRIT,
                     'Image named {} does not exist.'.format(
                         parsed_args.image_name),
@@ -100,3 +139,138 @@ class CheckImageExists(GlanceCommand):
             image.name, image.id)
 
         return (common.RET_OKAY, msg, t)
+
+
+class CheckImageCreateDelete(common.BandwidthCommand, GlanceCommand):
+    '''Create a test image, upload generated data to it, download it
+    again checking its checksum as it arrives, and delete it,
+    reporting the upload and download bandwidth.  The data is
+    generated as it is sent, so images of any size can be checked
+    without holding them in memory.'''
+
+    default_timeout_warning = 20
+    default_timeout_critical = 40
+
+    def get_parser(self, prog_name):
+        p = super(CheckImageCreateDelete, self).get_parser(prog_name)
+
+        g = p.add_argument_group('Image API Options')
+        g.add_argument('--os-image-api-version', default='2')
+        g.add_argument('--image-name', '--name', default='monitoring-test')
+        g.add_argument('--disk-format', default='raw')
+        g.add_argument('--container-format', default='bare')
+        g.add_argument('image_size', nargs='?', default=10, type=float,
+                       help='Size of the test image in MB (default 10)')
+
+        return p
+
+    def create_test_image(self, parsed_args, ctx):
+        '''Create test image'''
+
+        ctx.image = self.glance.images.create(
+            name=parsed_args.image_name,
+            disk_format=parsed_args.disk_format,
+            container_format=parsed_args.container_format,
+            visibility='private',
+            oschecks_run=ctx.run)
+        ctx.image_created = True
+
+    def upload_test_image(self, parsed_args, ctx):
+        '''Upload test image data'''
+
+        with common.Timer() as t:
+            self.glance.images.upload(ctx.image.id, ctx.payload,
+                                      image_size=ctx.payload.size)
+
+        ctx.upload = self.record_transfer('upload', ctx.payload.size,
+                                          t.interval)
+
+    def verify_test_image(self, parsed_args, ctx):
+        '''Verify test image'''
+
+        image = self.glance.images.get(ctx.image.id)
+
+        if image.status != 'active':
+            raise common.ExitCritical(
+                'Test image is {} after upload (expected active)'.format(
+                    image.status))
+
+        checksum = getattr(image, 'checksum', None)
+        if checksum and checksum != ctx.md5:
+            raise common.ExitCritical(
+                'Glance recorded checksum {} for the test image, '
+                'expected {}'.format(checksum, ctx.md5))
+
+    def download_test_image(self, parsed_args, ctx):
+        '''Download and verify test image data'''
+
+        with common.Timer() as t:
+            body = self.glance.images.data(ctx.image.id, do_checksum=False)
+
+            md5 = hashlib.md5()
+            size = 0
+            for chunk in body:
+                md5.update(chunk)
+                size += len(chunk)
+
+        if size != ctx.payload.size:
+            raise common.ExitCritical(
+                'Downloaded {} bytes of test image, expected {}'.format(
+                    size, ctx.payload.size))
+
+        if md5.hexdigest() != ctx.md5:
+            raise common.ExitCritical(
+                'Downloaded test image does not match what was uploaded')
+
+        ctx.download = self.record_transfer('download', size, t.interval)
+
+    def delete_test_image(self, parsed_args, ctx):
+        '''Delete test image'''
+
+        self.glance.images.delete(ctx.image.id)
+        ctx.image_created = False
+
+    def take_action(self, parsed_args):
+        '''Check that images can be uploaded, downloaded and deleted.'''
+        super(CheckImageCreateDelete, self).take_action(parsed_args)
+
+        test_plan = (
+            self.create_test_image,
+            self.upload_test_image,
+            self.verify_test_image,
+            self.download_test_image,
+            self.delete_test_image,
+        )
+
+        ctx = lambda: None
+        ctx.run = uuid.uuid4().hex
+        ctx.image_created = False
+        ctx.payload = payload.Payload(int(parsed_args.image_size * 1e6),
+                                      seed=ctx.run)
+        ctx.md5 = ctx.payload.md5()
+
+        with common.Timer() as t:
+            try:
+                for step in test_plan:
+                    self.log.info('running step: {}'.format(
+                        step.__doc__))
+                    with common.span(step.__doc__):
+                        step(parsed_args, ctx)
+            except glance_errors as exc:
+                raise common.ExitCritical(
+                    '{} failed: {}'.format(step.__doc__, exc))
+            finally:
+                try:
+                    if ctx.image_created:
+                        self.delete_test_image(parsed_args, ctx)
+                except glance_errors as exc:
+                    raise common.ExitCritical(
+                        'Failed to delete test image: {}'.format(exc))
+
+        msg = ('Successfully uploaded, downloaded and deleted image {} '
+               '({} bytes)\n'
+               'Upload {:0.2f} MB/s, download {:0.2f} MB/s').format(
+                   parsed_args.image_name, ctx.payload.size,
+                   ctx.upload, ctx.download)
+
+        return (common.RET_OKAY, msg, t)
@@ -1,7 +1,7 @@
 import keystoneauth1
 import keystoneclient
-import requests
 
+import oschecks.executor as executor
 import oschecks.openstack as openstack
 import oschecks.common as common
 
@@ -11,17 +11,19 @@ class KeystoneCommand(openstack.OpenstackCommand):
         super(KeystoneCommand, self).take_action(parsed_args)
 
         try:
-            self.keystone = keystoneclient.client.Client(
-                parsed_args.os_identity_api_version,
-                session=self.auth.sess)
+            with common.span('client'):
+                self.keystone = keystoneclient.client.Client(
+                    parsed_args.os_identity_api_version,
+                    session=self.auth.sess)
         except keystoneauth1.exceptions.ClientException as exc:
             raise common.ExitCritical(
                    'Failed to authenticate: {}'.format(exc))
 
     def get_endpoint(self, service_type, service_name=None):
-        endpoint_url = self.auth.sess.get_endpoint(
-            service_type=service_type,
-            service_name=service_name)
+        with common.span('catalog'):
+            endpoint_url = self.auth.sess.get_endpoint(
+                service_type=service_type,
+                service_name=service_name)
 
         return endpoint_url
 
@@ -96,32 +98,152 @@ class CheckServiceAlive(KeystoneCommand):
                        type=int)
         g.add_argument('--status-warning',
                        action='append',
-                       default=[])
+                       default=[],
+                       type=int)
         g.add_argument('--status-critical',
                        action='append',
-                       default=[])
+                       default=[],
+                       type=int)
+
+        g = p.add_argument_group('Service Catalog Options')
+        g.add_argument('--all', '-a', action='store_true',
+                       help='Probe every endpoint in the service catalog')
+        g.add_argument('--interface', action='append',
+                       help='With --all, only probe endpoints with this '
+                       'interface (may be repeated)')
+        g.add_argument('--region', action='append',
+                       help='With --all, only probe endpoints in this '
+                       'region (may be repeated)')
+        g.add_argument('--workers', '-j', type=int, default=10,
+                       help='With --all, probe this many endpoints at once')
 
         return p
 
+    def status_exitcode(self, status_code, parsed_args):
+        if status_code in parsed_args.status_warning:
+            return common.RET_WARN
+        elif status_code not in parsed_args.status_okay:
+            return common.RET_CRIT
+        else:
+            return common.RET_OKAY
+
+    def endpoint_name(self, endpoint):
+        return '{0.service_type} {0.interface} {0.region_name}'.format(
+            endpoint)
+
+    def probe(self, endpoint, parsed_args):
+        '''Send a request to a catalog endpoint and return a Result
+        describing the response.  The request gives up after the
+        critical threshold, since the check has failed by then.'''
+
+        desc = '{} {}'.format(self.endpoint_name(endpoint), endpoint.url)
+
+        with common.span(desc) as t:
+            try:
+                res = self.auth.sess.get(
+                    endpoint.url, authenticated=False, raise_exc=False,
+                    timeout=parsed_args.timeout_critical or None)
+            except keystoneauth1.exceptions.ConnectTimeout:
+                return common.Result(common.RET_CRIT,
+                                     '{}: timed out'.format(desc), t)
+            except keystoneauth1.exceptions.ConnectionError:
+                res = None
+
+        if res is None:
+            return common.Result(common.RET_CRIT,
+                                 '{}: cannot connect'.format(desc),
+                                 t)
+
+        return common.Result(
+            self.status_exitcode(res.status_code, parsed_args),
+            '{}: status {} ({:0.4f} seconds)'.format(
+                desc, res.status_code, t.interval),
+            t)
+
+    def probe_all(self, parsed_args):
+        '''Probe every endpoint in the service catalog (optionally
+        filtered by interface and region) concurrently.'''
+
+        access = self.auth.sess.auth.get_access(self.auth.sess)
+        catalog = access.service_catalog.get_endpoints_data(
+            interface=parsed_args.interface)
+
+        endpoints = [endpoint
+                     for service_type in sorted(catalog)
+                     for endpoint in catalog[service_type]
+                     if (not parsed_args.region or
+                         endpoint.region_name in parsed_args.region)]
+
+        if not endpoints:
+            return (common.RET_CRIT,
+                    'No matching endpoints in the service catalog',
+                    None)
+
+        deadline = parsed_args.timeout_critical or None
+        with common.span('probe endpoints') as t:
+            with executor.Executor(workers=parsed_args.workers) as pool:
+                tasks = [pool.submit(self.probe, endpoint, parsed_args,
+                                     timeout=deadline)
+                         for endpoint in endpoints]
+
+                results = []
+                for endpoint, task in zip(endpoints, tasks):
+                    try:
+                        results.append(task.result())
+                    except executor.TimeoutError:
+                        results.append(common.Result(
+                            common.RET_CRIT,
+                            '{} {}: timed out'.format(
+                                self.endpoint_name(endpoint),
+                                endpoint.url),
+                            common.Span.completed('probe',
+                                                  float(deadline))))
+
+        self.probes = [(self.endpoint_name(endpoint), result)
+                       for endpoint, result in zip(endpoints, results)]
+
+        exitcode = common.worst_exitcode(
+            [result.exitcode for result in results])
+        alive = len([result for result in results
+                     if result.exitcode == common.RET_OKAY])
+
+        msg = '{} of {} endpoints alive\n{}'.format(
+            alive, len(results),
+            '\n'.join(str(result) for result in results))
+
+        return (exitcode, msg, t)
+
     def take_action(self, parsed_args):
         '''Check if a service of the given type exists in the service
         catalog and if it reponds to HTTP requests.'''
 
         super(CheckServiceAlive, self).take_action(parsed_args)
 
+        if parsed_args.all:
+            return self.probe_all(parsed_args)
+
         try:
             endpoint_url = self.get_endpoint(
                 service_type=parsed_args.service_type,
                 service_name=parsed_args.service_name)
 
-            with common.Timer() as t:
-                res = requests.get(endpoint_url)
+            # Use the session (rather than requests directly) so that
+            # the probe uses the same CA settings and connection pool
+            # as the other checks.
+            with common.span('probe') as t:
+                res = self.auth.sess.get(
+                    endpoint_url, authenticated=False, raise_exc=False,
+                    timeout=parsed_args.timeout_critical or None)
         except keystoneauth1.exceptions.EndpointNotFound:
             return (common.RET_CRIT,
                     'Service {} does not exist'.format(
                         parsed_args.service_type),
-                    t)
-        except requests.exceptions.ConnectionError:
+                    None)
+        except keystoneauth1.exceptions.ConnectTimeout:
+            raise common.ExitCritical(
+                'Timed out probing service {} at {}'.format(
+                    parsed_args.service_type, endpoint_url))
+        except keystoneauth1.exceptions.ConnectionError:
             raise common.ExitCritical(
                 'Cannot connect to service {} at {}'.format(
                     parsed_args.service_type, endpoint_url))
@@ -129,11 +251,20 @@ class CheckServiceAlive(KeystoneCommand):
         msg = 'Received status {} from service {} at {}'.format(
             res.status_code, parsed_args.service_type, endpoint_url)
 
-        exitcode = common.RET_OKAY
-
-        if res.status_code in parsed_args.status_warning:
-            exitcode = common.RET_WARN
-        elif res.status_code not in parsed_args.status_okay:
-            exitcode = common.RET_CRIT
+        exitcode = self.status_exitcode(res.status_code, parsed_args)
 
         return (exitcode, msg, t)
+
+    def get_result(self, parsed_args):
+        '''With --all, add the response time of each endpoint to the
+        performance data.'''
+
+        self.probes = []
+        result = super(CheckServiceAlive, self).get_result(parsed_args)
+
+        for name, probe in self.probes:
+            if probe.elapsed is not None:
+                result.add_perfdata('{} time'.format(name), probe.elapsed,
+                                    's', minimum=0)
+
+        return result
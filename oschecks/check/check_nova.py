@@ -1,9 +1,46 @@
 import novaclient.client
+import re
+import time
+import uuid
+import oschecks.canary as canary
 import oschecks.openstack as openstack
 import oschecks.common as common
+import oschecks.poller as poller
 
 
-class CheckAPI(openstack.OpenstackCommand):
+class NovaCommand(openstack.OpenstackCommand):
+    '''This is the base class for all the Nova checks.'''
+
+    def take_action(self, parsed_args):
+        super(NovaCommand, self).take_action(parsed_args)
+
+        try:
+            with common.span('client'):
+                self.nova = novaclient.client.Client(
+                    parsed_args.os_compute_api_version,
+                    session=self.auth.sess)
+        except novaclient.exceptions.ClientException as exc:
+            raise common.ExitCritical(
+                'Failed to create Nova client: {}'.format(exc))
+
+    def server_poller(self, search_opts=None, callback=None):
+        '''Return a poller.Poller that tracks servers with one listing,
+        filtered by `search_opts`, per poll.  After the first poll only
+        servers changed since the last change seen are listed; Nova
+        includes deleted servers in such a listing, with the status
+        DELETED.'''
+
+        def list_servers(since):
+            opts = dict(search_opts or {})
+            if since is not None:
+                opts['changes-since'] = since
+            return self.nova.servers.list(search_opts=opts)
+
+        return poller.Poller(list_servers, changes_since=True,
+                             missing='DELETED', callback=callback)
+
+
+class CheckAPI(NovaCommand):
     def get_parser(self, prog_name):
         p = super(CheckAPI, self).get_parser(prog_name)
 
@@ -17,23 +54,27 @@ class CheckAPI(openstack.OpenstackCommand):
         super(CheckAPI, self).take_action(parsed_args)
 
         try:
-            nova = novaclient.client.Client(
-                parsed_args.os_compute_api_version,
-                session=self.auth.sess)
-
-            with common.Timer() as t:
-                servers = nova.servers.list(limit=parsed_args.limit)
+            if parsed_args.count:
+                with common.span('count servers') as t:
+                    found = self.count_resources(
+                        parsed_args,
+                        lambda marker, limit: self.nova.servers.list(
+                            detailed=False, marker=marker, limit=limit))
+            else:
+                with common.span('list servers') as t:
+                    found = len(self.nova.servers.list(
+                        limit=parsed_args.limit))
         except novaclient.exceptions.ClientException as exc:
             return (common.RET_CRIT,
                     'Failed to list servers: {}'.format(exc),
                     t)
 
-        msg = 'Found {} servers'.format(len(servers))
+        msg = 'Found {} servers'.format(found)
 
         return (common.RET_OKAY, msg, t)
 
 
-class CheckFlavorExists(openstack.OpenstackCommand):
+class CheckFlavorExists(NovaCommand):
     def get_parser(self, prog_name):
         p = super(CheckFlavorExists, self).get_parser(prog_name)
 
@@ -48,16 +89,13 @@ class CheckFlavorExists(openstack.OpenstackCommand):
         super(CheckFlavorExists, self).take_action(parsed_args)
 
         try:
-            nova = novaclient.client.Client(
-                parsed_args.os_compute_api_version,
-                session=self.auth.sess)
-
             try:
-                with common.Timer() as t:
-                    flavor = nova.flavors.get(parsed_args.flavor_name)
+                with common.span('get flavor') as t:
+                    flavor = self.nova.flavors.get(parsed_args.flavor_name)
             except novaclient.exceptions.NotFound:
-                with common.Timer() as t:
-                    flavor = nova.flavors.find(name=parsed_args.flavor_name)
+                with common.span('find flavor') as t:
+                    flavor = self.nova.flavors.find(
+                        name=parsed_args.flavor_name)
         except novaclient.exceptions.ClientException as exc:
             return (common.RET_CRIT,
                     'Failed to list servers: {}'.format(exc),
@@ -69,7 +107,26 @@ class CheckFlavorExists(openstack.OpenstackCommand):
         return (common.RET_OKAY, msg, t)
 
 
-class CheckServerExists(openstack.OpenstackCommand):
+class CheckServerExists(NovaCommand):
+    def find_server(self, name):
+        '''Look up a server by name, letting Nova do the filtering.
+        Nova treats the name as a regular expression, so it is escaped
+        and anchored to match only that exact name, and two matches are
+        enough to know the name is not unique.'''
+
+        servers = self.nova.servers.list(
+            search_opts={'name': '^{}$'.format(re.escape(name))},
+            limit=2)
+
+        if not servers:
+            raise novaclient.exceptions.NotFound(
+                404, 'No server matching name={}'.format(name))
+
+        if len(servers) > 1:
+            raise novaclient.exceptions.NoUniqueMatch()
+
+        return servers[0]
+
     def get_parser(self, prog_name):
         p = super(CheckServerExists, self).get_parser(prog_name)
 
@@ -83,17 +140,20 @@ class CheckServerExists(openstack.OpenstackCommand):
         '''Check if the named server exists.'''
         super(CheckServerExists, self).take_action(parsed_args)
 
+        t = None
         try:
-            nova = novaclient.client.Client(
-                parsed_args.os_compute_api_version,
-                session=self.auth.sess)
+            server = None
+            if common.looks_like_id(parsed_args.server_name):
+                try:
+                    with common.span('get server') as t:
+                        server = self.nova.servers.get(
+                            parsed_args.server_name)
+                except novaclient.exceptions.NotFound:
+                    pass
 
-            try:
-                with common.Timer() as t:
-                    server = nova.servers.get(parsed_args.server_name)
-            except novaclient.exceptions.NotFound:
-                with common.Timer() as t:
-                    server = nova.servers.find(name=parsed_args.server_name)
+            if server is None:
+                with common.span('find server') as t:
+                    server = self.find_server(parsed_args.server_name)
         except novaclient.exceptions.NoUniqueMatch:
             return (common.RET_WARN,
                     'Too many matches for server {}'.format(
@@ -109,3 +169,149 @@ class CheckServerExists(openstack.OpenstackCommand):
             server.name, server.id)
 
         return (common.RET_OKAY, msg, t)
+
+
+class CanaryServer(canary.Canary):
+    '''One of the servers booted by CheckServerCreateDelete.'''
+
+    def update(self, server, now):
+        '''Record what a server listing says about this server.  A
+        server has been scheduled once it has moved on from the
+        scheduling task (to networking, spawning and so on) or
+        finished building.'''
+
+        task_state = getattr(server, 'OS-EXT-STS:task_state', None)
+        if (server.status != 'BUILD' or
+                task_state not in (None, 'scheduling')):
+            self.latency.setdefault('schedule', now - self.time_created)
+
+        self.status = server.status
+
+
+class CheckServerCreateDelete(canary.CanaryCommand, NovaCommand):
+    '''Boot one or more small servers at once, wait for them to become
+    ACTIVE, then delete them all at once, and report how long they
+    took to be scheduled, to spawn once scheduled, and to be deleted.
+
+    The servers get unique names starting with the name prefix and a
+    random run ID, so one listing of the servers changed since the
+    last poll tracks all of them, and the cleanup that always runs at
+    the end can find any that were left behind.'''
+
+    default_timeout_warning = 60
+    default_timeout_critical = 120
+
+    resource_type = 'servers'
+    done = 'Booted and deleted'
+    ready_status = 'ACTIVE'
+    deleted_status = 'DELETED'
+    failed = ('ERROR',)
+    phases = ('schedule', 'spawn', 'delete')
+    ready_phase = 'boot'
+    not_found = novaclient.exceptions.NotFound
+    client_errors = novaclient.exceptions.ClientException
+
+    def get_parser(self, prog_name):
+        p = super(CheckServerCreateDelete, self).get_parser(prog_name)
+
+        g = p.add_argument_group('Compute API Options')
+        g.add_argument('--os-compute-api-version', default=2)
+        g.add_argument('--server-name-prefix', '--name',
+                       default='monitoring-test')
+        g.add_argument('--flavor', default='m1.tiny')
+        g.add_argument('--image', default='cirros')
+        g.add_argument('--network',
+                       help='ID of the network to attach the servers to')
+        g.add_argument('--availability-zone')
+        g.add_argument('--server-count', '-n', type=int,
+                       default=1, help='Number of servers to boot')
+        g.add_argument('--server-workers', dest='canary_workers', type=int,
+                       help='Number of API requests to make at once '
+                       '(default: one per server)')
+        g.add_argument('--server-active-timeout', dest='ready_timeout',
+                       type=int, default=90)
+        g.add_argument('--server-delete-timeout', dest='delete_timeout',
+                       type=int, default=30)
+        g.add_argument('--latency-warning', type=float,
+                       help='Warn if 90%% of the servers take longer '
+                       'than this many seconds to become ACTIVE')
+        g.add_argument('--latency-critical', type=float,
+                       help='Critical if 90%% of the servers take longer '
+                       'than this many seconds to become ACTIVE')
+
+        return p
+
+    def find_flavor_and_image(self, parsed_args, ctx):
+        '''Look up flavor and image'''
+
+        try:
+            ctx.flavor = self.nova.flavors.get(parsed_args.flavor)
+        except novaclient.exceptions.NotFound:
+            ctx.flavor = self.nova.flavors.find(name=parsed_args.flavor)
+
+        ctx.image = self.nova.glance.find_image(parsed_args.image)
+
+    def create_canary(self, parsed_args, ctx, server):
+        kwargs = {}
+        if parsed_args.network:
+            kwargs['nics'] = [{'net-id': parsed_args.network}]
+
+        server.time_created = time.time()
+        created = self.nova.servers.create(
+            server.name, ctx.image, ctx.flavor,
+            availability_zone=parsed_args.availability_zone,
+            meta={'oschecks_run': ctx.run},
+            **kwargs)
+        server.id = created.id
+
+    def delete_resource(self, server):
+        self.nova.servers.delete(server.id)
+
+    def list_leftovers(self, ctx):
+        for listed in self.nova.servers.list(search_opts=ctx.search_opts):
+            task_state = getattr(listed, 'OS-EXT-STS:task_state', None)
+            if task_state != 'deleting':
+                server = CanaryServer(listed.name)
+                server.id = listed.id
+                server.status = listed.status
+                yield server
+
+    def boot_servers(self, parsed_args, ctx):
+        '''Boot test servers'''
+
+        self.create_canaries(parsed_args, ctx)
+
+        for server in ctx.canaries:
+            if 'boot' in server.latency:
+                server.latency['spawn'] = max(0, (
+                    server.latency['boot'] -
+                    server.latency.get('schedule', server.latency['boot'])))
+
+    def delete_servers(self, parsed_args, ctx):
+        '''Delete test servers'''
+
+        self.delete_canaries(parsed_args, ctx)
+
+    def take_action(self, parsed_args):
+        '''Check that servers can be booted and deleted.'''
+        super(CheckServerCreateDelete, self).take_action(parsed_args)
+
+        ctx = lambda: None
+        ctx.run = uuid.uuid4().hex[:12]
+        prefix = '{}-{}-'.format(parsed_args.server_name_prefix, ctx.run)
+        ctx.search_opts = {'name': '^{}'.format(re.escape(prefix))}
+        ctx.canaries = [CanaryServer('{}{:03d}'.format(prefix, i))
+                        for i in range(parsed_args.server_count)]
+
+        def update(listed, now):
+            for server in ctx.canaries:
+                if server.id == listed.id:
+                    server.update(listed, now)
+
+        ctx.poller = self.server_poller(ctx.search_opts, callback=update)
+
+        return self.run_canaries(parsed_args, ctx, (
+            self.find_flavor_and_image,
+            self.boot_servers,
+            self.delete_servers,
+        ))
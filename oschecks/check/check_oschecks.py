@@ -0,0 +1,86 @@
+import subprocess
+import sys
+
+import oschecks.common as common
+
+# Run in a fresh interpreter to measure what it costs to start oschecks
+# and get as far as having the class for the named command, i.e.
+# everything up to the point where the check starts talking to a
+# service.
+startup_script = '''
+import sys
+from oschecks.main import App
+App().command_manager.find_command(sys.argv[1:])
+'''
+
+
+class CheckStartupTime(common.TimeoutCommand):
+    '''Measure how long it takes to start oschecks and import each
+    check, by timing a new Python process for every command.  Use
+    this to catch changes that make every check slower to start.'''
+
+    default_timeout_warning = 1
+    default_timeout_critical = 2
+
+    def get_parser(self, prog_name):
+        p = super(CheckStartupTime, self).get_parser(prog_name)
+
+        g = p.add_argument_group('Startup Options')
+        g.add_argument('--repeat', '-r', type=int, default=3,
+                       help='Time each command this many times and '
+                       'report the fastest')
+        g.add_argument('commands', nargs='*',
+                       help='Commands to time, each quoted as a single '
+                       'argument, e.g. "nova api" (default: every check)')
+
+        return p
+
+    def list_checks(self):
+        for name, ep in sorted(self.app.command_manager):
+            if name == self.cmd_name:
+                continue
+
+            try:
+                if issubclass(ep.load(), common.CheckCommand):
+                    yield name
+            except Exception as exc:
+                self.log.warning('failed to load %s: %s', name, exc)
+
+    def time_command(self, name, repeat):
+        timers = []
+        for i in range(max(1, repeat)):
+            with common.Timer() as t:
+                subprocess.check_call(
+                    [sys.executable, '-c', startup_script] + name.split())
+            timers.append(t)
+
+        return min(timers, key=lambda t: t.interval)
+
+    def take_action(self, parsed_args):
+        '''Check how long oschecks takes to start.'''
+
+        commands = parsed_args.commands or list(self.list_checks())
+
+        timings = []
+        for name in commands:
+            try:
+                timings.append(
+                    (name, self.time_command(name, parsed_args.repeat)))
+            except subprocess.CalledProcessError as exc:
+                return (common.RET_CRIT,
+                        'Failed to load command {} (exit status {})'.format(
+                            name, exc.returncode),
+                        None)
+
+        if not timings:
+            return (common.RET_WTF, 'No commands to time', None)
+
+        timings.sort(key=lambda timing: timing[1].interval, reverse=True)
+        slowest, t = timings[0]
+
+        msg = 'Slowest command to start is {}\n{}'.format(
+            slowest,
+            '\n'.join('{}: {:0.4f} seconds'.format(name, t.interval)
+                      for name, t in timings))
+
+        return (common.RET_OKAY, msg, t)
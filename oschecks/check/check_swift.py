@@ -1,32 +1,63 @@
+import hashlib
+import json
 import swiftclient
+import threading
+import uuid
 import oschecks.openstack as openstack
 import oschecks.common as common
+import oschecks.executor as executor
+import oschecks.payload as payload
 
 
-class CheckAPI(openstack.OpenstackCommand):
+class SwiftCommand(openstack.OpenstackCommand):
+    '''This is the base class for all the Swift checks.'''
+
+    def take_action(self, parsed_args):
+        super(SwiftCommand, self).take_action(parsed_args)
+
+        with common.span('client'):
+            self.swift = swiftclient.client.Connection(
+                session=self.auth.sess)
+        self.local = threading.local()
+
+    def connection(self):
+        '''Return a Connection for the current thread.  A Connection
+        keeps the response to its last request, so threads can't share
+        one; they share the session (and its connection pool)
+        instead.'''
+
+        if not hasattr(self.local, 'swift'):
+            self.local.swift = swiftclient.client.Connection(
+                session=self.auth.sess)
+
+        return self.local.swift
+
+
+class CheckAPI(SwiftCommand):
     def take_action(self, parsed_args):
-        '''Check if the Glance API is responding.'''
+        '''Check if the Swift API is responding.  Swift keeps count of
+        the containers and objects in an account, so they are read
+        from the account headers rather than by listing, and --count
+        costs nothing extra.'''
         super(CheckAPI, self).take_action(parsed_args)
 
         try:
-            swift = swiftclient.client.Connection(session=self.auth.sess)
-
-            with common.Timer() as t:
-                # XXX: It looks like swiftclient ignores the limit
-                # parameter.
-                containers = swift.get_account(
-                    limit=parsed_args.limit)
+            with common.span('head account') as t:
+                headers = self.swift.head_account()
         except swiftclient.exceptions.ClientException as exc:
             return (common.RET_CRIT,
-                    'Failed to list containers: {}'.format(exc),
+                    'Failed to get account: {}'.format(exc),
                     t)
 
-        msg = 'Found {} containers'.format(len(containers))
+        msg = 'Found {} containers with {} objects ({} bytes)'.format(
+            headers.get('x-account-container-count'),
+            headers.get('x-account-object-count'),
+            headers.get('x-account-bytes-used'))
 
         return (common.RET_OKAY, msg, t)
 
 
-class CheckContainerExists(openstack.OpenstackCommand):
+class CheckContainerExists(SwiftCommand):
     def get_parser(self, prog_name):
         p = super(CheckContainerExists, self).get_parser(prog_name)
 
@@ -36,71 +67,358 @@ class CheckContainerExists(openstack.OpenstackCommand):
         return p
 
     def take_action(self, parsed_args):
-        '''Check if the Glance API is responding.'''
+        '''Check if the named container exists.'''
         super(CheckContainerExists, self).take_action(parsed_args)
 
+        # HEAD the container rather than GET it, which would also fetch
+        # (the first page of) its object listing.
         try:
-            swift = swiftclient.client.Connection(session=self.auth.sess)
-
-            with common.Timer() as t:
-                with common.Timer() as t:
-                    container = swift.get_container(
-                        parsed_args.container_name)
+            with common.span('head container') as t:
+                headers = self.swift.head_container(
+                    parsed_args.container_name)
         except swiftclient.exceptions.ClientException as exc:
             if exc.http_status == 404:
                 msg = 'Container {} does not exist'.format(
                     parsed_args.container_name)
             else:
                 msg = 'Failed to retrieve container {}: {}'.format(
-                    parsed_args.container_name, exc),
+                    parsed_args.container_name, exc)
 
             return (common.RET_CRIT, msg, t)
 
         msg = 'Found container {} with {} objects'.format(
             parsed_args.container_name,
-            container[0]['x-container-object-count'])
+            headers['x-container-object-count'])
 
         return (common.RET_OKAY, msg, t)
 
 
-class CheckObjectExists(openstack.OpenstackCommand):
+class ContentMismatch(Exception):
+    pass
+
+
+class CheckObjectExists(common.BandwidthCommand, SwiftCommand):
     def get_parser(self, prog_name):
         p = super(CheckObjectExists, self).get_parser(prog_name)
 
         g = p.add_argument_group('Object Storage API Options')
+        g.add_argument('--verify-content', action='store_true',
+                       help='Download the object and check its size and '
+                       'MD5 checksum against its headers')
+        g.add_argument('--chunk-size', type=int, default=65536,
+                       help='Read the object this many bytes at a time '
+                       'when verifying its content')
         g.add_argument('container_name')
         g.add_argument('object_name')
 
         return p
 
+    def verify_content(self, parsed_args):
+        '''Stream the object, a chunk at a time so that memory use does
+        not depend on its size, and check that its length and MD5
+        checksum match the Content-Length and ETag of the download
+        (rather than of the earlier HEAD, in case the object has been
+        replaced since).  Returns the number of bytes read.'''
+
+        headers, body = self.swift.get_object(
+            parsed_args.container_name,
+            parsed_args.object_name,
+            resp_chunk_size=parsed_args.chunk_size)
+
+        md5 = hashlib.md5()
+        size = 0
+        for chunk in body:
+            md5.update(chunk)
+            size += len(chunk)
+
+        expected_size = int(headers['content-length'])
+        if size != expected_size:
+            raise ContentMismatch(
+                'read {} bytes, expected {}'.format(size, expected_size))
+
+        # The ETag of a large object manifest is not the MD5 checksum
+        # of its content.
+        manifest = ('x-object-manifest' in headers or
+                    headers.get('x-static-large-object') == 'True')
+        etag = headers.get('etag', '').strip('"')
+        if not manifest and etag and md5.hexdigest() != etag:
+            raise ContentMismatch(
+                'MD5 checksum {} does not match ETag {}'.format(
+                    md5.hexdigest(), etag))
+
+        return size
+
     def take_action(self, parsed_args):
-        '''Check if the Glance API is responding.'''
+        '''Check if the named object exists.'''
         super(CheckObjectExists, self).take_action(parsed_args)
 
         try:
-            swift = swiftclient.client.Connection(session=self.auth.sess)
-
             with common.Timer() as t:
-                with common.Timer() as t:
-                    container = swift.get_object(
+                with common.span('head object'):
+                    headers = self.swift.head_object(
                         parsed_args.container_name,
                         parsed_args.object_name)
+
+                if parsed_args.verify_content:
+                    with common.span('download object') as download:
+                        size = self.verify_content(parsed_args)
         except swiftclient.exceptions.ClientException as exc:
             if exc.http_status == 404:
                 msg = 'Object {} in container {} does not exist'.format(
                     parsed_args.object_name,
                     parsed_args.container_name)
             else:
-                msg = 'Failed to retrieve object {} fromContainer container {}: {}'.format(
+                msg = ('Failed to retrieve object {} from '
+                       'container {}: {}').format(
                     parsed_args.object_name,
                     parsed_args.container_name,
-                    exc),
+                    exc)
 
             return (common.RET_CRIT, msg, t)
+        except ContentMismatch as exc:
+            return (common.RET_CRIT,
+                    'Object {} in container {} is corrupt: {}'.format(
+                        parsed_args.object_name,
+                        parsed_args.container_name,
+                        exc),
+                    t)
 
         msg = 'Found object {} in container {} with {} bytes'.format(
             parsed_args.object_name,
             parsed_args.container_name,
-            container[0]['content-length'])
+            headers['content-length'])
+
+        if parsed_args.verify_content:
+            msg = '{}\nVerified content at {:0.2f} MB/s'.format(
+                msg, self.record_transfer('download', size,
+                                          download.interval))
+
+        return (common.RET_OKAY, msg, t)
+
+
+class CheckObjectCreateDelete(common.BandwidthCommand, SwiftCommand):
+    '''Upload a test object, download it and check its content, and
+    delete it, reporting the upload and download bandwidth.  With
+    --segment-size the object is uploaded as a static large object,
+    several segments at a time.  The object's name ends with a random
+    run ID, so that runs that overlap don't delete each other's
+    objects.'''
+
+    default_timeout_warning = 20
+    default_timeout_critical = 40
+
+    def get_parser(self, prog_name):
+        p = super(CheckObjectCreateDelete, self).get_parser(prog_name)
+
+        g = p.add_argument_group('Object Storage API Options')
+        g.add_argument('--container-name', '--container',
+                       default='monitoring-test')
+        g.add_argument('--object-name-prefix', '--name',
+                       default='monitoring-test',
+                       help='Name the test object with this prefix and '
+                       'a random run ID')
+        g.add_argument('--segment-size', type=float, default=0,
+                       help='Upload the object in segments of this many '
+                       'MB (default: in one piece)')
+        g.add_argument('--segment-workers', type=int, default=4,
+                       help='Number of segments to upload at once')
+        g.add_argument('--chunk-size', type=int, default=65536,
+                       help='Send and receive data this many bytes at '
+                       'a time')
+        g.add_argument('object_size', nargs='?', default=10, type=float,
+                       help='Size of the test object in MB (default 10)')
+
+        return p
+
+    def segments_container(self, parsed_args):
+        return '{}_segments'.format(parsed_args.container_name)
+
+    def create_containers(self, parsed_args, ctx):
+        '''Create test containers'''
+
+        self.swift.put_container(parsed_args.container_name)
+        if ctx.payload.size > ctx.segment_size:
+            self.swift.put_container(self.segments_container(parsed_args))
+
+    def put_segment(self, parsed_args, ctx, i, segment):
+        name = '{}/{:08d}'.format(ctx.object_name, i)
+        etag = self.connection().put_object(
+            self.segments_container(parsed_args), name, segment,
+            content_length=segment.size,
+            chunk_size=parsed_args.chunk_size)
+        ctx.segments.append(name)
+
+        return {
+            'path': '/{}/{}'.format(self.segments_container(parsed_args),
+                                    name),
+            'etag': etag,
+            'size_bytes': segment.size,
+        }
+
+    def collect_segments(self, tasks):
+        '''Return the manifest entries for the segment uploads `tasks`.
+        If one fails the uploads that haven't started are cancelled,
+        but those under way are waited for so that the cleanup knows
+        about every segment that was uploaded.'''
+
+        manifest = []
+        failure = None
+        for task in tasks:
+            try:
+                manifest.append(task.result())
+            except executor.CancelledError:
+                pass
+            except swiftclient.exceptions.ClientException as exc:
+                failure = failure or exc
+                for other in tasks:
+                    other.cancel()
+
+        if failure is not None:
+            raise failure
+
+        return manifest
+
+    def upload_test_object(self, parsed_args, ctx):
+        '''Upload test object'''
+
+        with common.Timer() as t:
+            if ctx.payload.size <= ctx.segment_size:
+                self.swift.put_object(
+                    parsed_args.container_name, ctx.object_name,
+                    ctx.payload, content_length=ctx.payload.size,
+                    chunk_size=parsed_args.chunk_size)
+                ctx.object_created = True
+            else:
+                segments = ctx.payload.segments(ctx.segment_size)
+                with executor.Executor(
+                        workers=parsed_args.segment_workers) as pool:
+                    tasks = [pool.submit(self.put_segment, parsed_args,
+                                         ctx, i, segment)
+                             for i, segment in enumerate(segments)]
+                    manifest = self.collect_segments(tasks)
+
+                with common.span('put manifest'):
+                    self.swift.put_object(
+                        parsed_args.container_name, ctx.object_name,
+                        json.dumps(manifest),
+                        query_string='multipart-manifest=put')
+                ctx.object_created = True
+
+        ctx.upload = self.record_transfer('upload', ctx.payload.size,
+                                          t.interval)
+
+    def download_test_object(self, parsed_args, ctx):
+        '''Download and verify test object'''
+
+        with common.Timer() as t:
+            headers, body = self.swift.get_object(
+                parsed_args.container_name, ctx.object_name,
+                resp_chunk_size=parsed_args.chunk_size)
+
+            md5 = hashlib.md5()
+            size = 0
+            for chunk in body:
+                md5.update(chunk)
+                size += len(chunk)
+
+        if size != ctx.payload.size:
+            raise common.ExitCritical(
+                'Downloaded {} bytes of test object, expected {}'.format(
+                    size, ctx.payload.size))
+
+        if md5.hexdigest() != ctx.payload.md5():
+            raise common.ExitCritical(
+                'Downloaded test object does not match what was uploaded')
+
+        ctx.download = self.record_transfer('download', size, t.interval)
+
+    def delete_test_object(self, parsed_args, ctx):
+        '''Delete test object'''
+
+        query_string = None
+        if ctx.payload.size > ctx.segment_size:
+            query_string = 'multipart-manifest=delete'
+
+        self.swift.delete_object(
+            parsed_args.container_name, ctx.object_name,
+            query_string=query_string)
+        ctx.object_created = False
+
+        # Deleting the manifest deleted its segments too.
+        if query_string is not None:
+            ctx.segments = []
+
+    def delete_segment(self, parsed_args, name):
+        try:
+            self.connection().delete_object(
+                self.segments_container(parsed_args), name)
+        except swiftclient.exceptions.ClientException as exc:
+            if exc.http_status != 404:
+                self.log.warning('failed to delete segment %s: %s',
+                                 name, exc)
+
+    def cleanup(self, parsed_args, ctx):
+        '''Delete the test object if it was created, and any segments
+        that were uploaded without a manifest to delete them with
+        (because a segment or the manifest failed to upload).'''
+
+        if ctx.object_created:
+            self.delete_test_object(parsed_args, ctx)
+
+        if ctx.segments:
+            with common.span('delete segments'):
+                with executor.Executor(
+                        workers=parsed_args.segment_workers) as pool:
+                    for task in [pool.submit(self.delete_segment,
+                                             parsed_args, name)
+                                 for name in ctx.segments]:
+                        task.result()
+            ctx.segments = []
+
+    def take_action(self, parsed_args):
+        '''Check that objects can be uploaded, downloaded and deleted.'''
+        super(CheckObjectCreateDelete, self).take_action(parsed_args)
+
+        test_plan = (
+            self.create_containers,
+            self.upload_test_object,
+            self.download_test_object,
+            self.delete_test_object,
+        )
+
+        ctx = lambda: None
+        ctx.run = uuid.uuid4().hex
+        ctx.object_name = '{}-{}'.format(parsed_args.object_name_prefix,
+                                         ctx.run[:12])
+        ctx.object_created = False
+        ctx.segments = []
+        ctx.payload = payload.Payload(int(parsed_args.object_size * 1e6),
+                                      seed=ctx.run)
+        ctx.segment_size = ctx.payload.size
+        if parsed_args.segment_size:
+            ctx.segment_size = max(1, int(parsed_args.segment_size * 1e6))
+
+        with common.Timer() as t:
+            try:
+                for step in test_plan:
+                    self.log.info('running step: {}'.format(
+                        step.__doc__))
+                    with common.span(step.__doc__):
+                        step(parsed_args, ctx)
+            except swiftclient.exceptions.ClientException as exc:
+                raise common.ExitCritical(
+                    '{} failed: {}'.format(step.__doc__, exc))
+            finally:
+                try:
+                    self.cleanup(parsed_args, ctx)
+                except swiftclient.exceptions.ClientException as exc:
+                    raise common.ExitCritical(
+                        'Failed to delete test object: {}'.format(exc))
+
+        msg = ('Successfully uploaded, downloaded and deleted object {} '
+               '({} bytes)\n'
+               'Upload {:0.2f} MB/s, download {:0.2f} MB/s').format(
+                   ctx.object_name, ctx.payload.size,
+                   ctx.upload, ctx.download)
 
         return (common.RET_OKAY, msg, t)
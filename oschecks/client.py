@@ -0,0 +1,162 @@
+'''A client for the `oschecks serve` daemon.
+
+This is installed as `oschecks-client`.  It takes the same arguments as
+`oschecks` and prints the same output and exits with the same status,
+but asks a running daemon to perform the check.  It deliberately
+imports nothing beyond the standard library so that it starts quickly,
+which makes it suitable for use from NRPE or cron.'''
+
+from __future__ import print_function
+
+import argparse
+import errno
+import json
+import os
+import pwd
+import socket
+import stat
+import sys
+
+from oschecks.exitcodes import RET_WTF
+
+
+def socket_dir():
+    '''Return the directory for the default socket: $XDG_RUNTIME_DIR
+    if it is set, and otherwise a directory in /tmp that only the
+    current user may use, which `oschecks serve` creates.'''
+
+    if 'XDG_RUNTIME_DIR' in os.environ:
+        return os.environ['XDG_RUNTIME_DIR']
+
+    return '/tmp/oschecks-{}'.format(os.getuid())
+
+
+def default_socket_path():
+    '''Return the socket path used by both `oschecks serve` and
+    `oschecks-client` unless told otherwise.'''
+
+    if 'OSCHECKS_SOCKET' in os.environ:
+        return os.environ['OSCHECKS_SOCKET']
+
+    return os.path.join(socket_dir(), 'oschecks.sock')
+
+
+def check_directory(path, owner=None):
+    '''Raise ValueError unless the directory `path` belongs to `owner`
+    (by default, the current user) or root, and no one else can
+    replace the files in it.'''
+
+    owner = os.getuid() if owner is None else owner
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise ValueError('{} is not a directory'.format(path))
+    if info.st_uid not in (owner, 0):
+        raise ValueError('{} is owned by uid {}'.format(path, info.st_uid))
+    if info.st_mode & 0o022 and not info.st_mode & stat.S_ISVTX:
+        raise ValueError('{} is writable by other users'.format(path))
+
+
+def check_socket(path, owner=None):
+    '''Raise ValueError unless `path` is a socket that belongs to
+    `owner` (by default, the current user), in a directory that no one
+    else can replace it in, so that checks (and their credentials) are
+    never sent to a daemon run by someone else.  A missing socket is
+    left for connect() to report.'''
+
+    owner = os.getuid() if owner is None else owner
+    check_directory(os.path.dirname(os.path.abspath(path)), owner)
+    try:
+        info = os.lstat(path)
+    except OSError as exc:
+        if exc.errno == errno.ENOENT:
+            return
+        raise
+
+    if not stat.S_ISSOCK(info.st_mode):
+        raise ValueError('{} is not a socket'.format(path))
+    if info.st_uid != owner:
+        raise ValueError('{} is owned by uid {}, not {}'.format(
+            path, info.st_uid, owner))
+
+
+def owner_uid(owner):
+    '''Return the uid of `owner`, a user name or number.'''
+
+    try:
+        return int(owner)
+    except ValueError:
+        pass
+
+    try:
+        return pwd.getpwnam(owner).pw_uid
+    except KeyError:
+        raise argparse.ArgumentTypeError(
+            'no such user: {}'.format(owner))
+
+
+def send_message(sock, message):
+    '''Messages are JSON documents terminated by a newline.'''
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def recv_message(fd):
+    line = fd.readline()
+    if not line:
+        raise ValueError('connection closed without a response')
+
+    return json.loads(line.decode('utf-8'))
+
+
+def request(path, argv, timeout=None, owner=None):
+    '''Ask the daemon listening on `path` to run the check named by
+    `argv`.  Returns a dictionary with `exitcode` and `output` keys.
+    Raises ValueError if the socket doesn't belong to `owner` (see
+    check_socket).'''
+
+    check_socket(path, owner)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        send_message(sock, {'argv': argv})
+        with sock.makefile('rb') as fd:
+            return recv_message(fd)
+    finally:
+        sock.close()
+
+
+def main(args=None):
+    p = argparse.ArgumentParser(
+        description='Run an oschecks check using the oschecks daemon')
+    p.add_argument('--socket', '-s', default=default_socket_path())
+    p.add_argument('--timeout', '-t', type=float, default=60,
+                   help='Give up if the daemon has not responded after '
+                   'this many seconds')
+    p.add_argument('--socket-owner', type=owner_uid, default=os.getuid(),
+                   help='User (name or uid) the daemon runs as; the client '
+                   'refuses to use a socket owned by anyone else '
+                   '(default: the current user)')
+    p.add_argument('argv', nargs=argparse.REMAINDER,
+                   help='A check and its arguments, e.g. "nova api"')
+
+    args = p.parse_args(args)
+
+    try:
+        response = request(args.socket, args.argv, timeout=args.timeout,
+                           owner=args.socket_owner)
+    except (socket.error, socket.timeout, OSError, ValueError) as exc:
+        print('UNKNOWN: Failed to contact oschecks daemon at {}: {}'.format(
+            args.socket, exc))
+        return RET_WTF
+
+    print(response['output'])
+    return response['exitcode']
+
+
+def cli():
+    sys.exit(main())
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,39 +1,277 @@
 from __future__ import print_function
 
 import cliff.command
+import contextlib
+import json
 import logging
+import os
+import re
+import threading
 import time
 
 from oschecks.exitcodes import (  # NOQA
     Exitcode, ExitCritical, ExitWarning, ExitOkay,
-    RET_OKAY, RET_WARN, RET_CRIT
+    RET_OKAY, RET_WARN, RET_CRIT, RET_WTF,
+    worst_exitcode,
 )
+import oschecks.cache as cache
+import oschecks.exitcodes as exitcodes
+import oschecks.pagination as pagination
+
+
+class Perfdata(object):
+    '''A single Nagios performance data value, rendered as
+    `'label'=value[uom];[warn];[crit];[min];[max]`.'''
+
+    def __init__(self, label, value, uom='', warning=None, critical=None,
+                 minimum=None, maximum=None):
+        self.label = label
+        self.value = value
+        self.uom = uom
+        self.warning = warning
+        self.critical = critical
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @staticmethod
+    def format_value(value):
+        if value is None:
+            return ''
+        elif isinstance(value, float):
+            return '{:0.4f}'.format(value)
+        else:
+            return str(value)
+
+    def __str__(self):
+        label = self.label
+        if any(c in label for c in " '="):
+            label = "'{}'".format(label.replace("'", "''"))
+
+        fields = [self.format_value(self.value) + self.uom] + [
+            self.format_value(value) for value in
+            (self.warning, self.critical, self.minimum, self.maximum)]
+
+        return '{}={}'.format(label, ';'.join(fields).rstrip(';'))
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class Result(object):
+    '''The outcome of running a check: an exit code, a message and (for
+    timed checks) the Timer that measured the operation, along with
+    any performance data and per-phase timings.
+
+    Converting a Result to a string renders it in its `format`: either
+    the Nagios plugin format (`LABEL: message | perfdata`) or a JSON
+    document.
+
+    A result taken from the result cache has an `age`: the number of
+    seconds since the check actually ran.'''
+
+    def __init__(self, exitcode, msg, timer=None):
+        self.exitcode = exitcode
+        self.msg = msg
+        self.timer = timer
+        self.thresholds = {}
+        self.perfdata = []
+        self.phases = []
+        self.format = 'text'
+        self.age = None
+
+    @classmethod
+    def from_dict(cls, doc):
+        '''Rebuild a Result from the output of `as_dict`, without its
+        phases.'''
+
+        timer = None
+        if doc['elapsed'] is not None:
+            timer = Timer()
+            timer.interval = doc['elapsed']
+
+        result = cls(doc['exitcode'], doc['msg'], timer)
+        result.thresholds = doc['thresholds']
+        result.perfdata = [Perfdata(**perf) for perf in doc['perfdata']]
+
+        return result
+
+    @property
+    def label(self):
+        return exitcodes.labels.get(self.exitcode, 'UNKNOWN')
+
+    @property
+    def elapsed(self):
+        return self.timer.interval if self.timer is not None else None
+
+    def add_perfdata(self, *args, **kwargs):
+        self.perfdata.append(Perfdata(*args, **kwargs))
+
+    def as_dict(self):
+        return {
+            'exitcode': self.exitcode,
+            'label': self.label,
+            'msg': self.msg,
+            'elapsed': self.elapsed,
+            'thresholds': self.thresholds,
+            'perfdata': [perf.as_dict() for perf in self.perfdata],
+            'phases': [phase.as_dict() for phase in self.phases],
+            'age': self.age,
+        }
+
+    def as_text(self):
+        # Nagios expects performance data at the end of the first line
+        # of output.
+        summary, sep, details = self.msg.partition('\n')
+        if self.age is not None:
+            summary = '{} (cached {:0.0f} seconds ago)'.format(
+                summary, self.age)
+        if self.perfdata:
+            summary = '{} | {}'.format(
+                summary, ' '.join(str(perf) for perf in self.perfdata))
+
+        return '{}: {}{}{}'.format(self.label, summary, sep, details)
+
+    def as_json(self):
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def __str__(self):
+        if self.format == 'json':
+            return self.as_json()
+        else:
+            return self.as_text()
 
 
 class CheckCommand (cliff.command.Command):
 
+    # Results are only cached if this (or --cache-ttl) is set.
+    default_cache_ttl = 0
+
+    # Options that don't change what a check does, and so don't
+    # distinguish one cached result from another.
+    uncached_options = ('format', 'cache_ttl', 'cache_size')
+
     def __init__(self, *args, **kwargs):
         super(CheckCommand, self).__init__(*args, **kwargs)
 
         self.log = logging.getLogger(
             '{0.__class__.__module__}.{0.__class__.__name__}'.format(self))
 
-    def format_result(self, retcode, msg):
-        label = {
-            RET_OKAY: 'OKAY',
-            RET_WARN: 'WARNING',
-            RET_CRIT: 'CRITICAL',
-        }.get(retcode, 'UNKNOWN')
+    def get_parser(self, prog_name):
+        p = super(CheckCommand, self).get_parser(prog_name)
+        g = p.add_argument_group('Output Options')
+        g.add_argument('--format', '-f', choices=['text', 'json'],
+                       default='text',
+                       help='Print results as Nagios plugin output '
+                       '(with performance data) or as JSON')
+
+        g = p.add_argument_group('Result Cache Options')
+        g.add_argument('--cache-ttl', type=float,
+                       default=self.default_cache_ttl,
+                       help='Reuse the result of the same check run by '
+                       'any oschecks process within this many seconds')
+        g.add_argument('--cache-size', type=int, default=1000,
+                       help='Maximum number of results to cache')
+
+        return p
 
-        print('{}: {}'.format(label, msg))
+    def format_result(self, retcode, msg):
+        print(Result(retcode, msg))
         return retcode
 
-    def run(self, parsed_args):
+    def get_result(self, parsed_args):
         try:
             exitcode, msg = self.take_action(parsed_args)
-            return self.format_result(exitcode, msg)
         except Exitcode as exc:
-            return self.format_result(exc.exitcode, str(exc))
+            return Result(exc.exitcode, str(exc))
+
+        return Result(exitcode, msg)
+
+    def check(self, parsed_args):
+        '''Run the check and return a Result rather than printing
+        it.  This is what `run` uses, and what lets other commands run
+        checks in-process.
+
+        Everything the check does is timed by a span named after the
+        command.  The spans opened inside it (see `span`) are logged
+        when running verbosely and attached to the result as its
+        phases.
+
+        With --cache-ttl, a recent result of the same check with the
+        same arguments is returned instead, if there is one.'''
+
+        if getattr(parsed_args, 'cache_ttl', None):
+            result = self.cached_check(parsed_args)
+        else:
+            result = self.timed_check(parsed_args)
+
+        result.format = getattr(parsed_args, 'format', 'text')
+
+        return result
+
+    def timed_check(self, parsed_args):
+        with span(self.cmd_name or self.__class__.__name__) as root:
+            result = self.get_result(parsed_args)
+
+        for line in root.format():
+            self.log.info(line)
+
+        result.phases.extend(root.children)
+
+        return result
+
+    def cache_key(self, parsed_args):
+        '''Identify a check by its name, its arguments and the OS_*
+        environment variables that select and authenticate to a
+        cloud.'''
+
+        args = dict((name, value)
+                    for name, value in vars(parsed_args).items()
+                    if name not in self.uncached_options)
+        environ = dict((name, value)
+                       for name, value in os.environ.items()
+                       if name.startswith('OS_'))
+
+        return cache.result_cache_key(
+            self.cmd_name or self.__class__.__name__, args, environ)
+
+    def cached_check(self, parsed_args):
+        results = []
+
+        def run_check():
+            result = self.timed_check(parsed_args)
+            results.append(result)
+
+            # Don't keep results that say the check itself broke.
+            if result.exitcode != RET_WTF:
+                return result.as_dict()
+
+        # Waiting longer than the critical threshold for another
+        # process to run the same check can only end in CRITICAL.
+        try:
+            doc, age = cache.ResultCache(
+                max_entries=parsed_args.cache_size).fetch(
+                    self.cache_key(parsed_args), parsed_args.cache_ttl,
+                    run_check,
+                    timeout=getattr(parsed_args, 'timeout_critical', None)
+                    or None)
+        except (IOError, OSError) as exc:
+            self.log.warning('result cache unavailable: %s', exc)
+            if results:
+                return results[0]
+            return self.timed_check(parsed_args)
+
+        if age is None:
+            return results[0]
+
+        result = Result.from_dict(doc)
+        result.age = age
+
+        return result
+
+    def run(self, parsed_args):
+        result = self.check(parsed_args)
+        print(result)
+        return result.exitcode
 
 
 class LimitCommand (CheckCommand):
@@ -41,9 +279,30 @@ class LimitCommand (CheckCommand):
         p = super(LimitCommand, self).get_parser(prog_name)
         g = p.add_argument_group('Limit Options')
         g.add_argument('--limit', '-l', type=int, default=1)
+        g.add_argument('--count', action='store_true',
+                       help='Count every resource, a page at a time, '
+                       'instead of listing --limit of them')
+        g.add_argument('--page-size', type=int, default=1000,
+                       help='Number of resources to request at a time '
+                       'when counting')
+        g.add_argument('--count-cap', type=int, default=100000,
+                       help='Stop counting after this many resources '
+                       '(0 for no limit)')
 
         return p
 
+    def count_resources(self, parsed_args, list_page,
+                        marker_of=lambda item: item.id):
+        '''Count resources with `list_page(marker, limit)` a page at a
+        time, up to --count-cap, and return a pagination.Count.'''
+
+        cap = parsed_args.count_cap or None
+        items = pagination.paginate(list_page, parsed_args.page_size,
+                                    limit=cap + 1 if cap else None,
+                                    marker_of=marker_of)
+
+        return pagination.count(items, cap)
+
 
 class TimeoutCommand (CheckCommand):
     default_timeout_warning = 5
@@ -60,33 +319,129 @@ class TimeoutCommand (CheckCommand):
 
         return p
 
-    def run(self, parsed_args):
+    def get_result(self, parsed_args):
         try:
             exitcode, msg, t = self.take_action(parsed_args)
         except Exitcode as exc:
-            return self.format_result(exc.exitcode, str(exc))
+            return Result(exc.exitcode, str(exc))
 
         # If we have no interval information, just exit normally.
         if t is None:
-            return self.format_result(exitcode, msg)
+            return Result(exitcode, msg)
 
-        msg = '{} ({:0.4f} seconds)'.format(msg, t.interval)
+        # Report the time on the first line of the message, so that
+        # it stays in the summary of a multi-line message.
+        summary, sep, details = msg.partition('\n')
+        msg = '{} ({:0.4f} seconds){}{}'.format(
+            summary, t.interval, sep, details)
 
         # If there was a problem, don't override the status
         # based on the timeouts.
-        if exitcode != RET_OKAY:
-            return self.format_result(exitcode, msg)
-
-        # Modify the return status based on how long
-        # the operation took to complete.
-        if (parsed_args.timeout_critical and
-                t.interval >= parsed_args.timeout_critical):
-            return self.format_result(RET_CRIT, msg)
-        elif (parsed_args.timeout_warning and
-                t.interval >= parsed_args.timeout_warning):
-            return self.format_result(RET_WARN, msg)
-        else:
-            return self.format_result(RET_OKAY, msg)
+        if exitcode == RET_OKAY:
+            # Modify the return status based on how long
+            # the operation took to complete.
+            if (parsed_args.timeout_critical and
+                    t.interval >= parsed_args.timeout_critical):
+                exitcode = RET_CRIT
+            elif (parsed_args.timeout_warning and
+                    t.interval >= parsed_args.timeout_warning):
+                exitcode = RET_WARN
+
+        result = Result(exitcode, msg, t)
+        result.thresholds = {
+            'warning': parsed_args.timeout_warning,
+            'critical': parsed_args.timeout_critical,
+        }
+        result.add_perfdata('time', t.interval, 's',
+                            warning=parsed_args.timeout_warning or None,
+                            critical=parsed_args.timeout_critical or None,
+                            minimum=0)
+
+        return result
+
+
+class BandwidthCommand (CheckCommand):
+    '''A check that transfers data and reports how fast it went.  The
+    check calls `record_transfer` for each transfer it makes; each is
+    reported as `<name>_bandwidth` (in MB/s) and `<name>_time`
+    performance data, and a bandwidth below --bandwidth-warning or
+    --bandwidth-critical changes an OKAY result to WARNING or
+    CRITICAL.
+
+    List this class before the other base classes of a check, so that
+    its get_result wraps theirs.'''
+
+    default_bandwidth_warning = None
+    default_bandwidth_critical = None
+
+    def get_parser(self, prog_name):
+        p = super(BandwidthCommand, self).get_parser(prog_name)
+        g = p.add_argument_group('Bandwidth Options')
+
+        g.add_argument('--bandwidth-warning', type=float,
+                       default=self.default_bandwidth_warning,
+                       help='Warn if any transfer is slower than this '
+                       'many MB/s')
+        g.add_argument('--bandwidth-critical', type=float,
+                       default=self.default_bandwidth_critical,
+                       help='Go critical if any transfer is slower than '
+                       'this many MB/s')
+
+        return p
+
+    def record_transfer(self, name, size, interval):
+        '''Record that transferring `size` bytes took `interval`
+        seconds, and return the bandwidth in MB/s.'''
+
+        bandwidth = size / max(interval, 1e-6) / 1e6
+        self.transfers.append((name, bandwidth, interval))
+        return bandwidth
+
+    def get_result(self, parsed_args):
+        self.transfers = []
+        result = super(BandwidthCommand, self).get_result(parsed_args)
+
+        for name, bandwidth, interval in self.transfers:
+            result.add_perfdata('{}_bandwidth'.format(name), bandwidth,
+                                'MB/s',
+                                warning=parsed_args.bandwidth_warning,
+                                critical=parsed_args.bandwidth_critical,
+                                minimum=0)
+            result.add_perfdata('{}_time'.format(name), interval, 's',
+                                minimum=0)
+
+            if result.exitcode not in (RET_OKAY, RET_WARN):
+                continue
+
+            for exitcode, threshold in (
+                    (RET_CRIT, parsed_args.bandwidth_critical),
+                    (RET_WARN, parsed_args.bandwidth_warning)):
+                if threshold and bandwidth < threshold:
+                    result.exitcode = worst_exitcode(
+                        [result.exitcode, exitcode])
+                    result.msg = ('{}\n{} bandwidth {:0.2f} MB/s is below '
+                                  '{:g} MB/s').format(
+                        result.msg, name, bandwidth, threshold)
+                    break
+
+        result.thresholds.update({
+            'bandwidth_warning': parsed_args.bandwidth_warning,
+            'bandwidth_critical': parsed_args.bandwidth_critical,
+        })
+
+        return result
+
+
+id_pattern = re.compile(r'^[0-9a-f]{8}-?([0-9a-f]{4}-?){3}[0-9a-f]{12}$', re.I)
+
+
+def looks_like_id(value):
+    '''Return True if `value` has the shape of a resource ID (a UUID,
+    with or without dashes).  Anything else can only be a name, so
+    there is no point asking the API for a resource with that ID
+    first.'''
+
+    return id_pattern.match(value) is not None
 
 
 class TimeoutError(Exception):
@@ -125,3 +480,93 @@ class Timer(object):
             delta = time_now - self.time_start
             if delta > self.timeout:
                 raise TimeoutError(delta)
+
+
+class Span(Timer):
+    '''A named Timer that records the Spans opened while it is running,
+    giving a tree of timings for the parts of an operation.  Spans are
+    normally created with the `span` function rather than directly.'''
+
+    def __init__(self, name, timeout=None):
+        super(Span, self).__init__(timeout=timeout)
+        self.name = name
+        self.children = []
+
+    @classmethod
+    def completed(cls, name, interval):
+        '''Return a Span for an operation that has already finished.'''
+        span = cls(name)
+        span.time_end = time.time()
+        span.time_start = span.time_end - interval
+        span.interval = interval
+        return span
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'elapsed': self.interval,
+            'children': [child.as_dict() for child in self.children],
+        }
+
+    def format(self, depth=0):
+        '''Return a list of lines describing this span and its
+        children, indented to show nesting.'''
+
+        lines = ['{}{}: {:0.4f} seconds'.format(
+            '  ' * depth, self.name, self.interval)]
+        for child in self.children:
+            lines.extend(child.format(depth + 1))
+
+        return lines
+
+
+# The span that is currently open in each thread.
+_spans = threading.local()
+
+
+def current_span():
+    return getattr(_spans, 'current', None)
+
+
+@contextlib.contextmanager
+def activate(parent):
+    '''Make `parent` the current span in this thread, so that spans
+    opened in another thread (for example by an executor worker) are
+    recorded as its children.'''
+
+    previous = current_span()
+    _spans.current = parent
+    try:
+        yield parent
+    finally:
+        _spans.current = previous
+
+
+@contextlib.contextmanager
+def span(name, timeout=None):
+    '''Time an operation as a Span, recorded as a child of the current
+    span (if there is one).  Use it like a Timer:
+
+        with span('list servers') as t:
+            ...do something...
+
+    The resulting tree of spans is reported with the result of a check
+    as its phases.'''
+
+    parent = current_span()
+    child = Span(name, timeout=timeout)
+    if parent is not None:
+        parent.children.append(child)
+
+    with activate(child):
+        with child:
+            yield child
+
+
+def record_span(name, interval):
+    '''Record an operation that has already completed as a child of the
+    current span.'''
+
+    parent = current_span()
+    if parent is not None:
+        parent.children.append(Span.completed(name, interval))
@@ -0,0 +1,162 @@
+import cliff.command
+import errno
+import logging
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import oschecks.client as client
+import oschecks.openstack as openstack
+import oschecks.runner as runner
+
+LOG = logging.getLogger(__name__)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    '''Reads a single request from an oschecks-client, runs the check
+    and writes back the exit code and output.'''
+
+    def handle(self):
+        try:
+            request = client.recv_message(self.rfile)
+            argv = [str(arg) for arg in request['argv']]
+        except (ValueError, KeyError, TypeError) as exc:
+            LOG.warning('invalid request: %s', exc)
+            return
+
+        # A check that runs past its critical threshold is reported as
+        # CRITICAL rather than holding up the client, but keeps its
+        # slot until it returns.
+        LOG.info('running %s', ' '.join(argv))
+        self.server.slots.acquire()
+        result = self.server.runner.run_with_deadline(
+            argv, on_finished=self.server.slots.release)
+
+        try:
+            client.send_message(self.connection, {
+                'exitcode': result.exitcode,
+                'output': str(result),
+            })
+        except socket.error as exc:
+            LOG.warning('failed to send result: %s', exc)
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, runner, workers):
+        self.runner = runner
+        self.slots = threading.BoundedSemaphore(workers)
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+
+def remove_stale_socket(path):
+    '''Remove a socket left behind by a daemon that is no longer
+    running.  Raises ValueError if a daemon is still listening.'''
+
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise ValueError('{} exists and is not a socket'.format(path))
+    except OSError as exc:
+        if exc.errno == errno.ENOENT:
+            return
+        raise
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        os.unlink(path)
+    else:
+        raise ValueError('another daemon is listening on {}'.format(path))
+    finally:
+        sock.close()
+
+
+def make_socket_dir(path):
+    '''Create the private directory for the default socket if `path`
+    is in it, and make sure that no other user can replace the socket
+    in the directory of `path`.'''
+
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory == client.socket_dir():
+        try:
+            os.mkdir(directory, 0o700)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    client.check_directory(directory)
+
+
+class Serve(cliff.command.Command):
+    '''Run checks on behalf of oschecks-client.  The daemon keeps the
+    client libraries imported and authenticated sessions open between
+    checks, so each check costs only the API calls it makes.'''
+
+    def get_parser(self, prog_name):
+        p = super(Serve, self).get_parser(prog_name)
+        p.add_argument('--socket', '-s', default=client.default_socket_path())
+        p.add_argument('--socket-mode', type=lambda mode: int(mode, 8),
+                       default=0o600,
+                       help='Permissions (in octal) for the socket')
+        p.add_argument('--workers', '-j', type=int, default=10,
+                       help='Maximum number of checks to run at once')
+        p.add_argument('--no-preload', dest='preload',
+                       action='store_false',
+                       help='Import check modules on first use rather '
+                       'than at startup')
+
+        return p
+
+    def preload(self):
+        '''Import every check (and the client library it uses) now, so
+        that the first request for each check is not slowed down by
+        imports.'''
+
+        for name, ep in self.app.command_manager:
+            try:
+                ep.load()
+            except Exception as exc:
+                LOG.warning('failed to load %s: %s', name, exc)
+
+    def take_action(self, parsed_args):
+        if parsed_args.preload:
+            self.preload()
+
+        self.app.session_pool = openstack.SessionPool()
+        check_runner = runner.CheckRunner(self.app, self.app_args)
+
+        make_socket_dir(parsed_args.socket)
+        remove_stale_socket(parsed_args.socket)
+
+        # Create the socket with its final permissions, rather than
+        # changing them after anyone could have connected.
+        umask = os.umask(0o777 & ~parsed_args.socket_mode)
+        try:
+            server = Server(parsed_args.socket, check_runner,
+                            parsed_args.workers)
+        finally:
+            os.umask(umask)
+
+        # Turn SIGTERM into a normal exit so that we clean up after
+        # ourselves.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        LOG.info('listening on %s', parsed_args.socket)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(parsed_args.socket)
+            self.app.session_pool.close()
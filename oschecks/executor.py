@@ -0,0 +1,158 @@
+import concurrent.futures
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import oschecks.common as common
+
+TimeoutError = concurrent.futures.TimeoutError
+CancelledError = concurrent.futures.CancelledError
+
+
+class Task(object):
+    '''A unit of work submitted to an Executor.  The deadline for a task
+    with a timeout is measured from when a worker starts running it,
+    not from when it was submitted, so time spent waiting in the queue
+    for a free worker does not count against it.
+
+    Spans opened by the task are recorded under the span that was
+    current when it was submitted.'''
+
+    def __init__(self, func, args, kwargs, timeout=None, executor=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.started = threading.Event()
+        self.time_start = None
+        self.future = None
+        self.executor = executor
+        self.abandoned = False
+        self.parent_span = common.current_span()
+
+    def __call__(self):
+        self.time_start = time.time()
+        self.started.set()
+        with common.activate(self.parent_span):
+            return self.func(*self.args, **self.kwargs)
+
+    def cancel(self):
+        '''Stop the task from starting if it hasn't yet, in which case
+        result() raises CancelledError.'''
+
+        return self.future.cancel()
+
+    def result(self):
+        '''Wait for the task and return its result.  Raises TimeoutError
+        if the task has a timeout and runs past it; the worker thread
+        cannot be interrupted, so it keeps running in the background but
+        the caller no longer waits for it, and the executor starts
+        another worker in its place so that the tasks queued behind it
+        still run.'''
+
+        if self.timeout is None:
+            return self.future.result()
+
+        self.started.wait()
+        remaining = self.time_start + self.timeout - time.time()
+        try:
+            return self.future.result(timeout=max(0, remaining))
+        except TimeoutError:
+            self.executor.abandon(self)
+            raise
+
+
+class Executor(object):
+    '''Runs tasks on a bounded pool of worker threads.  Use it like
+    this:
+
+        with Executor(workers=4) as pool:
+            tasks = [pool.submit(func, arg, timeout=10) for arg in args]
+            results = [task.result() for task in tasks]
+
+    Collecting results by iterating over the tasks returns them in
+    submission order, no matter in what order they complete.
+
+    The workers are daemon threads (unlike those of
+    concurrent.futures.ThreadPoolExecutor, which the interpreter waits
+    for when it exits), so a task that has timed out and been
+    abandoned can't keep the process from exiting once its result has
+    been reported.  Nor can an abandoned task hold up the tasks queued
+    behind it: its worker is replaced, and exits once the task
+    finishes.'''
+
+    def __init__(self, workers=4):
+        self.workers = max(1, workers)
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+
+            if not task.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = task()
+            except BaseException as exc:
+                task.future.set_exception(exc)
+            else:
+                task.future.set_result(result)
+
+            with self.lock:
+                if task.abandoned:
+                    # Another worker has taken our place.
+                    self.threads.remove(threading.current_thread())
+                    return
+
+    def start_worker(self):
+        thread = threading.Thread(target=self.work)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def abandon(self, task):
+        '''Start a worker to replace the one running `task`, which has
+        timed out, unless the task has finished in the meantime.'''
+
+        with self.lock:
+            if task.abandoned or task.future.done():
+                return
+
+            task.abandoned = True
+            self.start_worker()
+
+    def submit(self, func, *args, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        task = Task(func, args, kwargs, timeout=timeout, executor=self)
+        task.future = concurrent.futures.Future()
+
+        with self.lock:
+            # Start a worker for every task until there are `workers`
+            # of them.
+            if len(self.threads) < self.workers:
+                self.start_worker()
+
+        self.queue.put(task)
+        return task
+
+    def shutdown(self):
+        # Don't wait for tasks that have timed out; the threads exit
+        # when they finish.
+        with self.lock:
+            for thread in self.threads:
+                self.queue.put(None)
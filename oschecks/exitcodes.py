@@ -5,6 +5,26 @@ RET_WARN = 1
 RET_CRIT = 2
 RET_WTF = 3
 
+labels = {
+    RET_OKAY: 'OKAY',
+    RET_WARN: 'WARNING',
+    RET_CRIT: 'CRITICAL',
+}
+
+# When combining the results of several checks, a status later in this
+# list takes precedence over one earlier in the list.
+severity = [RET_OKAY, RET_WARN, RET_WTF, RET_CRIT]
+
+
+def worst_exitcode(exitcodes):
+    '''Return the most severe of the given exit codes (RET_OKAY if there
+    are none).  Unrecognized exit codes are treated as RET_WTF.'''
+
+    return max(
+        [exitcode if exitcode in severity else RET_WTF
+         for exitcode in exitcodes] or [RET_OKAY],
+        key=severity.index)
+
 
 class Exitcode(Exception):
     exitcode = RET_WTF
@@ -0,0 +1,250 @@
+'''Export the results of scheduled checks as Prometheus metrics.
+
+`oschecks export` runs the checks in a manifest on their own schedule
+(see oschecks.scheduler) and serves their results at /metrics in the
+Prometheus text exposition format.  The page is rendered again each
+time a check finishes, so a scrape only copies out the last rendering:
+however often Prometheus (or several Prometheus servers) scrape, the
+cloud sees the same API calls.'''
+
+from __future__ import print_function
+
+import collections
+import logging
+import math
+import os
+import threading
+import time
+
+try:
+    import http.server as http_server
+    import socketserver
+except ImportError:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+
+import oschecks.cache as cache
+import oschecks.common as common
+import oschecks.scheduler as scheduler
+import oschecks.stats as stats
+
+LOG = logging.getLogger(__name__)
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value):
+    '''Escape a label value for the text exposition format.'''
+
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def sample(name, labels, value):
+    '''Format one sample; `labels` is a list of (name, value) pairs.'''
+
+    if labels:
+        name = '{}{{{}}}'.format(name, ','.join(
+            '{}="{}"'.format(label, escape(value))
+            for label, value in labels))
+
+    return '{} {}'.format(name, format_value(value))
+
+
+def histogram_samples(name, labels, histogram):
+    for bound, count in histogram.cumulative():
+        yield sample(name + '_bucket',
+                     labels + [('le', format_value(bound))], count)
+    yield sample(name + '_sum', labels, histogram.sum)
+    yield sample(name + '_count', labels, histogram.count)
+
+
+class Metrics(object):
+    '''The metrics for a set of checks, updated with `add` as results
+    arrive (from any thread).  `page` is always a complete rendering of
+    the metrics as they were after the last update.
+
+    Check durations come from each result's Timer, and phase durations
+    from its top-level spans (such as `auth`, or `wait for available`).
+    A result served from the result cache counts towards the status
+    and run metrics but not the histograms, since its timings belong to
+    the check that stored it.  The token and result cache counters are
+    read from their stats.json files, which count the hits and misses
+    of every oschecks process sharing the cache directory.'''
+
+    def __init__(self, bounds=stats.default_buckets, counter_paths=None):
+        self.bounds = bounds
+        self.counter_paths = counter_paths or {}
+        self.lock = threading.Lock()
+        self.status = {}
+        self.last_run = {}
+        self.runs = collections.Counter()
+        self.durations = {}
+        self.phases = {}
+        self.counters = {}
+        self.page = self.render().encode('utf-8')
+
+    def add(self, name, result, now=None):
+        with self.lock:
+            self.status[name] = result.exitcode
+            self.last_run[name] = now or time.time()
+            self.runs[name, result.label] += 1
+
+            # Read the counters while holding the lock, so that a
+            # slower update can't replace them with older values.
+            self.counters = {}
+            for kind, path in self.counter_paths.items():
+                # Include the hits this process hasn't written out yet.
+                counters = cache.counters(path)
+                counters.flush()
+                self.counters[kind] = counters.read()
+
+            if result.age is None and result.elapsed is not None:
+                self.histogram(self.durations, name).add(result.elapsed)
+                for phase in result.phases:
+                    self.histogram(self.phases,
+                                   (name, phase.name)).add(phase.interval)
+
+            self.page = self.render().encode('utf-8')
+
+    def histogram(self, histograms, key):
+        if key not in histograms:
+            histograms[key] = stats.Histogram(self.bounds)
+
+        return histograms[key]
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+        family('oschecks_check_status', 'gauge',
+               'Exit code of the last run of the check (0 OK, '
+               '1 warning, 2 critical, 3 unknown).')
+        for name in sorted(self.status):
+            lines.append(sample('oschecks_check_status',
+                                [('check', name)], self.status[name]))
+
+        family('oschecks_check_last_run_timestamp_seconds', 'gauge',
+               'When the check last finished.')
+        for name in sorted(self.last_run):
+            lines.append(sample('oschecks_check_last_run_timestamp_seconds',
+                                [('check', name)], self.last_run[name]))
+
+        family('oschecks_check_runs_total', 'counter',
+               'Number of times the check has run, by result.')
+        for name, label in sorted(self.runs):
+            lines.append(sample('oschecks_check_runs_total',
+                                [('check', name), ('status', label)],
+                                self.runs[name, label]))
+
+        family('oschecks_check_duration_seconds', 'histogram',
+               'Time taken by the check.')
+        for name in sorted(self.durations):
+            lines.extend(histogram_samples(
+                'oschecks_check_duration_seconds', [('check', name)],
+                self.durations[name]))
+
+        family('oschecks_check_phase_duration_seconds', 'histogram',
+               'Time taken by each phase of the check.')
+        for name, phase in sorted(self.phases):
+            lines.extend(histogram_samples(
+                'oschecks_check_phase_duration_seconds',
+                [('check', name), ('phase', phase)],
+                self.phases[name, phase]))
+
+        for kind in sorted(self.counter_paths):
+            metric = 'oschecks_{}_cache_events_total'.format(kind)
+            family(metric, 'counter',
+                   'Number of {} cache events (such as hits and misses) '
+                   'in every process sharing the cache.'.format(kind))
+            counters = self.counters.get(kind, {})
+            for event in sorted(counters):
+                lines.append(sample(metric, [('event', event)],
+                                    counters[event]))
+
+        return '\n'.join(lines) + '\n'
+
+
+class RequestHandler(http_server.BaseHTTPRequestHandler):
+    '''Serves the last rendering of the metrics, without running
+    anything.'''
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        page = self.server.metrics.page
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, fmt, *args):
+        LOG.debug('%s ' + fmt, self.address_string(), *args)
+
+
+class Server(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, metrics):
+        self.metrics = metrics
+        http_server.HTTPServer.__init__(self, address, RequestHandler)
+
+
+class Export(scheduler.ScheduleCommand):
+    '''Run the checks in a manifest periodically, like `schedule`, and
+    serve their status, latency histograms and the token and result
+    cache counters as Prometheus metrics at /metrics.  Scrapes return
+    the metrics as of the last check to finish, and never run a
+    check.'''
+
+    def get_parser(self, prog_name):
+        p = super(Export, self).get_parser(prog_name)
+        p.add_argument('--listen-address', default='',
+                       help='Address to serve metrics on (default: all '
+                       'addresses)')
+        p.add_argument('--port', '-p', type=int, default=9470,
+                       help='Port to serve metrics on')
+
+        return p
+
+    def report(self, parsed_args, entry, result):
+        self.metrics.add(entry.job.name, result)
+
+    def take_action(self, parsed_args):
+        self.metrics = Metrics(counter_paths={
+            'token': os.path.join(cache.cache_dir('tokens'), 'stats.json'),
+            'result': os.path.join(cache.cache_dir('results'),
+                                   'stats.json'),
+        })
+
+        try:
+            server = Server((parsed_args.listen_address, parsed_args.port),
+                            self.metrics)
+        except (IOError, OSError) as exc:
+            print('UNKNOWN: Failed to listen on port {}: {}'.format(
+                parsed_args.port, exc))
+            return common.RET_WTF
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        LOG.info('serving metrics on port %d', server.server_address[1])
+        try:
+            return super(Export, self).take_action(parsed_args)
+        finally:
+            server.shutdown()
+            server.server_close()
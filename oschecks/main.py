@@ -1,10 +1,116 @@
 import cliff.app
 import cliff.commandmanager
+import importlib
 import oschecks
+import oschecks.cache as cache
+import os
 import sys
 import logging
 import argparse
 
+LOG = logging.getLogger(__name__)
+
+
+class EntryPoint(object):
+    '''A minimal stand-in for an entry point that imports its target
+    only when the command is actually used.'''
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def load(self):
+        module_name, _, attrs = self.value.partition(':')
+        obj = importlib.import_module(module_name)
+        for attr in attrs.split('.'):
+            obj = getattr(obj, attr)
+
+        return obj
+
+    # Older versions of cliff call resolve() rather than load().
+    resolve = load
+
+
+def find_entry_points_file():
+    '''Return the path to the entry_points.txt file installed with
+    oschecks, or None if it cannot be found.'''
+
+    pkgdir = os.path.dirname(os.path.dirname(os.path.abspath(
+        oschecks.__file__)))
+
+    for path in [pkgdir] + sys.path:
+        try:
+            names = os.listdir(path or '.')
+        except OSError:
+            continue
+
+        for name in names:
+            if (name.startswith('oschecks') and
+                    name.endswith(('.egg-info', '.dist-info'))):
+                candidate = os.path.join(path, name, 'entry_points.txt')
+                if os.path.exists(candidate):
+                    return candidate
+
+
+class CommandManager(cliff.commandmanager.CommandManager):
+    '''Looks up commands in a cache rather than asking stevedore to scan
+    for entry points, which imports every check module (and so every
+    OpenStack client library) just to run one of them.
+
+    The cache is rebuilt whenever the oschecks entry points or any
+    directory on sys.path changes, which covers installing, upgrading
+    and removing packages.'''
+
+    def cache_key(self, namespace):
+        entry_points = find_entry_points_file()
+        if entry_points is None:
+            return None
+
+        # Skip the current directory ('') so that the key does not
+        # depend on where we are run from.
+        key = [namespace, sys.version]
+        for path in [entry_points] + [path for path in sys.path if path]:
+            try:
+                key.append([path, os.stat(path).st_mtime])
+            except OSError:
+                continue
+
+        return key
+
+    def load_commands(self, namespace):
+        key = self.cache_key(namespace)
+        try:
+            path = os.path.join(cache.cache_dir(), 'commands.json')
+        except OSError as exc:
+            LOG.warning('cannot cache commands: %s', exc)
+            key = None
+
+        cached = cache.read_json(path) if key is not None else None
+        if cached and cached.get('key') == key:
+            self.group_list.append(namespace)
+            for name, value in cached['commands'].items():
+                self.commands[name] = EntryPoint(name, value)
+            return
+
+        LOG.debug('scanning entry points for %s', namespace)
+        super(CommandManager, self).load_commands(namespace)
+
+        if key is None:
+            return
+
+        commands = {}
+        for name, ep in self.commands.items():
+            value = getattr(ep, 'value', None)
+            if value is None:
+                # pkg_resources entry points
+                value = '{}:{}'.format(ep.module_name, '.'.join(ep.attrs))
+            commands[name] = value
+
+        try:
+            cache.write_json(path, {'key': key, 'commands': commands})
+        except (IOError, OSError) as exc:
+            LOG.warning('failed to cache commands: %s', exc)
+
 
 class App(cliff.app.App):
     '''An application that provides health checks for Openstack and other
@@ -18,9 +124,7 @@ class App(cliff.app.App):
         super(App, self).__init__(
             description='oschecks health checks',
             version=oschecks.__version__,
-            command_manager=(
-                cliff.commandmanager.CommandManager('oschecks.check')
-            ),
+            command_manager=CommandManager('oschecks.check'),
             deferred_help=True,
         )
 
@@ -1,9 +1,14 @@
 #!/usr/bin/python
 
+import copy
 import keystoneauth1
+import logging
 import os_client_config as os_client_config
+import threading
 
+import oschecks.cache as cache
 import oschecks.common as common
+import oschecks.executor as executor
 
 openstack_option_names = [
     'auth_url',
@@ -21,6 +26,7 @@ openstack_option_names = [
     'user_domain_id',
     'user_domain_name',
     'username',
+    'region_name',
     'cacert',
     'cert',
     'key'
@@ -30,18 +36,102 @@ openstack_option_defaults = {
     'default_domain_name': 'default',
 }
 
+# Options that affect how we authenticate or how the session makes
+# requests (the critical threshold sets its HTTP timeout).  Checks
+# whose values for all of these match can share an Openstack session.
+session_option_names = openstack_option_names + [
+    'cloud',
+    'verify',
+    'token_cache',
+    'token_cache_dir',
+    'http_pool_connections',
+    'http_pool_maxsize',
+    'http_keepalive',
+    'timeout_critical',
+]
+
+LOG = logging.getLogger(__name__)
+
+
+def record_response(response, *args, **kwargs):
+    '''A requests response hook that records each HTTP request
+    (including each request in a redirect chain, and each retry) as a
+    span of the check that made it.'''
+
+    url = response.url.split('?')[0]
+    common.record_span(
+        '{} {} {}'.format(response.request.method, url,
+                          response.status_code),
+        response.elapsed.total_seconds())
+
+
+def configure_transport(sess, parsed_args):
+    '''Size the HTTP connection pools of a keystoneauth1 session.  All
+    of the clients created from a session send their requests through
+    it, so in a process that runs several checks (see SessionPool)
+    connections, and their TLS handshakes, are reused between checks.
+
+    Requests time out after the check's critical threshold, by which
+    time the check has failed anyway; without this a request to an
+    endpoint that doesn't answer would keep a worker thread (and the
+    connection) busy until the kernel gives up on it.'''
+
+    requests_session = sess.session
+
+    for scheme in ('https://', 'http://'):
+        # Resize the existing adapters (rather than mounting new ones)
+        # to keep keystoneauth1's TCP keepalive and TLS settings.
+        adapter = requests_session.get_adapter(scheme)
+        adapter.poolmanager.clear()
+        adapter.init_poolmanager(parsed_args.http_pool_connections,
+                                 parsed_args.http_pool_maxsize)
+
+    if not parsed_args.http_keepalive:
+        requests_session.headers['Connection'] = 'close'
+
+    timeout = getattr(parsed_args, 'timeout_critical', None)
+    if timeout:
+        sess.timeout = float(timeout)
+
+    requests_session.hooks['response'].append(record_response)
+
 
 class Openstack(object):
     '''Loads authentication configuration using os_client_config and creates
     a keystoneauth1 session for authenticating to other services.'''
 
     def __init__(self, parsed_args):
+        self.token_cache = None
+
+        with common.span('auth'):
+            self._authenticate(parsed_args)
+
+    def _authenticate(self, parsed_args):
         try:
             cfg = (
                 os_client_config.config
                 .OpenStackConfig()
                 .get_one_cloud(argparse=parsed_args))
             sess = cfg.get_session()
+            configure_transport(sess, parsed_args)
+
+            # Plugins that cannot export their state (e.g. token or
+            # noauth plugins) are never cached.
+            if (getattr(parsed_args, 'token_cache', False) and
+                    hasattr(sess.auth, 'get_auth_state')):
+                try:
+                    self.token_cache = cache.TokenCache(
+                        cache.token_cache_key(cfg, sess.auth),
+                        directory=parsed_args.token_cache_dir)
+                    self.token_cache.load(sess)
+                except (IOError, OSError) as exc:
+                    LOG.warning('token cache unavailable: %s', exc)
+                    self.token_cache = None
+
+            # Authenticate now rather than on the first API request, so
+            # that the time spent is attributed to authentication.
+            if self.token_cache is None and hasattr(sess.auth, 'get_access'):
+                sess.auth.get_access(sess)
         except (
                 keystoneauth1.exceptions.ClientException,
                 os_client_config.exceptions.OpenStackConfigException
@@ -52,10 +142,72 @@ class Openstack(object):
         self.cfg = cfg
         self.sess = sess
 
+    def close(self):
+        '''Write back any token acquired by re-authentication.'''
+        if self.token_cache is None:
+            return
+
+        try:
+            self.token_cache.save(self.sess)
+        except (IOError, OSError) as exc:
+            LOG.warning('failed to update token cache: %s', exc)
+
+
+class SessionPool(object):
+    '''Shares Openstack objects between checks that run in the same
+    process with the same authentication options, so that they
+    authenticate once and reuse one keystoneauth1 session.'''
+
+    def __init__(self):
+        self.sessions = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, parsed_args):
+        key = tuple(getattr(parsed_args, name, None)
+                    for name in session_option_names)
+
+        # Authenticate while holding a per-key lock, so that concurrent
+        # checks wait for a session with the same credentials rather
+        # than authenticating twice, without serializing checks
+        # against different clouds.
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if key not in self.sessions:
+                self.sessions[key] = Openstack(parsed_args)
+
+            return self.sessions[key]
+
+    def close(self):
+        with self.lock:
+            for auth in self.sessions.values():
+                auth.close()
+
+
+def region_of(cfg):
+    # os-client-config calls this `region`; openstacksdk, which newer
+    # releases of os-client-config are built on, calls it
+    # `region_name`.
+    return getattr(cfg, 'region_name', getattr(cfg, 'region', None))
+
+
+def target_name(cloud, region):
+    if region:
+        return '{}/{}'.format(cloud, region)
+
+    return cloud
+
 
 class OpenstackAuthCommand(common.CheckCommand):
     '''A command that provides all the standard Keystone
-    authentication options.'''
+    authentication options.
+
+    A check that is given several clouds (with --cloud more than once,
+    --all-clouds or --all-regions) runs once for every cloud and
+    region, concurrently, and reports the most severe of their
+    results.'''
 
     def get_parser(self, prog_name):
         p = super(OpenstackAuthCommand, self).get_parser(prog_name)
@@ -68,14 +220,166 @@ class OpenstackAuthCommand(common.CheckCommand):
 
         g.add_argument('--verify', dest='verify', action='store_true')
         g.add_argument('--no-verify', dest='verify', action='store_false')
-        g.add_argument('--cloud')
+        g.add_argument('--cloud', action='append', dest='clouds',
+                       help='A cloud from clouds.yaml.  Give this more '
+                       'than once to check several clouds')
+        g.add_argument('--all-clouds', action='store_true',
+                       help='Check every cloud in clouds.yaml')
+        g.add_argument('--all-regions', action='store_true',
+                       help='Check every region of each cloud')
+        g.add_argument('--cloud-workers', type=int, default=10,
+                       help='Number of clouds to check at once')
+
+        p.set_defaults(verify=True, cloud=None)
+
+        g = p.add_argument_group('Token Cache Options')
+        g.add_argument('--token-cache-dir')
+        g.add_argument('--no-token-cache', dest='token_cache',
+                       action='store_false')
+
+        p.set_defaults(token_cache=True)
 
-        p.set_defaults(verify=True)
+        g = p.add_argument_group('HTTP Connection Options')
+        g.add_argument('--http-pool-connections', type=int, default=10,
+                       help='Number of hosts to keep connections to')
+        g.add_argument('--http-pool-maxsize', type=int, default=10,
+                       help='Number of connections to keep to each host')
+        g.add_argument('--no-http-keepalive', dest='http_keepalive',
+                       action='store_false',
+                       help='Close connections after each request')
+
+        p.set_defaults(http_keepalive=True)
 
         return p
 
+    def run(self, parsed_args):
+        try:
+            return super(OpenstackAuthCommand, self).run(parsed_args)
+        finally:
+            if getattr(self, 'auth', None) is not None:
+                self.auth.close()
+
+    def get_targets(self, parsed_args):
+        '''Return a list of (cloud, region) tuples naming each cloud the
+        check should run against.  A region of None means the cloud's
+        default region.'''
+
+        clouds = parsed_args.clouds or []
+        if not (parsed_args.all_clouds or parsed_args.all_regions):
+            return [(cloud, None) for cloud in clouds]
+
+        config = os_client_config.config.OpenStackConfig()
+        if not (parsed_args.all_clouds or clouds):
+            clouds = [config.get_one_cloud(argparse=parsed_args).name]
+
+        targets = []
+        for cfg in config.get_all_clouds():
+            if not (parsed_args.all_clouds or cfg.name in clouds):
+                continue
+
+            if parsed_args.all_regions:
+                target = (cfg.name, region_of(cfg))
+            else:
+                target = (cfg.name, None)
+
+            if target not in targets:
+                targets.append(target)
+
+        return targets
+
+    def get_result(self, parsed_args):
+        try:
+            targets = self.get_targets(parsed_args)
+        except os_client_config.exceptions.OpenStackConfigException as exc:
+            return common.Result(
+                common.RET_CRIT,
+                'Failed to load cloud configuration: {}'.format(exc))
+
+        many = parsed_args.all_clouds or parsed_args.all_regions
+        if len(targets) > 1 or many:
+            return self.get_fanout_result(parsed_args, targets)
+
+        if targets:
+            parsed_args.cloud = targets[0][0]
+
+        return super(OpenstackAuthCommand, self).get_result(parsed_args)
+
+    def check_target(self, parsed_args, cloud, region):
+        '''Run this check against a single cloud, using a new instance
+        of the command since commands keep per-check state.'''
+
+        target_args = copy.copy(parsed_args)
+        target_args.clouds = None
+        target_args.all_clouds = target_args.all_regions = False
+        target_args.cloud = cloud
+        if region is not None:
+            target_args.region_name = region
+
+        cmd = self.__class__(self.app, self.app_args, cmd_name=self.cmd_name)
+        try:
+            with common.span(target_name(cloud, region)):
+                return cmd.get_result(target_args)
+        except Exception as exc:
+            LOG.debug('%s failed on %s', self.cmd_name, cloud, exc_info=True)
+            return common.Result(common.RET_WTF,
+                                 'Check failed: {}'.format(exc))
+        finally:
+            if getattr(cmd, 'auth', None) is not None:
+                cmd.auth.close()
+
+    def get_fanout_result(self, parsed_args, targets):
+        if not targets:
+            return common.Result(common.RET_WTF, 'No clouds to check')
+
+        deadline = getattr(parsed_args, 'timeout_critical', None)
+        with executor.Executor(workers=parsed_args.cloud_workers) as pool:
+            tasks = [pool.submit(self.check_target, parsed_args,
+                                 cloud, region, timeout=deadline or None)
+                     for cloud, region in targets]
+
+            results = []
+            for task in tasks:
+                try:
+                    results.append(task.result())
+                except executor.TimeoutError:
+                    results.append(common.Result(
+                        common.RET_CRIT,
+                        'Check did not finish within {} seconds'.format(
+                            task.timeout)))
+
+        names = [target_name(cloud, region) for cloud, region in targets]
+        okay = sum(1 for result in results
+                   if result.exitcode == common.RET_OKAY)
+        msg = '{} of {} clouds OK\n{}'.format(
+            okay, len(results),
+            '\n'.join('{}: {}: {}'.format(
+                name, result.label, result.msg.partition('\n')[0])
+                for name, result in zip(names, results)))
+
+        result = common.Result(
+            common.worst_exitcode(result.exitcode for result in results),
+            msg)
+        for name, target_result in zip(names, results):
+            result.thresholds.update(target_result.thresholds)
+            for perf in target_result.perfdata:
+                perf = copy.copy(perf)
+                perf.label = '{} {}'.format(name, perf.label)
+                result.perfdata.append(perf)
+
+        return result
+
+    def get_openstack(self, parsed_args):
+        '''Return an authenticated Openstack object, from the
+        application's session pool if it has one.'''
+
+        pool = getattr(self.app, 'session_pool', None)
+        if pool is None:
+            return Openstack(parsed_args)
+
+        return pool.get(parsed_args)
+
     def take_action(self, parsed_args):
-        self.auth = Openstack(parsed_args)
+        self.auth = self.get_openstack(parsed_args)
 
 
 class OpenstackCommand(OpenstackAuthCommand,
@@ -0,0 +1,72 @@
+'''Count API resources a page at a time.
+
+Listing every server to count them builds the whole list in memory and
+takes as long as the slowest single request the API will serve.
+Instead `paginate` fetches one page at a time, following markers, and
+`count` keeps only a running total, so memory use doesn't depend on
+how many resources there are and a cap bounds the time taken:
+
+    servers = paginate(
+        lambda marker, limit: nova.servers.list(
+            detailed=False, marker=marker, limit=limit),
+        page_size=1000, limit=10001)
+    found = count(servers, cap=10000)
+
+An API that pages by itself (such as glanceclient's image generator)
+can be passed straight to `count`.'''
+
+
+class Count(object):
+    '''The number of resources counted, and whether that was all of
+    them or counting stopped at the cap.'''
+
+    def __init__(self, total, complete=True):
+        self.total = total
+        self.complete = complete
+
+    def __str__(self):
+        if self.complete:
+            return str(self.total)
+
+        return 'more than {}'.format(self.total)
+
+
+def paginate(list_page, page_size=1000, limit=None,
+             marker_of=lambda item: item.id):
+    '''Yield resources from `list_page(marker, limit)`, a page of at
+    most `page_size` at a time, passing the marker of the last
+    resource of each page to get the next.  Stops after `limit`
+    resources if that is given.  A short page is taken to be the
+    last, so `page_size` should be no larger than the maximum page
+    size the API serves.'''
+
+    marker = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+
+        item = None
+        listed = 0
+        for item in list_page(marker, size):
+            listed += 1
+            yield item
+
+        if remaining is not None:
+            remaining -= listed
+        if listed < size:
+            return
+
+        marker = marker_of(item)
+
+
+def count(items, cap=None):
+    '''Count `items` without keeping them, stopping once there are more
+    than `cap`.  Returns a Count.'''
+
+    total = 0
+    for item in items:
+        if cap is not None and total >= cap:
+            return Count(total, complete=False)
+        total += 1
+
+    return Count(total)
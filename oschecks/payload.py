@@ -0,0 +1,103 @@
+'''Test data for checks that upload and download objects.
+
+A Payload is a file-like object that generates its content as it is
+read, so checks can transfer objects of any size without holding them
+in memory.  The content is a deterministic function of the seed and
+the position in the stream, so a check can upload parts of an object
+in parallel (each as a Payload with its own offset) and later
+recompute the checksum of the whole object to verify a download.'''
+
+import binascii
+import hashlib
+import random
+
+block_size = 65536
+
+
+def make_block(seed, number):
+    '''Return block `number` of the stream identified by `seed`, as
+    pseudo-random bytes generated from both.'''
+
+    bits = random.Random('{}-{}'.format(seed, number)).getrandbits(
+        block_size * 8)
+    if hasattr(bits, 'to_bytes'):
+        return bits.to_bytes(block_size, 'big')
+
+    # Python 2 has no int.to_bytes.
+    return binascii.unhexlify('{:0{}x}'.format(bits, block_size * 2))
+
+
+class Payload(object):
+    '''`size` bytes of the stream identified by `seed`, starting at
+    `offset`.  Each block of the stream is generated separately from
+    the seed and the block number, so no two blocks are the same and
+    the data doesn't compress or deduplicate away.'''
+
+    def __init__(self, size, offset=0, seed=0):
+        self.size = size
+        self.offset = offset
+        self.seed = seed
+        self.position = 0
+        self.number = None
+        self.block = None
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        remaining = self.size - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+
+        chunks = []
+        while size > 0:
+            absolute = self.offset + self.position
+            number, start = divmod(absolute, block_size)
+            count = min(size, block_size - start)
+
+            if number != self.number:
+                self.block = make_block(self.seed, number)
+                self.number = number
+            chunks.append(self.block[start:start + count])
+
+            self.position += count
+            size -= count
+
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(block_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def seek(self, position, whence=0):
+        '''Move to `position`, relative to the start of the payload
+        (the only `whence` supported).  Clients use this to rewind
+        before retrying an upload.'''
+
+        if whence != 0:
+            raise ValueError('can only seek relative to the start')
+        self.position = position
+
+    def tell(self):
+        return self.position
+
+    def md5(self):
+        '''Return the MD5 checksum of the whole payload, generating it
+        again from the start.'''
+
+        digest = hashlib.md5()
+        for chunk in Payload(self.size, self.offset, self.seed):
+            digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def segments(self, segment_size):
+        '''Split the payload into Payloads of `segment_size` bytes (the
+        last may be shorter).'''
+
+        return [Payload(min(segment_size, self.size - start),
+                        offset=self.offset + start, seed=self.seed)
+                for start in range(0, self.size, segment_size)]
@@ -0,0 +1,190 @@
+'''Track the status of many resources with one API request per poll.
+
+A Waiter polls one resource, so a check that waits on twenty volumes
+makes twenty requests every time round.  A Poller instead lists every
+resource it is tracking with a single request, and hands out the
+statuses to everyone waiting:
+
+    poller = Poller(lambda since: cinder.volumes.list(
+        search_opts={'metadata': {'oschecks_run': run}}))
+
+    # From as many threads as there are volumes:
+    transition = poller.wait(volume.id, 'available', timeout=30)
+
+Whichever waiting thread finds a poll due makes it while the others
+wait for the result, so the number of requests per poll stays the
+same however many resources are tracked.  With `changes_since`, every
+poll after the first asks only for resources that have changed since
+the newest change seen so far (Nova's `changes-since` filter), which
+keeps the responses small as well.'''
+
+import threading
+import time
+
+import oschecks.common as common
+import oschecks.waiter as waiter
+
+
+class Poller(object):
+    '''Polls `list_resources(since)` for the status of resources.  It
+    must return resources with `id` and `status` attributes, and is
+    called with `since` set to None for a full listing, or (with
+    `changes_since`) to the newest `updated`/`updated_at` timestamp
+    seen so far.  In a full listing a resource that isn't listed is
+    given the status `missing`.
+
+    If `callback` is given it is called with every listed resource and
+    the time of the poll, so checks can record more than the status.
+    The interval between polls comes from `status_waiter` (by default
+    a waiter.Waiter), and starts again from the shortest whenever a
+    new wait begins.'''
+
+    def __init__(self, list_resources, changes_since=False,
+                 missing='deleted', callback=None, status_waiter=None):
+        self.list_resources = list_resources
+        self.changes_since = changes_since
+        self.missing = missing
+        self.callback = callback
+        self.waiter = status_waiter or waiter.Waiter()
+
+        self.changed = threading.Condition()
+        self.watching = {}
+        self.statuses = {}
+        self.since = None
+        self.full = True
+        self.seq = 0
+        self.polling = False
+        self.time_poll = None
+        self.time_next = 0
+        self.intervals = self.waiter.intervals()
+
+    def status(self, resource_id):
+        '''The last status seen for `resource_id`, or None.'''
+
+        with self.changed:
+            return self.statuses.get(resource_id)
+
+    def watch(self, resource_id):
+        self.watching[resource_id] = self.watching.get(resource_id, 0) + 1
+        if resource_id not in self.statuses:
+            # We can't tell from a list of changes whether a resource
+            # we know nothing about exists.
+            self.full = True
+
+        self.intervals = self.waiter.intervals()
+        self.time_next = 0
+
+    def unwatch(self, resource_id):
+        self.watching[resource_id] -= 1
+        if not self.watching[resource_id]:
+            del self.watching[resource_id]
+
+    def poll(self):
+        '''List the resources, with the lock released so that waiters
+        can keep looking at the previous results, and record their
+        statuses.  If the listing fails the exception is raised to
+        this waiter, and the others are woken so that one of them can
+        try again.'''
+
+        since = None
+        if self.changes_since and not self.full:
+            since = self.since
+        self.full = False
+        self.polling = True
+        self.changed.release()
+        resources = None
+        try:
+            time_poll = time.time()
+            resources = list(self.list_resources(since))
+        finally:
+            self.changed.acquire()
+            self.polling = False
+            if resources is None:
+                self.full = self.full or since is None
+            # The waiters can't look until we release the lock, by
+            # which time the results below have been recorded.
+            self.changed.notify_all()
+
+        listed = set()
+        for resource in resources:
+            listed.add(resource.id)
+            if resource.id in self.watching:
+                self.statuses[resource.id] = resource.status
+
+            updated = (getattr(resource, 'updated', None) or
+                       getattr(resource, 'updated_at', None))
+            if updated and (self.since is None or updated > self.since):
+                self.since = updated
+
+            if self.callback is not None:
+                self.callback(resource, time_poll)
+
+        if since is None:
+            for resource_id in self.watching:
+                if resource_id not in listed:
+                    self.statuses[resource_id] = self.missing
+
+        self.seq += 1
+        self.time_poll = time_poll
+        self.time_next = time.time() + next(self.intervals)
+
+    def wait(self, resource_id, status, timeout=None, failed=()):
+        '''Wait until `resource_id` reaches `status` and return a
+        waiter.Transition.  Raises waiter.StatusError if it reaches one
+        of the `failed` statuses instead, and common.TimeoutError if
+        `timeout` seconds pass first.  Safe to call from many threads
+        at once.'''
+
+        with common.span('wait for {}'.format(status)):
+            with self.changed:
+                self.watch(resource_id)
+                try:
+                    return self.wait_locked(resource_id, status, timeout,
+                                            failed)
+                finally:
+                    self.unwatch(resource_id)
+
+    def wait_locked(self, resource_id, status, timeout, failed):
+        transition = waiter.Transition(status)
+        time_start = time.time()
+        time_last = time_start
+        deadline = time_start + timeout if timeout else None
+
+        # A poll that is already under way may have started before the
+        # caller's last change, so only results after it count.
+        seen = self.seq + (1 if self.polling else 0)
+
+        while True:
+            if self.seq > seen:
+                seen = self.seq
+                current = self.statuses.get(resource_id)
+                transition.polls += 1
+
+                if (not transition.history or
+                        transition.history[-1][1] != current):
+                    transition.history.append(
+                        (self.time_poll - time_start, current))
+
+                if current == status:
+                    transition.interval = self.time_poll - time_start
+                    transition.resolution = self.time_poll - time_last
+                    return transition
+
+                if current in failed:
+                    raise waiter.StatusError(current)
+
+                time_last = self.time_poll
+
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                raise common.TimeoutError(now - time_start)
+
+            if not self.polling and now >= self.time_next:
+                self.poll()
+                continue
+
+            delay = None if self.polling else self.time_next - now
+            if deadline is not None:
+                delay = min(delay or deadline - now, deadline - now)
+
+            self.changed.wait(delay)
@@ -0,0 +1,202 @@
+import logging
+import shlex
+import yaml
+
+import oschecks.common as common
+import oschecks.executor as executor
+
+LOG = logging.getLogger(__name__)
+
+
+class ManifestError(Exception):
+    pass
+
+
+class Job(object):
+    '''A check to run: the command line that selects and configures it,
+    a name to report it under, and any other settings from the
+    manifest entry.'''
+
+    def __init__(self, argv, name=None, options=None):
+        self.argv = argv
+        self.name = name or ' '.join(argv)
+        self.options = options or {}
+
+    def __repr__(self):
+        return '<Job {}>'.format(self.name)
+
+
+def load_manifest(path):
+    '''Read a list of checks from a YAML file that looks like this:
+
+        # Arguments appended to every check (optional).
+        defaults: [--cloud, mycloud]
+
+        checks:
+          - nova api
+          - keystone service alive compute
+          - check: glance image exists cirros
+            name: cirros image
+
+    Each check is either a command line or a mapping with a `check` key
+    (a command line, either as a string or as a list of arguments) and
+    an optional `name`.  Returns a list of Job objects.'''
+
+    try:
+        with open(path) as fd:
+            manifest = yaml.safe_load(fd)
+    except (IOError, yaml.YAMLError) as exc:
+        raise ManifestError('Failed to read {}: {}'.format(path, exc))
+
+    if not isinstance(manifest, dict) or 'checks' not in manifest:
+        raise ManifestError('{}: no checks defined'.format(path))
+
+    if not isinstance(manifest['checks'], list):
+        raise ManifestError('{}: checks must be a list'.format(path))
+
+    defaults = manifest.get('defaults') or []
+    if not isinstance(defaults, list):
+        defaults = shlex.split(defaults)
+
+    jobs = []
+    for entry in manifest['checks']:
+        if not isinstance(entry, dict):
+            entry = {'check': entry}
+
+        options = dict(entry)
+        try:
+            argv = options.pop('check')
+        except KeyError:
+            raise ManifestError('{}: missing check in {}'.format(
+                path, entry))
+
+        if not isinstance(argv, list):
+            argv = shlex.split(argv)
+
+        name = options.pop('name', None) or ' '.join(argv)
+        jobs.append(Job([str(arg) for arg in argv + defaults],
+                        name=name, options=options))
+
+    return jobs
+
+
+class CheckRunner(object):
+    '''Runs check commands in-process.  Commands are looked up with the
+    application's command manager, exactly as if they had been given
+    on the command line, but results are returned as common.Result
+    objects rather than printed.'''
+
+    def __init__(self, app, app_args=None):
+        self.app = app
+        self.app_args = app_args if app_args is not None else app.options
+
+    def prepare(self, argv):
+        '''Return a (command, parsed_args) tuple for the check named
+        by `argv`.  Raises ValueError if `argv` does not name a check or
+        if its arguments are invalid.'''
+
+        cmd_factory, cmd_name, sub_argv = (
+            self.app.command_manager.find_command(argv))
+
+        if not issubclass(cmd_factory, common.CheckCommand):
+            raise ValueError('{} is not a check'.format(cmd_name))
+
+        cmd = cmd_factory(self.app, self.app_args, cmd_name=cmd_name)
+        parser = cmd.get_parser('{} {}'.format(self.app.NAME, cmd_name))
+
+        try:
+            parsed_args = parser.parse_args(sub_argv)
+        except SystemExit:
+            # argparse has already explained the problem on stderr.
+            raise ValueError('invalid arguments for {}: {}'.format(
+                cmd_name, ' '.join(sub_argv)))
+
+        return cmd, parsed_args
+
+    def check(self, cmd, parsed_args):
+        '''Run a prepared check, converting any unexpected exception
+        into an UNKNOWN result so that one broken check cannot stop
+        the others.'''
+
+        try:
+            return cmd.check(parsed_args)
+        except Exception as exc:
+            LOG.debug('%s failed', cmd.cmd_name, exc_info=True)
+            return common.Result(common.RET_WTF,
+                                 'Check failed: {}'.format(exc))
+
+    def run(self, argv):
+        try:
+            cmd, parsed_args = self.prepare(argv)
+        except ValueError as exc:
+            return common.Result(common.RET_WTF, str(exc))
+
+        return self.check(cmd, parsed_args)
+
+    def timed_out(self, task):
+        return common.Result(
+            common.RET_CRIT,
+            'Check did not finish within {} seconds'.format(task.timeout))
+
+    def run_with_deadline(self, argv, on_finished=None):
+        '''Like `run`, but a check that accepts -c/--critical runs on a
+        thread of its own and is given that many seconds to finish; if
+        it is still running after that it is reported as CRITICAL
+        without waiting for it.
+
+        `on_finished`, if given, is called once the check has returned,
+        which for a check reported as CRITICAL this way is some time
+        after this method has returned (and may be never).'''
+
+        prepared = False
+        try:
+            cmd, parsed_args = self.prepare(argv)
+            prepared = True
+        except ValueError as exc:
+            return common.Result(common.RET_WTF, str(exc))
+        finally:
+            if not prepared and on_finished is not None:
+                on_finished()
+
+        deadline = getattr(parsed_args, 'timeout_critical', None)
+        with executor.Executor(workers=1) as pool:
+            task = pool.submit(self.check, cmd, parsed_args,
+                               timeout=deadline or None)
+            if on_finished is not None:
+                task.future.add_done_callback(lambda future: on_finished())
+            try:
+                return task.result()
+            except executor.TimeoutError:
+                return self.timed_out(task)
+
+    def run_all(self, jobs, workers=1):
+        '''Run a list of jobs on up to `workers` threads and return their
+        results in the same order as the jobs.
+
+        A check that accepts -c/--critical is given that many seconds
+        to finish once it has started; if it is still running after
+        that it is reported as CRITICAL without waiting for it.'''
+
+        results = [None] * len(jobs)
+        pending = []
+
+        with executor.Executor(workers=workers) as pool:
+            for i, job in enumerate(jobs):
+                try:
+                    cmd, parsed_args = self.prepare(job.argv)
+                except ValueError as exc:
+                    results[i] = common.Result(common.RET_WTF, str(exc))
+                    continue
+
+                deadline = getattr(parsed_args, 'timeout_critical', None)
+                task = pool.submit(self.check, cmd, parsed_args,
+                                   timeout=deadline or None)
+                pending.append((i, task))
+
+            for i, task in pending:
+                try:
+                    results[i] = task.result()
+                except executor.TimeoutError:
+                    results[i] = self.timed_out(task)
+
+        return results
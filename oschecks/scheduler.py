@@ -0,0 +1,334 @@
+from __future__ import print_function
+
+import cliff.command
+import heapq
+import json
+import logging
+import random
+import signal
+import sys
+import threading
+import time
+
+import oschecks.common as common
+import oschecks.executor as executor
+import oschecks.openstack as openstack
+import oschecks.runner as runner
+
+LOG = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    '''Allows `rate` events per second on average, with bursts of up to
+    `burst` events.'''
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time_last = time.time()
+
+    def take(self, now):
+        '''Take a token if one is available and return 0, or return how
+        many seconds until one will be.'''
+
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.time_last) * self.rate)
+        self.time_last = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+class Entry(object):
+    '''A job in the schedule: how often it runs, which service it counts
+    against for rate limiting, and when it is next due.'''
+
+    def __init__(self, job, interval, service):
+        self.job = job
+        self.interval = interval
+        self.service = service
+        self.due = None
+        self.running = False
+
+
+class Scheduler(object):
+    '''Runs jobs over and over, each every `interval` seconds, keeping
+    them in a heap ordered by when they are next due.
+
+    Each job starts at a random point in its first interval, and every
+    later interval is stretched or shrunk by a random fraction of up to
+    `jitter`, so that checks don't all run at the same moment however
+    they were started, and drift apart rather than together.  At most
+    `workers` checks run at once, and checks against any one service
+    (the first word of the check, such as `nova`, unless the manifest
+    says otherwise) start at most `rate` times a second.  A job that is
+    still running when it is next due waits for its following turn.
+
+    A check that accepts -c/--critical is reported as CRITICAL once
+    it has run for that many seconds, but it still counts against
+    `workers`, and its job isn't run again, until it does finish.  When
+    stopped, the scheduler waits up to `grace` seconds for the checks
+    that are running.
+
+    `on_result(entry, result)` is called, on the worker's thread, with
+    every result.'''
+
+    def __init__(self, check_runner, jobs, on_result, interval=60,
+                 jitter=0.1, workers=4, rate=None, grace=10):
+        self.check_runner = check_runner
+        self.on_result = on_result
+        self.jitter = jitter
+        self.workers = workers
+        self.rate = rate
+        self.grace = grace
+        self.slots = threading.BoundedSemaphore(workers)
+        self.buckets = {}
+        self.stopped = threading.Event()
+
+        self.entries = []
+        for job in jobs:
+            self.entries.append(Entry(
+                job,
+                float(job.options.get('interval', interval)),
+                job.options.get('service', job.argv[0])))
+
+        self.heap = []
+        self.seq = 0
+        now = time.time()
+        for entry in self.entries:
+            self.push(entry, now + random.uniform(0, entry.interval))
+
+    def push(self, entry, due):
+        entry.due = due
+        self.seq += 1
+        heapq.heappush(self.heap, (due, self.seq, entry))
+
+    def next_interval(self, entry):
+        return entry.interval * random.uniform(1 - self.jitter,
+                                               1 + self.jitter)
+
+    def wait_until(self, when):
+        '''Sleep until `when`, and return False if stopped first.'''
+
+        return not self.stopped.wait(max(0, when - time.time()))
+
+    def run_entry(self, entry):
+        # A check reported as CRITICAL at its deadline keeps its slot,
+        # and isn't started again, until it has actually returned as
+        # well as been reported.
+        lock = threading.Lock()
+        pending = [2]
+
+        def finished():
+            with lock:
+                pending[0] -= 1
+                if pending[0]:
+                    return
+            entry.running = False
+            self.slots.release()
+
+        try:
+            result = self.check_runner.run_with_deadline(
+                entry.job.argv, on_finished=finished)
+            self.on_result(entry, result)
+        except Exception:
+            LOG.exception('failed to report result of %s', entry.job.name)
+        finally:
+            finished()
+
+    def run(self, duration=None):
+        '''Run jobs until stop() is called, or for `duration` seconds.'''
+
+        if duration is not None:
+            timer = threading.Timer(duration, self.stop)
+            timer.daemon = True
+            timer.start()
+
+        with executor.Executor(workers=self.workers) as pool:
+            try:
+                self.dispatch(pool)
+            finally:
+                self.drain()
+
+    def drain(self):
+        '''Wait (for up to `grace` seconds) for the checks that are
+        running to finish.'''
+
+        deadline = time.time() + self.grace
+        for i in range(self.workers):
+            if not self.slots.acquire(
+                    timeout=max(0, deadline - time.time())):
+                LOG.warning('not waiting for checks still running after '
+                            '%s seconds', self.grace)
+                return
+
+    def dispatch(self, pool):
+        while self.heap and self.wait_until(self.heap[0][0]):
+            due, seq, entry = heapq.heappop(self.heap)
+            now = time.time()
+
+            if entry.running:
+                LOG.warning('%s is still running, skipping a turn',
+                            entry.job.name)
+                self.push(entry, due + self.next_interval(entry))
+                continue
+
+            if self.rate:
+                bucket = self.buckets.setdefault(
+                    entry.service, TokenBucket(self.rate))
+                delay = bucket.take(now)
+                if delay:
+                    self.push(entry, now + delay)
+                    continue
+
+            # Wait for a free slot, checking now and then whether we
+            # have been stopped.
+            while not self.slots.acquire(timeout=0.1):
+                if self.stopped.is_set():
+                    return
+
+            entry.running = True
+            pool.submit(self.run_entry, entry)
+
+            # Schedule from when the job was due rather than from
+            # when it finished, so that slow checks don't make the
+            # schedule drift; if we have fallen more than a whole
+            # interval behind, skip the missed turns.
+            following = due + self.next_interval(entry)
+            if following < now:
+                following = now + self.next_interval(entry)
+            self.push(entry, following)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def nagios_command(host, description, result, now=None):
+    '''Format a result as a Nagios external command that submits it as
+    a passive service check result.'''
+
+    output = result.as_text().replace('\n', '\\n')
+    return '[{:d}] PROCESS_SERVICE_CHECK_RESULT;{};{};{:d};{}'.format(
+        int(now or time.time()), host, description, result.exitcode,
+        output)
+
+
+class ScheduleCommand(cliff.command.Command):
+    '''A command that runs the checks in a manifest periodically with
+    a Scheduler, sharing authenticated sessions like `batch`, and
+    passes every result to `report`.'''
+
+    def get_parser(self, prog_name):
+        p = super(ScheduleCommand, self).get_parser(prog_name)
+        p.add_argument('--interval', '-i', type=float, default=60,
+                       help='Run each check this often, in seconds, '
+                       'unless the manifest says otherwise')
+        p.add_argument('--jitter', type=float, default=0.1,
+                       help='Vary each interval randomly by up to this '
+                       'fraction')
+        p.add_argument('--workers', '-j', type=int, default=4,
+                       help='Maximum number of checks to run at once')
+        p.add_argument('--rate-limit', type=float,
+                       help='Start at most this many checks per second '
+                       'against any one service')
+        p.add_argument('--duration', '-d', type=float,
+                       help='Stop after this many seconds')
+        p.add_argument('manifest')
+
+        return p
+
+    def report(self, parsed_args, entry, result):
+        '''Do something with the result of a scheduled check; by default
+        it is logged.'''
+
+        LOG.info('%s: %s', entry.job.name, result.as_text())
+
+    def take_action(self, parsed_args):
+        try:
+            jobs = runner.load_manifest(parsed_args.manifest)
+        except runner.ManifestError as exc:
+            print('UNKNOWN: {}'.format(exc))
+            return common.RET_WTF
+
+        self.app.session_pool = openstack.SessionPool()
+        check_runner = runner.CheckRunner(self.app, self.app_args)
+
+        scheduler = Scheduler(
+            check_runner, jobs,
+            lambda entry, result: self.report(parsed_args, entry, result),
+            interval=parsed_args.interval, jitter=parsed_args.jitter,
+            workers=parsed_args.workers, rate=parsed_args.rate_limit)
+
+        signal.signal(signal.SIGTERM,
+                      lambda signum, frame: scheduler.stop())
+
+        LOG.info('scheduling %d checks', len(jobs))
+        try:
+            scheduler.run(duration=parsed_args.duration)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.app.session_pool.close()
+
+
+class Schedule(ScheduleCommand):
+    '''Run the checks in a manifest periodically, spreading them out in
+    time, and write their results as Nagios passive check results (or
+    JSON).  Like `batch`, the checks share authenticated sessions.
+
+    Manifest entries may set `interval` (seconds), `service` (the
+    group to rate limit the check with; by default the first word of
+    the check), and the Nagios `host` and `description` to submit the
+    result under (by default --nagios-host and the check's name).'''
+
+    def get_parser(self, prog_name):
+        p = super(Schedule, self).get_parser(prog_name)
+        p.add_argument('--output', '-o', default='-',
+                       help='Append results to this file, such as the '
+                       'Nagios command pipe (default: standard output)')
+        p.add_argument('--format', '-f', choices=['nagios', 'json'],
+                       default='nagios',
+                       help='Write Nagios external commands, or one JSON '
+                       'document per result')
+        p.add_argument('--nagios-host', default='openstack',
+                       help='Nagios host to submit results for')
+
+        return p
+
+    def write(self, parsed_args, line):
+        # Write each line in one call, so that lines from concurrent
+        # checks aren't interleaved (writes of less than PIPE_BUF bytes
+        # to a pipe are atomic).
+        with self.lock:
+            if parsed_args.output == '-':
+                sys.stdout.write(line + '\n')
+                sys.stdout.flush()
+            else:
+                with open(parsed_args.output, 'a') as fd:
+                    fd.write(line + '\n')
+
+    def report(self, parsed_args, entry, result):
+        job = entry.job
+        if parsed_args.format == 'json':
+            doc = result.as_dict()
+            doc['name'] = job.name
+            doc['time'] = time.time()
+            line = json.dumps(doc, sort_keys=True)
+        else:
+            line = nagios_command(
+                job.options.get('host', parsed_args.nagios_host),
+                job.options.get('description', job.name),
+                result)
+
+        try:
+            self.write(parsed_args, line)
+        except (IOError, OSError) as exc:
+            LOG.error('failed to write result of %s: %s', job.name, exc)
+
+    def take_action(self, parsed_args):
+        self.lock = threading.Lock()
+        return super(Schedule, self).take_action(parsed_args)
@@ -0,0 +1,118 @@
+'''Summary statistics for collections of latency samples.'''
+
+import bisect
+import math
+
+# Histogram bucket upper bounds, in seconds.  These cover everything
+# from a cached API response to a slow volume create.
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+
+
+def percentile(values, p):
+    '''Return the `p`th percentile (0 to 100) of the sorted list
+    `values`, interpolating between the closest ranks.  Returns None
+    for an empty list.'''
+
+    if not values:
+        return None
+
+    rank = (len(values) - 1) * p / 100.0
+    lower = int(math.floor(rank))
+    upper = int(math.ceil(rank))
+
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+class Summary(object):
+    '''The count, mean, minimum, maximum and a few percentiles of a set
+    of samples.'''
+
+    percentiles = (50, 90, 99)
+
+    def __init__(self, samples):
+        values = sorted(samples)
+
+        self.count = len(values)
+        self.min = values[0] if values else None
+        self.max = values[-1] if values else None
+        self.mean = sum(values) / len(values) if values else None
+        self.p = dict((p, percentile(values, p)) for p in self.percentiles)
+
+    def as_dict(self):
+        doc = {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+        }
+        for p, value in self.p.items():
+            doc['p{}'.format(p)] = value
+
+        return doc
+
+    def format(self):
+        if not self.count:
+            return 'no samples'
+
+        return ', '.join(
+            ['min {:0.4f}'.format(self.min)] +
+            ['p{} {:0.4f}'.format(p, self.p[p]) for p in self.percentiles] +
+            ['max {:0.4f} seconds'.format(self.max)])
+
+
+class Histogram(object):
+    '''Counts samples into buckets by upper bound.  The last bucket
+    (with a bound of infinity) catches everything larger than the
+    largest bound.'''
+
+    def __init__(self, bounds=default_buckets):
+        self.bounds = tuple(bounds) + (float('inf'),)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def cumulative(self):
+        '''Return (bound, number of samples <= bound) pairs.'''
+
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            yield bound, total
+
+    def as_dict(self):
+        return {
+            'buckets': [[bound, count]
+                        for bound, count in zip(self.bounds, self.counts)
+                        if not math.isinf(bound)],
+            'overflow': self.counts[-1],
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+    def format(self, width=40):
+        '''Return a list of lines drawing the histogram as a bar chart,
+        leaving out empty buckets at either end.'''
+
+        used = [i for i, count in enumerate(self.counts) if count]
+        if not used:
+            return []
+
+        largest = max(self.counts)
+        lines = []
+        for i in range(used[0], used[-1] + 1):
+            lower = self.bounds[i - 1] if i else 0
+            bar = '#' * int(round(width * self.counts[i] / float(largest)))
+            lines.append('{:>8.3f} - {:<8.3f} {:<{width}} {}'.format(
+                lower, self.bounds[i], bar, self.counts[i], width=width))
+
+        return lines
@@ -0,0 +1,99 @@
+import random
+import time
+
+import oschecks.common as common
+
+
+class StatusError(Exception):
+    '''Raised by a Waiter when the resource reaches a status from which
+    it will never reach the one we are waiting for.'''
+
+    def __init__(self, status):
+        super(StatusError, self).__init__(
+            'resource entered status {}'.format(status))
+        self.status = status
+
+
+class Transition(object):
+    '''What a Waiter saw while waiting for a resource to change status.
+
+    `interval` is the time from the start of the wait to the poll that
+    first saw the expected status.  The change happened somewhere
+    between the previous poll and that one, so `interval` overstates
+    the real transition time by at most `resolution` seconds.'''
+
+    def __init__(self, status):
+        self.status = status
+        self.interval = 0
+        self.resolution = 0
+        self.polls = 0
+        self.history = []
+
+
+class Waiter(object):
+    '''Polls a resource until it reaches a status.  Use it like this:
+
+        waiter = Waiter()
+        transition = waiter.wait(lambda: volume.get().status,
+                                 'available', timeout=10)
+
+    The first polls come quickly, so fast transitions are noticed
+    promptly, and the interval then backs off exponentially up to
+    `maximum` so slow ones don't hammer the API.  Each interval is
+    shortened by a random fraction of up to `jitter` so that many
+    checks started together don't poll in lockstep.  No sleep extends
+    past the timeout; the last poll happens at the deadline.'''
+
+    def __init__(self, initial=0.1, maximum=5, factor=2, jitter=0.25):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+
+    def intervals(self):
+        interval = self.initial
+        while True:
+            yield interval * (1 - random.uniform(0, self.jitter))
+            interval = min(interval * self.factor, self.maximum)
+
+    def wait(self, get_status, status, timeout=None, failed=()):
+        '''Call `get_status` until it returns `status` and return a
+        Transition.  Raises StatusError if `get_status` returns one of
+        the `failed` statuses and common.TimeoutError if `timeout`
+        seconds pass first.'''
+
+        with common.span('wait for {}'.format(status)):
+            return self.poll(get_status, status, timeout, failed)
+
+    def poll(self, get_status, status, timeout, failed):
+        transition = Transition(status)
+        time_start = time.time()
+        time_poll = time_start
+        deadline = time_start + timeout if timeout else None
+        intervals = self.intervals()
+
+        while True:
+            time_last, time_poll = time_poll, time.time()
+            current = get_status()
+            transition.polls += 1
+
+            if not transition.history or transition.history[-1][1] != current:
+                transition.history.append((time_poll - time_start, current))
+
+            if current == status:
+                transition.interval = time_poll - time_start
+                transition.resolution = time_poll - time_last
+                return transition
+
+            if current in failed:
+                raise StatusError(current)
+
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                raise common.TimeoutError(now - time_start)
+
+            delay = next(intervals)
+            if deadline is not None:
+                delay = min(delay, deadline - now)
+
+            time.sleep(delay)